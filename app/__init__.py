@@ -1,24 +1,58 @@
-from slackclient import SlackClient
-from app.config import BOT_TOKEN, SLACK_VERIFICATION_TOKEN, LOG_LEVEL
-from app.myslackeventsapi import MySlackEventAdapter
-from huey.contrib.minimal import MiniHuey
-
+from app.config import BOT_TOKEN, SLACK_VERIFICATION_TOKEN, LOG_LEVEL,\
+    SLACK_API_URL, SLACK_API_POOL_SIZE, EVENT_WORKERS, EVENT_QUEUE_SIZE,\
+    EVENT_OVERFLOW_POLICY, EVENT_DEDUP_TTL, EVENT_DEDUP_DB, REDIS_URL,\
+    LOG_FORMAT, LOG_QUEUE_SIZE
 import logging
+import time
+
+
+logger = logging.getLogger(name=__name__)
 
+from app.logs import setup_logging
+log_handler = setup_logging(logger, LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE)
+
+
+from app.dedup import SeenEventCache, SQLiteSeenEventCache,\
+    SharedSeenEventCache
+from app.shared import get_backend
+from app.myslackeventsapi import MySlackEventAdapter
+from app.slack_api import SlackAPIClient
+from app.workers import EventWorkerPool
 
 # slack client
-slack_client = SlackClient(BOT_TOKEN)
+slack_client = SlackAPIClient(BOT_TOKEN, base_url=SLACK_API_URL,
+                              pool_size=SLACK_API_POOL_SIZE)
 slack_events_adapter = MySlackEventAdapter(SLACK_VERIFICATION_TOKEN,
                                            "/slack/events")
 
-logger = logging.getLogger(name=__name__)
-stream_handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    "[%(asctime)s] {%(pathname)s:%(lineno)d}\n%(levelname)s - %(message)s\n")
+event_pool = EventWorkerPool(EVENT_WORKERS, EVENT_QUEUE_SIZE,
+                             EVENT_OVERFLOW_POLICY)
+
+if REDIS_URL:
+    seen_events = SharedSeenEventCache(get_backend(), ttl=EVENT_DEDUP_TTL)
+elif EVENT_DEDUP_DB:
+    seen_events = SQLiteSeenEventCache(EVENT_DEDUP_DB, ttl=EVENT_DEDUP_TTL)
+else:
+    seen_events = SeenEventCache(ttl=EVENT_DEDUP_TTL)
 
-stream_handler.setFormatter(formatter)
-logger.setLevel(LOG_LEVEL)
-logger.addHandler(stream_handler)
 
+def warm_up():
+    """
+    Load the equipment data and the fortunes now rather than on the first
+    request that needs them eg. in the gunicorn master before it forks the
+    workers
+    :return: dict of seconds each step took
+    """
+    from app.models import get_snapshot
+    from app.helpers import get_fortunes
 
-huey = MiniHuey()
+    timings = {}
+    for name, step in [("equipment", get_snapshot),
+                       ("fortunes", get_fortunes)]:
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+    logger.info("Warmed up in %.3fs (%s)", sum(timings.values()),
+                ", ".join(f"{name} {seconds:.3f}s"
+                          for name, seconds in timings.items()))
+    return timings
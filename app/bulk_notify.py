@@ -0,0 +1,497 @@
+"""
+This file contains the engine for notifying the owners of a batch of found
+equipment at once. Owners are resolved through the equipment lookups, each
+owner gets one message for all of their items and messages are sent by a
+bounded number of worker greenlets (threads outside of gevent) at no more
+than a given rate. The state of every item is recorded before its message is
+sent, so a run that stops halfway resumes without messaging anyone twice.
+With REDIS_URL set it is kept in the shared state, where runs on every
+process and dyno see it and claim each item before sending it. Otherwise it
+is checkpointed to a file.
+
+Usage:
+    $ python -m app.bulk_notify found.txt --submitter U1234567
+"""
+from app import logger
+from app.config import BULK_NOTIFY_CONCURRENCY, BULK_NOTIFY_RATE,\
+    BULK_NOTIFY_CHECKPOINT_DIR, BULK_NOTIFY_STATE_TTL
+from app.helpers import build_found_equipment_message
+from app.models import find_equipment_by_ids, get_snapshot,\
+    parse_equipment_ids
+from app.outbound import OutboundMessage, OutboundMessageQueue
+from app.shared import get_backend, is_shared, KEY_PREFIX, SharedStateError
+from collections import deque
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+# checkpoint states of an item. an item that is sending but never became
+# sent or failed may or may not have reached its owner
+SENDING, SENT, FAILED = "sending", "sent", "failed"
+
+# seconds after which the lock of a run that never released it expires. the
+# item claims still keep a later run from messaging anyone twice
+RUN_LOCK_TTL = 3600
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second on average and bursts of
+    up to `burst` calls
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a call is allowed
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter:
+    """
+    Rate limit shared by every process on every dyno. Calls are counted in
+    fixed windows in the shared state. If it is unavailable the calls of
+    this process are limited on their own.
+    """
+
+    def __init__(self, backend, name, rate):
+        """
+        :param backend: shared state backend from app.shared.get_backend
+        :param name: what is limited eg. a Slack API method
+        :param rate: calls per second allowed across every process
+        """
+        self.backend = backend
+        self.name = name
+        self.window = max(1.0, 1 / rate)
+        self.limit = int(rate * self.window)
+        self.fallback = RateLimiter(rate)
+
+    def acquire(self):
+        """
+        Wait until a call is allowed
+        """
+        while True:
+            now = time.time()
+            window = int(now / self.window)
+            try:
+                calls = self.backend.incr(
+                    f"{KEY_PREFIX}ratelimit:{self.name}:{window}",
+                    ttl=int(self.window) + 1)
+            except SharedStateError:
+                logger.exception("Failed to check the shared rate limit")
+                self.fallback.acquire()
+                return
+            if calls <= self.limit:
+                return
+            time.sleep((window + 1) * self.window - now)
+
+
+class NotificationCheckpoint:
+    """
+    Append only log of the state of each item of a bulk run, one json object
+    per line. Every line is flushed to disk before the message it describes
+    is sent or counted, so the log is never behind what actually happened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # item key -> last recorded state
+        self.states = {}
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash
+                        continue
+                    self.states[entry["key"]] = entry["state"]
+        self.file = open(path, "a")
+
+    def get(self, key):
+        return self.states.get(key)
+
+    def claim(self, keys):
+        """
+        Record items as being sent unless they are being or have been sent
+        :param keys: keys of the items to send
+        :return: list of the keys claimed
+        """
+        with self.lock:
+            claimed = [key for key in keys
+                       if self.states.get(key) not in [SENDING, SENT]]
+            self.write(claimed, SENDING)
+        return claimed
+
+    def record(self, keys, state):
+        """
+        :param keys: keys of the items to record the state of
+        :param state: one of SENDING, SENT or FAILED
+        """
+        with self.lock:
+            self.write(keys, state)
+
+    def write(self, keys, state):
+        if not keys:
+            return
+        for key in keys:
+            self.states[key] = state
+            self.file.write(json.dumps({"key": key, "state": state}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SharedNotificationState:
+    """
+    State of the items notified in bulk kept in the shared state, with the
+    same interface as NotificationCheckpoint. Every run on every process and
+    dyno sees it and it outlives restarts. An item is claimed with a set if
+    absent before its owner is messaged, so only one run sends it, however
+    the id lists of the runs overlap. Failed items are forgotten so a later
+    run retries them.
+    """
+
+    def __init__(self, backend, ttl=BULK_NOTIFY_STATE_TTL):
+        """
+        :param backend: shared state backend from app.shared.get_backend
+        :param ttl: seconds an item is remembered
+        """
+        self.backend = backend
+        self.ttl = ttl
+
+    def state_key(self, key):
+        return f"{KEY_PREFIX}bulk_notify:item:{key}"
+
+    def get(self, key):
+        state = self.backend.get(self.state_key(key))
+        return state.decode("utf-8") if state is not None else None
+
+    def claim(self, keys):
+        """
+        :param keys: keys of the items to send
+        :return: list of the keys no other run has claimed
+        """
+        return [key for key in keys
+                if self.backend.set(self.state_key(key),
+                                    SENDING.encode("utf-8"), ttl=self.ttl,
+                                    only_if_absent=True)]
+
+    def record(self, keys, state):
+        """
+        :param keys: keys of claimed items
+        :param state: SENT or FAILED
+        """
+        for key in keys:
+            if state == FAILED:
+                self.backend.delete(self.state_key(key))
+            else:
+                self.backend.set(self.state_key(key), state.encode("utf-8"),
+                                 ttl=self.ttl)
+
+    def close(self):
+        pass
+
+
+def item_key(equipment_type, equipment):
+    return f"{equipment_type}:{equipment['equipment_id']}:"\
+        f"{equipment['owner_slack_id']}"
+
+
+def run_key(equipment_ids):
+    """
+    :return: key of a run for a list of ids, the same whatever their order
+    and however often an id is repeated
+    """
+    digest = hashlib.sha1("\n".join(sorted(set(equipment_ids)))
+                          .encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def default_checkpoint_path(equipment_ids):
+    """
+    :return: checkpoint file for a list of ids. Running the same list again
+    resumes the earlier run.
+    """
+    return os.path.join(BULK_NOTIFY_CHECKPOINT_DIR,
+                        f"sakabot-bulk-notify-{run_key(equipment_ids)}.jsonl")
+
+
+def open_notification_state(equipment_ids):
+    """
+    :return: SharedNotificationState when the state is shared, otherwise the
+    NotificationCheckpoint of the list of ids
+    """
+    if is_shared():
+        return SharedNotificationState(get_backend())
+    return NotificationCheckpoint(default_checkpoint_path(equipment_ids))
+
+
+def acquire_run_lock(equipment_ids):
+    """
+    Take the lock of a run across every process and dyno. Always succeeds
+    when the state isn't shared.
+    :return: False if another process is running the same ids
+    """
+    if not is_shared():
+        return True
+    return get_backend().set(
+        f"{KEY_PREFIX}bulk_notify:run:{run_key(equipment_ids)}", b"1",
+        ttl=RUN_LOCK_TTL, only_if_absent=True)
+
+
+def release_run_lock(equipment_ids):
+    if is_shared():
+        get_backend().delete(
+            f"{KEY_PREFIX}bulk_notify:run:{run_key(equipment_ids)}")
+
+
+class BulkNotifier:
+    """
+    Notifies the owners of a list of found equipment
+    """
+
+    def __init__(self, outbound, submitter, checkpoint,
+                 concurrency=BULK_NOTIFY_CONCURRENCY, rate=BULK_NOTIFY_RATE):
+        """
+        :param outbound: OutboundMessageQueue to send messages with. Rate
+        limited and failed calls are retried by it
+        :param submitter: slack id of the user who found the equipment
+        :param checkpoint: NotificationCheckpoint or SharedNotificationState
+        of the run
+        :param concurrency: number of owners messaged at once
+        :param rate: maximum messages per second
+        """
+        self.outbound = outbound
+        self.submitter = submitter
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        # every bulk run shares Slack's rate limit
+        self.limiter = SharedRateLimiter(get_backend(), "chat.postMessage",
+                                         rate) if is_shared() else\
+            RateLimiter(rate)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, outcome, amount=1):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + amount
+
+    def plan(self, equipment_ids, snapshot=None):
+        """
+        Resolve the owners of the equipment and leave out items the
+        checkpoint has already seen
+        :param equipment_ids: list of equipment ids
+        :param snapshot: <optional> equipment snapshot to search
+        :return: list of tuples of owner slack id and their list of tuples of
+        equipment type and equipment, in the order the ids were given
+        """
+        owners = {}
+        for equipment_id, (equipment_type, equipment_list) in\
+                find_equipment_by_ids(equipment_ids, snapshot).items():
+            if not equipment_list:
+                self.count("not_found")
+                logger.warning("No equipment found for %s", equipment_id)
+            for equipment in equipment_list:
+                if not equipment.get("owner_slack_id"):
+                    self.count("no_owner")
+                    continue
+                state = self.checkpoint.get(item_key(equipment_type,
+                                                     equipment))
+                if state == SENT:
+                    self.count("already_sent")
+                elif state == SENDING:
+                    # the run stopped while sending this one. it is left out
+                    # rather than risk messaging the owner twice
+                    self.count("unknown")
+                    logger.warning("%s may already have been sent. Skipping"
+                                   " it.", equipment_id)
+                else:
+                    owners.setdefault(equipment["owner_slack_id"], [])\
+                        .append((equipment_type, equipment))
+        return list(owners.items())
+
+    def notify(self, owner_slack_id, found):
+        keys = [item_key(equipment_type, equipment)
+                for equipment_type, equipment in found]
+        self.limiter.acquire()
+        claimed = set(self.checkpoint.claim(keys))
+        for key in keys:
+            if key not in claimed:
+                # another run got to it since the plan was made
+                self.count("already_sent" if self.checkpoint.get(key) == SENT
+                           else "unknown")
+        found = [item for item, key in zip(found, keys) if key in claimed]
+        keys = [key for key in keys if key in claimed]
+        if not found:
+            return
+        slack_response = self.outbound.send(OutboundMessage(
+            "chat.postMessage", owner_slack_id,
+            build_found_equipment_message(owner_slack_id, self.submitter,
+                                          found),
+            as_user=True))
+        if slack_response.get("ok"):
+            self.checkpoint.record(keys, SENT)
+            self.count("sent", len(keys))
+        else:
+            self.checkpoint.record(keys, FAILED)
+            self.count("failed", len(keys))
+
+    def run(self, equipment_ids, snapshot=None):
+        """
+        Notify the owners of the equipment
+        :param equipment_ids: list of equipment ids
+        :param snapshot: <optional> equipment snapshot to search
+        :return: dict of counts of items by outcome: sent, failed,
+        already_sent, unknown (may have been sent by a run that stopped),
+        no_owner and not_found (ids)
+        """
+        snapshot = snapshot or get_snapshot()
+        start = time.monotonic()
+        jobs = deque(self.plan(equipment_ids, snapshot))
+        owner_count = len(jobs)
+
+        def work():
+            while True:
+                try:
+                    owner_slack_id, found = jobs.popleft()
+                except IndexError:
+                    return
+                try:
+                    self.notify(owner_slack_id, found)
+                except Exception:
+                    logger.exception("Failed to notify %s", owner_slack_id)
+                    self.count("failed", len(found))
+
+        workers = [threading.Thread(target=work, daemon=True,
+                                    name=f"bulk-notify-{i}")
+                   for i in range(min(self.concurrency, owner_count))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        logger.info("Notified %s owners in %.1fs. %s", owner_count,
+                    time.monotonic() - start, self.counts)
+        return dict(self.counts)
+
+
+def format_summary(counts):
+    return ", ".join(f"{count} {outcome.replace('_', ' ')}"
+                     for outcome, count in sorted(counts.items())) or\
+        "nothing to do"
+
+
+# keys of the runs in progress in this process
+running = set()
+running_lock = threading.Lock()
+
+
+def start_bulk_notify(equipment_ids, submitter, client):
+    """
+    Notify the owners of the equipment in the background and send the
+    submitter a summary when done
+    :param equipment_ids: list of equipment ids
+    :param submitter: slack id of the user who found the equipment
+    :param client: SlackAPIClient to send messages with
+    :return: False if a run for the same ids is already in progress on any
+    process
+    """
+    key = run_key(equipment_ids)
+    with running_lock:
+        if key in running:
+            return False
+        running.add(key)
+    try:
+        locked = acquire_run_lock(equipment_ids)
+    except SharedStateError:
+        logger.exception("Failed to lock the bulk notification run")
+        locked = False
+    if not locked:
+        with running_lock:
+            running.discard(key)
+        return False
+
+    def run():
+        outbound = OutboundMessageQueue(client)
+        checkpoint = open_notification_state(equipment_ids)
+        try:
+            counts = BulkNotifier(outbound, submitter, checkpoint)\
+                .run(equipment_ids)
+            outbound.send(OutboundMessage(
+                "chat.postMessage", submitter,
+                f"Done notifying owners: {format_summary(counts)}.",
+                as_user=True))
+        except Exception:
+            logger.exception("Bulk notification failed")
+        finally:
+            checkpoint.close()
+            try:
+                release_run_lock(equipment_ids)
+            except SharedStateError:
+                logger.exception("Failed to unlock the bulk notification "
+                                 "run")
+            with running_lock:
+                running.discard(key)
+
+    threading.Thread(target=run, daemon=True, name="bulk-notify").start()
+    return True
+
+
+if __name__ == "__main__":
+    from app import slack_client
+
+    parser = argparse.ArgumentParser(
+        description="Notify the owners of found equipment")
+    parser.add_argument("ids_file",
+                        help="file of equipment ids separated by spaces, "
+                        "commas or new lines")
+    parser.add_argument("--submitter", required=True,
+                        help="slack id of the user who has the equipment")
+    parser.add_argument("--checkpoint",
+                        help="progress file, defaults to the shared state "
+                        "with REDIS_URL set or one named after the ids in "
+                        "BULK_NOTIFY_CHECKPOINT_DIR")
+    parser.add_argument("--concurrency", type=int,
+                        default=BULK_NOTIFY_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=BULK_NOTIFY_RATE,
+                        help="max messages per second")
+    args = parser.parse_args()
+
+    with open(args.ids_file) as ids_file:
+        equipment_ids = parse_equipment_ids(ids_file.read())
+    if not acquire_run_lock(equipment_ids):
+        parser.exit(1, "The owners of those ids are already being "
+                    "notified\n")
+    checkpoint = NotificationCheckpoint(args.checkpoint) if args.checkpoint\
+        else open_notification_state(equipment_ids)
+    try:
+        counts = BulkNotifier(OutboundMessageQueue(slack_client),
+                              args.submitter, checkpoint, args.concurrency,
+                              args.rate).run(equipment_ids)
+    finally:
+        checkpoint.close()
+        release_run_lock(equipment_ids)
+    print(format_summary(counts))
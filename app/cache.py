@@ -0,0 +1,90 @@
+"""
+This file contains the cache of replies to equipment searches. Replies are
+only valid for the equipment dataset they were built from so the cache is
+cleared whenever it sees a new dataset version.
+"""
+from app.metrics import Counter
+from collections import OrderedDict
+import threading
+import time
+
+QUERY_CACHE_REQUESTS = Counter("sakabot_query_cache_requests_total",
+                               "Search reply cache lookups", ["result"])
+
+
+class QueryCache:
+    """
+    LRU cache of at most max_size entries that expire after ttl seconds,
+    tied to one equipment dataset version
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.version = None
+        # key -> (expiry time, value), least recently used first
+        self.entries = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.invalidation_count = 0
+
+    def get(self, key, version):
+        """
+        :param key: hashable query key
+        :param version: dataset version the caller is searching
+        :return: the cached value or None
+        """
+        now = time.monotonic()
+        with self.lock:
+            if version != self.version:
+                self.invalidate(version)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hit_count += 1
+                hit = True
+            else:
+                self.miss_count += 1
+                hit = False
+        QUERY_CACHE_REQUESTS.inc("hit" if hit else "miss")
+        return entry[1] if hit else None
+
+    def set(self, key, version, value):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            if version != self.version:
+                self.invalidate(version)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.eviction_count += 1
+
+    def invalidate(self, version):
+        """
+        Drop every entry and start caching for another dataset version. Call
+        with the lock held.
+        """
+        if self.entries:
+            self.invalidation_count += 1
+        self.entries.clear()
+        self.version = version
+
+    def stats(self):
+        """
+        :return: dict of size, hit, miss and eviction counts and the hit rate
+        """
+        with self.lock:
+            lookups = self.hit_count + self.miss_count
+            return {
+                "size": len(self.entries),
+                "version": self.version,
+                "hits": self.hit_count,
+                "misses": self.miss_count,
+                "hit_rate": self.hit_count / lookups if lookups else 0,
+                "evictions": self.eviction_count,
+                "invalidations": self.invalidation_count,
+            }
@@ -1,8 +1,53 @@
 import os
+import tempfile
 HOME_DIR = os.path.dirname(os.path.abspath(__file__))
 # slack bot token
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# slack web api url and max number of open connections to it per worker
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+SLACK_API_POOL_SIZE = int(os.getenv("SLACK_API_POOL_SIZE", 10))
 ASSET_SPREADSHEET_KEY = os.getenv('ASSET_SPREADSHEET_KEY')
 SLACK_VERIFICATION_TOKEN = os.getenv("SLACK_VERIFICATION_TOKEN")
 ADMIN_SLACK_ID = os.getenv("ADMIN_SLACK_ID")
 LOG_LEVEL = os.getenv("LOG_LEVEL")
+# json for one json object per log record or text, the fraction of the per
+# event logs to keep and the max records waiting to be written
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_EVENT_SAMPLE_RATE = float(os.getenv("LOG_EVENT_SAMPLE_RATE", 1))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# equipment data file and how often (in seconds) to check it for changes.
+# set the interval to 0 to disable reloading
+EQUIPMENT_FILE = os.getenv("EQUIPMENT_FILE",
+                           os.path.join(HOME_DIR, "utils", "equipment.json"))
+EQUIPMENT_RELOAD_INTERVAL = float(os.getenv("EQUIPMENT_RELOAD_INTERVAL", 30))
+# event worker pool size, queue size and what to do with events that arrive
+# when the queue is full: drop, shed (drop the oldest) or reject (HTTP 503)
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", 16))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 200))
+EVENT_OVERFLOW_POLICY = os.getenv("EVENT_OVERFLOW_POLICY", "reject")
+# seconds to remember slack event ids for to drop redelivered events and an
+# optional SQLite file to share them between the workers on a machine
+EVENT_DEDUP_TTL = int(os.getenv("EVENT_DEDUP_TTL", 600))
+EVENT_DEDUP_DB = os.getenv("EVENT_DEDUP_DB")
+# max number of search replies to cache per worker and seconds to keep them
+# for. set either to 0 to disable the cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 300))
+# optional redis server shared by every process on every dyno. it holds the
+# equipment dataset, seen event ids and rate limits so they're consistent
+# across dynos. without it each process keeps its own
+REDIS_URL = os.getenv("REDIS_URL")
+# owners messaged at once and messages per second when notifying owners in
+# bulk, and where to keep the progress of bulk runs so they can resume
+BULK_NOTIFY_CONCURRENCY = int(os.getenv("BULK_NOTIFY_CONCURRENCY", 4))
+BULK_NOTIFY_RATE = float(os.getenv("BULK_NOTIFY_RATE", 1))
+BULK_NOTIFY_CHECKPOINT_DIR = os.getenv("BULK_NOTIFY_CHECKPOINT_DIR",
+                                       tempfile.gettempdir())
+# seconds an item notified in bulk is remembered in the shared state so its
+# owner isn't messaged about it again
+BULK_NOTIFY_STATE_TTL = int(os.getenv("BULK_NOTIFY_STATE_TTL", 7 * 24 * 3600))
+# every process writes its metrics to this directory (or to REDIS_URL) every
+# METRICS_FLUSH_INTERVAL seconds so /metrics can add up those of every worker
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(),
+                                                    "sakabot-metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
@@ -1,10 +1,18 @@
 """
 This file contains controllers which process events we receive through the bot.
 """
-from app.models import find_equipment_by_id, find_equipment_by_owner_id
+from app.models import find_equipment_by_id_in_all_stores,\
+    find_equipment_by_owner_id, find_equipment_by_owner_name, get_snapshot,\
+    suggest_equipment_ids, name_tokens, find_equipment_by_ids,\
+    parse_equipment_ids, find_owner_name
+from app.outbound import MAX_ATTACHMENTS
+from app.bulk_notify import start_bulk_notify
+from app import slack_client
 from app.helpers import build_search_equipment_attachment,\
     generate_random_hex_color, generate_random_fortune
-from app.config import ADMIN_SLACK_ID
+from app.cache import QueryCache
+from app.config import ADMIN_SLACK_ID, QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+from app.metrics import STAGE_LATENCY, RESPONSES
 import re
 
 EQUIPMENT_TYPE_CANONICAL_NAME = {}
@@ -16,6 +24,16 @@ EQUIPMENT_TYPE_CANONICAL_NAME["tb"] = EQUIPMENT_TYPE_CANONICAL_NAME[
     "thunderbolt"] = EQUIPMENT_TYPE_CANONICAL_NAME["thunder"] = "thunderbolts"
 EQUIPMENT_TYPE_CANONICAL_NAME["dongle"] = "dongles"
 
+# an equipment id in a list of them eg. TB/0051 or tb0051
+BATCH_EQUIPMENT_ID = r"\w+\/[^\s,]+|[a-z]+\d+[^\s,]*"
+# words that may end in an owner's name eg. john doe or mary o'neil. the first
+# word has at least two letters. only the words that are in owner names are
+# taken as the name, see MessageHandler.owner_name_groups
+OWNER_NAME = r"[a-z][a-z.'-]+?(?:[ ]+[a-z][a-z.'-]*?)*?"
+# most ids and found equipment a batch search replies with
+MAX_BATCH_IDS = 50
+MAX_BATCH_ATTACHMENTS = 5 * MAX_ATTACHMENTS
+
 
 class MessageHandler:
     """
@@ -27,13 +45,20 @@ class MessageHandler:
     def __init__(self):
         self.responses = {
             "^hello$|^hi$|^hey$|^aloha$|^bonjour$": self.hello_reply,
+            "^notify\sowners?\s([\s\S]+)$": self.bulk_notify_reply,
             "(?:find|get|search|retrieve)\s(<@.*>.*?|my|me)\s(mac|tmac|macbook|charger|charge|procharger|tb|thunderbolt|thunder|dongle)": self.search_equipment_by_owner_reply,
-            "(?:find|get|search|retrieve)\s(\w+\/.*)": self.search_equipment_reply,
+            f"(?:find|get|search|retrieve)\s({OWNER_NAME})(?:'s)?\s(mac|tmac|macbook|charger|charge|procharger|tb|thunderbolt|thunder|dongle)": self.search_equipment_by_owner_name_reply,
+            f"(?:find|get|search|retrieve)\s((?:{BATCH_EQUIPMENT_ID})(?:[\s,]+(?:{BATCH_EQUIPMENT_ID}))+)": self.search_equipment_batch_reply,
+            "(?:find|get|search|retrieve)\s(\w+\s?\/.*|[a-z]+\s?\d+\S*)": self.search_equipment_reply,
             "love": self.love_reply,
             "thanks|thank": self.gratitude_reply,
             "help": self.help_reply,
             "fortune": self.fortune_reply,
         }
+        self.dispatcher = MessageDispatcher(self.responses, guards={
+            self.search_equipment_by_owner_name_reply:
+                self.owner_name_groups})
+        self.cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
 
     def respond_to(self, message):
         """
@@ -42,16 +67,15 @@ class MessageHandler:
         :param message: slack event message
         :return: HTTP response on success or failure
         """
-        found_match = False
-        for pattern in self.responses:
-            handler = self.responses[pattern]
-            match = re.compile(pattern, re.IGNORECASE).search(message["text"])
-            if match:
-                found_match = True
-                break
-        if found_match:
-            return handler(message, *match.groups())
-        return self.default_reply(message)
+        with STAGE_LATENCY.time("dispatch"):
+            match = self.dispatcher.match(message["text"])
+        if match:
+            handler, groups = match
+            response = handler(message, *groups)
+        else:
+            response = self.default_reply(message)
+        RESPONSES.inc(response.response_type)
+        return response
 
     def hello_reply(self, message):
         return Response(f"Hello <@{message['user']}>! :tada:. I'm here to "
@@ -62,33 +86,112 @@ class MessageHandler:
 
     def search_equipment_reply(self, message, equipment_id):
         equipment_id = equipment_id.upper().strip()
-        equipment_list = None
 
         # search
-        for equipment_store in ["dongles", "chargers", "macbooks",
-                                "thunderbolts"]:
-            equipment_list = find_equipment_by_id(
-                equipment_id, equipment_store)
-            if equipment_list:
-                break
-
-        # build response
-        if not equipment_list:
-            return Response("Sorry. I did not find any equipment by that "
-                            "id :slightly_frowning_face:",
-                            "RESPONSE_SEARCH_EQUIPMENT")
+        snapshot = get_snapshot()
+        with STAGE_LATENCY.time("lookup"):
+            equipment_store, equipment_list =\
+                find_equipment_by_id_in_all_stores(equipment_id, snapshot)
+
+        # the reply only depends on the requester when they own one of the
+        # items since theirs don't get a notify_owner button
+        requester = message["user"]
+        if not any(equipment.get("owner_slack_id") == requester
+                   for equipment in equipment_list):
+            requester = None
+        cache_key = ("id", equipment_id, requester)
+        cached = self.cache.get(cache_key, snapshot.version)
+        if cached is not None:
+            return cached.copy()
+
+        if equipment_list:
+            response = self.build_search_equipment_response(
+                message, equipment_store, equipment_list, snapshot.version)
+        else:
+            response = self.build_equipment_suggestions_response(
+                suggest_equipment_ids(equipment_id, snapshot=snapshot))
+        self.cache.set(cache_key, snapshot.version, response)
+        return response.copy()
+
+    def search_equipment_batch_reply(self, message, equipment_ids):
+        equipment_ids = parse_equipment_ids(equipment_ids)
+        id_count = len(equipment_ids)
+        skipped = id_count - MAX_BATCH_IDS
+        equipment_ids = equipment_ids[:MAX_BATCH_IDS]
+
+        snapshot = get_snapshot()
+        with STAGE_LATENCY.time("lookup"):
+            results = find_equipment_by_ids(equipment_ids, snapshot)
+
+        requester = message["user"]
+        if not any(equipment.get("owner_slack_id") == requester
+                   for _, equipment_list in results.values()
+                   for equipment in equipment_list):
+            requester = None
+        # the reply tells how many ids were left out
+        cache_key = ("ids", tuple(equipment_ids), id_count, requester)
+        cached = self.cache.get(cache_key, snapshot.version)
+        if cached is not None:
+            return cached.copy()
+
+        attachments = []
+        missing = []
+        for equipment_id in equipment_ids:
+            equipment_store, equipment_list = results[equipment_id]
+            if not equipment_list:
+                missing.append(equipment_id)
+            for equipment in equipment_list:
+                attachments.append(build_search_equipment_attachment(
+                    equipment, equipment_store,
+                    equipment.get("owner_slack_id") != message["user"],
+                    snapshot.version))
+
+        found = len(equipment_ids) - len(missing)
+        text = f"Found {found} of the {len(equipment_ids)} ids."
+        if skipped > 0:
+            text += f" I only searched for the first {MAX_BATCH_IDS}, send"\
+                f" the other {skipped} in another message."
+        if len(attachments) > MAX_BATCH_ATTACHMENTS:
+            text += f" Showing {MAX_BATCH_ATTACHMENTS} of "\
+                f"{len(attachments)} results."
+            attachments = attachments[:MAX_BATCH_ATTACHMENTS]
+        if missing:
+            not_found = []
+            for equipment_id in missing:
+                suggestions = suggest_equipment_ids(equipment_id, 1,
+                                                    snapshot)
+                not_found.append(
+                    f"`{equipment_id}`" + (f" (did you mean "
+                                           f"`{suggestions[0]}`?)"
+                                           if suggestions else ""))
+            text += " Nothing found for " + ", ".join(not_found) + "."
+        response = Response(text, "RESPONSE_SEARCH_EQUIPMENT",
+                            attachments=attachments)
+        self.cache.set(cache_key, snapshot.version, response)
+        return response.copy()
+
+    def build_equipment_suggestions_response(self, suggestions):
+        text = "Sorry. I did not find any equipment by that id "\
+            ":slightly_frowning_face:"
+        if suggestions:
+            text += " Did you mean " + ", ".join(
+                f"`{equipment_id}`" for equipment_id in suggestions) + "?"
+        return Response(text, "RESPONSE_SEARCH_EQUIPMENT")
 
+    def build_search_equipment_response(self, message, equipment_store,
+                                        equipment_list, dataset_version):
         attachments = []
         for equipment in equipment_list:
             """
             Add the notify_owner button if the equipmnet doesn't belong to
             the current requesting user
             """
-            add_notify_owner_btn = not (equipment["owner_slack_id"] ==
+            add_notify_owner_btn = not (equipment.get("owner_slack_id") ==
                                         message["user"])
             attachments.append(
                 build_search_equipment_attachment(equipment, equipment_store,
-                                                  add_notify_owner_btn))
+                                                  add_notify_owner_btn,
+                                                  dataset_version))
         return Response("", "RESPONSE_SEARCH_EQUIPMENT",
                         attachments=attachments)
 
@@ -101,18 +204,95 @@ class MessageHandler:
             owner_id = owner_id[owner_id.index("<@") + 2: owner_id.index(">")]
         equipment_type = EQUIPMENT_TYPE_CANONICAL_NAME[equipment_type]
 
-        equipment_list = find_equipment_by_owner_id(owner_id, equipment_type)
+        snapshot = get_snapshot()
+        cache_key = ("owner", owner_id, equipment_type)
+        cached = self.cache.get(cache_key, snapshot.version)
+        if cached is not None:
+            return cached.copy()
+
+        with STAGE_LATENCY.time("lookup"):
+            equipment_list = find_equipment_by_owner_id(
+                owner_id, equipment_type, snapshot)
         if not equipment_list:
-            return Response(f"Sorry. I did not find any {equipment_type}"
-                            f" belonging to <@{owner_id}> "
-                            ":slightly_frowning_face:",
-                            "RESPONSE_SEARCH_EQUIPMENT")
-        attachments = [build_search_equipment_attachment(equipment,
-                                                         equipment_type)
-                       for equipment in equipment_list]
+            response = Response(f"Sorry. I did not find any {equipment_type}"
+                                f" belonging to <@{owner_id}> "
+                                ":slightly_frowning_face:",
+                                "RESPONSE_SEARCH_EQUIPMENT")
+        else:
+            attachments = [build_search_equipment_attachment(equipment,
+                                                             equipment_type)
+                           for equipment in equipment_list]
+            response = Response("", "RESPONSE_SEARCH_EQUIPMENT",
+                                attachments=attachments)
+        self.cache.set(cache_key, snapshot.version, response)
+        return response.copy()
 
-        return Response("", "RESPONSE_SEARCH_EQUIPMENT",
-                        attachments=attachments)
+    def owner_name_groups(self, owner_name, equipment_type):
+        """
+        Take the words before the equipment type that are in owner names as
+        the name, so "search for jane roe charger" is a search for jane roe
+        and "retrieve lost dongle" isn't a search for someone named lost
+        :return: groups to call search_equipment_by_owner_name_reply with or
+        None if the message isn't a name search
+        """
+        owner_name = find_owner_name(owner_name)
+        return (owner_name, equipment_type) if owner_name else None
+
+    def search_equipment_by_owner_name_reply(self, message, owner_name,
+                                             equipment_type):
+        equipment_type = EQUIPMENT_TYPE_CANONICAL_NAME[equipment_type]
+        snapshot = get_snapshot()
+        with STAGE_LATENCY.time("lookup"):
+            owners = find_equipment_by_owner_name(owner_name, equipment_type,
+                                                  snapshot)
+        equipment_list = [equipment for _, owner_equipment in owners
+                          for equipment in owner_equipment]
+
+        requester = message["user"]
+        if not any(equipment.get("owner_slack_id") == requester
+                   for equipment in equipment_list[:MAX_ATTACHMENTS]):
+            requester = None
+        cache_key = ("name", " ".join(sorted(name_tokens(owner_name))),
+                     equipment_type, requester)
+        cached = self.cache.get(cache_key, snapshot.version)
+        if cached is not None:
+            return cached.copy()
+
+        if not equipment_list:
+            response = Response(f"Sorry. I did not find any {equipment_type}"
+                                f" belonging to someone named {owner_name} "
+                                ":slightly_frowning_face:",
+                                "RESPONSE_SEARCH_EQUIPMENT")
+        else:
+            text = ""
+            if len(equipment_list) > MAX_ATTACHMENTS:
+                text = f"Showing {MAX_ATTACHMENTS} of "\
+                    f"{len(equipment_list)} {equipment_type} belonging to "\
+                    f"{len(owners)} people. Try their full name."
+            attachments = [
+                build_search_equipment_attachment(
+                    equipment, equipment_type,
+                    equipment.get("owner_slack_id") != message["user"],
+                    snapshot.version)
+                for equipment in equipment_list[:MAX_ATTACHMENTS]]
+            response = Response(text, "RESPONSE_SEARCH_EQUIPMENT",
+                                attachments=attachments)
+        self.cache.set(cache_key, snapshot.version, response)
+        return response.copy()
+
+    def bulk_notify_reply(self, message, equipment_ids):
+        if message["user"] != ADMIN_SLACK_ID:
+            return Response(f"Sorry. Only <@{ADMIN_SLACK_ID}> can notify "
+                            "owners in bulk.", "RESPONSE_BULK_NOTIFY")
+        equipment_ids = parse_equipment_ids(equipment_ids)
+        if not start_bulk_notify(equipment_ids, message["user"],
+                                 slack_client):
+            return Response("I'm already notifying the owners of those. "
+                            "I'll message you when I'm done.",
+                            "RESPONSE_BULK_NOTIFY")
+        return Response(f"Notifying the owners of {len(equipment_ids)} "
+                        "items. I'll message you when I'm done.",
+                        "RESPONSE_BULK_NOTIFY")
 
     def love_reply(self, message):
         return Response("OK, what do you need?", "RESPONSE_LOVE")
@@ -132,16 +312,17 @@ class MessageHandler:
                 "title": "Searching for an item's owner",
                 "text": "You can search for an item's owner by "
                 "sending _find <item_id>_.\n\n eg. "
-                "`find AND/DONGLE/123`\n"
+                "`find AND/DONGLE/123`. Send several ids to search for "
+                "all of them at once eg. `find TB/0051 AND/DONGLE/123`\n"
                 "Note: For channel requests, you have to mention me in the "
                 "message"
             },
             {
                 "title": "Check the ownership information of an item",
                 "text": "Check ownership information for an item by sending \n"
-                "_find < @mention|my > <mac|charger|dongle|thunderbolt>_ "
-                "\n\n eg. `find my dongle` or "
-                "`find @johndoe thunderbolt`\n"
+                "_find < @mention|my|name > <mac|charger|dongle|thunderbolt>_ "
+                "\n\n eg. `find my dongle`, "
+                "`find @johndoe thunderbolt` or `find john doe charger`\n"
                 "Note: For channel requests, you have to mention me in the "
                 "message"
             },
@@ -169,6 +350,97 @@ class MessageHandler:
                         " Try requesting `help`.", "RESPONSE_DEFAULT")
 
 
+class MessageDispatcher:
+    """
+    Matches a message against an ordered mapping of regex patterns to
+    handlers. The patterns are compiled once, both on their own and into one
+    alternation, so most messages are routed with a single regex search.
+
+    The alternation finds the leftmost match. Patterns listed before the one
+    that matched are then only retried on the rest of the message, which
+    keeps the priority of trying the patterns one by one.
+
+    A handler can have a guard that looks at the groups its pattern captured
+    and turns the message down, in which case the patterns are tried one by
+    one without it.
+    """
+
+    def __init__(self, responses, flags=re.IGNORECASE, guards=None):
+        """
+        :param responses: ordered dict of regex pattern -> handler
+        :param flags: regex flags
+        :param guards: <optional> dict of handler -> function taking the
+        groups its pattern captured and returning the groups to call it with
+        or None to try the patterns after it
+        """
+        self.guards = guards or {}
+        self.patterns = []
+        # index of a pattern's wrapping group -> index of the pattern
+        self.pattern_index = {}
+        alternatives = []
+        group_index = 1
+        for index, (pattern, handler) in enumerate(responses.items()):
+            regex = re.compile(pattern, flags)
+            self.patterns.append((regex, handler))
+            self.pattern_index[group_index] = index
+            alternatives.append(f"({pattern})")
+            group_index += regex.groups + 1
+        self.regex = re.compile("|".join(alternatives), flags)
+
+    def match(self, text):
+        """
+        Find the handler for a message
+        :param text: message text
+        :return: tuple of handler and the groups captured by its pattern or
+        None if no pattern matches
+        """
+        found = self.match_first(text)
+        if found is None or found[0] not in self.guards:
+            return found
+        handler, groups = found
+        groups = self.guards[handler](*groups)
+        if groups is not None:
+            return handler, groups
+        return self.match_each(text)
+
+    def match_each(self, text):
+        """
+        Try the patterns one by one, skipping those whose guard turns the
+        message down
+        """
+        for regex, handler in self.patterns:
+            match = regex.search(text)
+            if match is None:
+                continue
+            groups = match.groups()
+            if handler in self.guards:
+                groups = self.guards[handler](*groups)
+                if groups is None:
+                    continue
+            return handler, groups
+        return None
+
+    def match_first(self, text):
+        """
+        Find the first pattern that matches a message with the combined regex
+        """
+        match = self.regex.search(text)
+        if match is None:
+            return None
+
+        # the wrapping group closes after the groups nested in it
+        index = self.pattern_index[match.lastindex]
+        for regex, handler in self.patterns[:index]:
+            # none of these matched at or before match.start()
+            earlier_match = regex.search(text, match.start() + 1)
+            if earlier_match:
+                return handler, earlier_match.groups()
+
+        regex, handler = self.patterns[index]
+        return handler, match.groups()[
+            match.lastindex:match.lastindex + regex.groups]
+
+
 class Response:
     """
     Response object returned by MessageHandler message handling methods
@@ -179,6 +451,15 @@ class Response:
         self.response_type = response_type
         self.attachments = attachments
 
+    def copy(self):
+        """
+        Copy of the response with its own attachments list, for handing out a
+        cached response
+        """
+        return Response(self.text, self.response_type,
+                        list(self.attachments) if self.attachments is not None
+                        else None)
+
     def __repr__(self):
         return f"Response('{self.text}', '{self.response_type}', "\
             f"'{self.attachments}')"
@@ -0,0 +1,184 @@
+"""
+This file contains caches of the Slack event ids we have already received.
+Slack redelivers an event with the same event_id when we are slow to ack
+it, so the events endpoint checks these before queuing an event.
+"""
+from app import logger
+from app.shared import KEY_PREFIX, SharedStateError
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+
+
+class SeenEventCache:
+    """
+    Bounded in-process cache of event ids that expire after ttl seconds
+    """
+
+    def __init__(self, max_size=10000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # event_id -> expiry time. every entry has the same ttl so the
+        # entries that expire first are always at the front
+        self.expiries = OrderedDict()
+        self.duplicate_count = 0
+
+    def seen_before(self, event_id):
+        """
+        Record an event id
+        :return: True if the event id was already recorded and hasn't expired
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.expiries and next(iter(self.expiries.values())) <= now:
+                self.expiries.popitem(last=False)
+            if event_id in self.expiries:
+                self.duplicate_count += 1
+                return True
+            self.expiries[event_id] = now + self.ttl
+            if len(self.expiries) > self.max_size:
+                self.expiries.popitem(last=False)
+        return False
+
+    def forget(self, event_id):
+        """
+        Remove an event id eg. when we asked Slack to redeliver the event
+        """
+        with self.lock:
+            self.expiries.pop(event_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.expiries),
+                    "duplicates": self.duplicate_count}
+
+
+class SQLiteSeenEventCache:
+    """
+    Cache of event ids that expire after ttl seconds, kept in a SQLite file
+    so it is shared by every gunicorn worker on the machine
+    """
+
+    # delete expired rows after this many new event ids
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, path, ttl=600):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+        self.inserts = 0
+        self.duplicate_count = 0
+
+    def get_connection(self):
+        """
+        Get this process's connection. SQLite connections must not be used
+        across a fork so every process opens its own. Call with the lock held.
+        """
+        if self.connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1,
+                                         check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen_events "
+                "(event_id TEXT PRIMARY KEY, expires_at REAL)")
+            self.connection, self.connection_pid = connection, os.getpid()
+        return self.connection
+
+    def seen_before(self, event_id):
+        """
+        Record an event id. If the database is unavailable the event is
+        treated as new since handling it twice beats not handling it.
+        :return: True if the event id was already recorded and hasn't expired
+        """
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self.get_connection()
+                # take the write lock up front so only one worker can record
+                # a given event id
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    row = connection.execute(
+                        "SELECT expires_at FROM seen_events WHERE event_id = ?",
+                        (event_id,)).fetchone()
+                    if row is not None and row[0] > now:
+                        self.duplicate_count += 1
+                        return True
+                    connection.execute(
+                        "INSERT OR REPLACE INTO seen_events VALUES (?, ?)",
+                        (event_id, now + self.ttl))
+                    self.inserts += 1
+                    if self.inserts % self.PURGE_INTERVAL == 0:
+                        connection.execute(
+                            "DELETE FROM seen_events WHERE expires_at <= ?",
+                            (now,))
+                finally:
+                    connection.execute("COMMIT")
+        except sqlite3.Error:
+            logger.exception("Failed to check event %s for duplicates",
+                             event_id)
+        return False
+
+    def forget(self, event_id):
+        try:
+            with self.lock:
+                self.get_connection().execute(
+                    "DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+        except sqlite3.Error:
+            logger.exception("Failed to forget event %s", event_id)
+
+    def stats(self):
+        return {"duplicates": self.duplicate_count}
+
+
+class SharedSeenEventCache:
+    """
+    Cache of event ids that expire after ttl seconds, kept in the shared
+    state so it is shared by every process on every dyno. While the shared
+    state is unavailable event ids are checked against a cache in the
+    process instead.
+    """
+
+    def __init__(self, backend, ttl=600):
+        """
+        :param backend: shared state backend from app.shared.get_backend
+        :param ttl: seconds to remember an event id for
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.fallback = SeenEventCache(ttl=ttl)
+        self.duplicate_count = 0
+
+    def seen_before(self, event_id):
+        """
+        Record an event id. If the shared state is unavailable it is
+        recorded in this process only.
+        :return: True if the event id was already recorded and hasn't expired
+        """
+        try:
+            if self.backend.set(KEY_PREFIX + "event:" + event_id, b"1",
+                                ttl=self.ttl, only_if_absent=True):
+                return False
+        except SharedStateError:
+            logger.exception("Failed to check event %s for duplicates. "
+                             "Checking this process's events.", event_id)
+            return self.fallback.seen_before(event_id)
+        self.duplicate_count += 1
+        return True
+
+    def forget(self, event_id):
+        self.fallback.forget(event_id)
+        try:
+            self.backend.delete(KEY_PREFIX + "event:" + event_id)
+        except SharedStateError:
+            logger.exception("Failed to forget event %s", event_id)
+
+    def stats(self):
+        return {"duplicates": self.duplicate_count +
+                self.fallback.stats()["duplicates"]}
@@ -0,0 +1,110 @@
+"""
+This file contains the fortune store. Fortunes are packed into a compact
+binary file which workers memory-map instead of parsing fortunes.json, so
+every worker on a machine shares one page cache copy of the quotes.
+
+The file layout (all integers are little-endian unsigned 32 bit):
+
+    header   magic b"SAKAFORT", format version, number of quotes (n)
+    offsets  n + 1 offsets of each quote's start relative to the data section,
+             the last one marks the end of the data section
+    data     the quotes, utf-8 encoded and packed back to back
+
+To build the fortunes.bin file from fortunes.json run:
+
+    $ python -m app.fortunes
+"""
+from app.config import HOME_DIR
+from app import logger
+import json
+import mmap
+import os
+import struct
+
+FORTUNES_JSON_FILE = HOME_DIR + "/utils/fortunes.json"
+FORTUNES_FILE = HOME_DIR + "/utils/fortunes.bin"
+
+MAGIC = b"SAKAFORT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+OFFSET = struct.Struct("<I")
+
+
+class FortuneStore:
+    """
+    Read-only, memory-mapped sequence of fortunes. Indexing a quote reads two
+    offsets and decodes one quote so picking a random fortune is O(1).
+    """
+
+    def __init__(self, path=FORTUNES_FILE):
+        with open(path, "rb") as fortunes_file:
+            self.mmap = mmap.mmap(fortunes_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} "
+                             "fortune store")
+        self.data_start = HEADER.size + OFFSET.size * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError("fortune index out of range")
+        offset = HEADER.size + OFFSET.size * index
+        start, = OFFSET.unpack_from(self.mmap, offset)
+        end, = OFFSET.unpack_from(self.mmap, offset + OFFSET.size)
+        return self.mmap[self.data_start + start:
+                         self.data_start + end].decode("utf-8")
+
+
+def build_fortune_store(json_path=FORTUNES_JSON_FILE,
+                        store_path=FORTUNES_FILE):
+    """
+    Convert the fortunes json file into a fortune store file
+    :param json_path: path to fortunes json, a list of {"quote": ""} objects
+    :param store_path: path to write the fortune store to
+    :return: number of fortunes written
+    """
+    with open(json_path, "r") as json_file:
+        # skip the few empty objects in fortunes.json
+        quotes = [fortune["quote"].encode("utf-8")
+                  for fortune in json.loads(json_file.read())
+                  if "quote" in fortune]
+
+    offsets = [0]
+    for quote in quotes:
+        offsets.append(offsets[-1] + len(quote))
+
+    # write next to the target and move it over so workers never map a
+    # partially written file
+    with open(store_path + ".tmp", "wb") as store_file:
+        store_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(quotes)))
+        store_file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        store_file.writelines(quotes)
+    os.replace(store_path + ".tmp", store_path)
+    return len(quotes)
+
+
+def load_fortunes():
+    """
+    Open the fortune store, falling back to parsing fortunes.json if it has
+    not been built yet
+    :return: sequence of fortune quotes
+    """
+    try:
+        return FortuneStore()
+    except FileNotFoundError:
+        logger.warning("%s not found, loading fortunes from %s. Run `python "
+                       "-m app.fortunes` to build it.", FORTUNES_FILE,
+                       FORTUNES_JSON_FILE)
+        with open(FORTUNES_JSON_FILE, "r") as json_file:
+            return [fortune["quote"]
+                    for fortune in json.loads(json_file.read())
+                    if "quote" in fortune]
+
+
+if __name__ == "__main__":
+    count = build_fortune_store()
+    print(f"Wrote {count} fortunes to {FORTUNES_FILE}")
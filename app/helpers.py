@@ -1,11 +1,24 @@
-from app.config import HOME_DIR
+from app.fortunes import load_fortunes
+from app.models import build_equipment_reference, get_dataset_version
 import random
-import json
+import threading
 
 
-# loading messages
-fortunes = json.loads(open(HOME_DIR + "/utils/fortunes.json", "r").
-                      read())
+# loaded on first use, see get_fortunes
+fortunes = None
+_fortunes_lock = threading.Lock()
+
+
+def get_fortunes():
+    """
+    Get the fortunes, opening the fortune store on first use
+    """
+    global fortunes
+    if fortunes is None:
+        with _fortunes_lock:
+            if fortunes is None:
+                fortunes = load_fortunes()
+    return fortunes
 
 
 def generate_random_hex_color():
@@ -17,21 +30,24 @@ def generate_random_hex_color():
 
 
 def build_search_equipment_attachment(equipment, equipment_type,
-                                      add_notify_owner_btn=False):
+                                      add_notify_owner_btn=False,
+                                      dataset_version=None):
     '''
     Returns a slack attachment to show a result
     :param equipment: equipment object
-    :param equipment_type: type of equipment eg. dongle, thunderbolt, macbook
+    :param equipment_type: type of equipment eg. dongles, thunderbolts,
+    macbooks
     :param add_notify_owner_btn: <optional> add a notify owner button to the
     result
+    :param dataset_version: <optional> version of the dataset the equipment
+    was found in, defaults to the current one
     :return: dict attachment to send in slack response
     '''
     # equipment_type is in canonical form (plural)
     # so we get everything up to the last letter
-    equipment_type = equipment_type[:-1]
-    equipment["type"] = equipment_type
+    equipment_name = equipment_type[:-1]
     attachment = {
-        "text": f"{equipment['owner_name']}'s {equipment_type}",
+        "text": f"{equipment['owner_name']}'s {equipment_name}",
         "fallback": f"Equipment ID - {equipment['equipment_id']} | Owner - {equipment['owner_name']}",
         "color": generate_random_hex_color(),
         "fields": [{
@@ -41,12 +57,16 @@ def build_search_equipment_attachment(equipment, equipment_type,
         },
             {
             "title": "Owner",
-            "value": f"<@{equipment['owner_slack_id']}>",
+            # unmatched equipment has no slack id, only a name
+            "value": f"<@{equipment['owner_slack_id']}>"
+            if equipment.get("owner_slack_id") else equipment["owner_name"],
             "short": "true"
         }
         ]
     }
-    if add_notify_owner_btn:
+    if add_notify_owner_btn and equipment.get("owner_slack_id"):
+        if dataset_version is None:
+            dataset_version = get_dataset_version()
         attachment.update(
             {
                 "callback_id": "notify_owner",
@@ -55,12 +75,13 @@ def build_search_equipment_attachment(equipment, equipment_type,
                         "name": "notify_owner",
                         "text": "Notify the owner you have their equipment",
                         "type": "button",
-                        "value": json.dumps(equipment),
+                        "value": build_equipment_reference(
+                            equipment, equipment_type, dataset_version),
                         "confirm": {
                             "title": "Are you sure?",
                             "text": f"Clicking 'Yes' will send a message to "
                             f"{equipment['owner_name']} "
-                            f"telling them you found their {equipment_type}.",
+                            f"telling them you found their {equipment_name}.",
                             "ok_text": "Yes",
                             "dismiss_text": "No"
                         }
@@ -68,8 +89,26 @@ def build_search_equipment_attachment(equipment, equipment_type,
     return attachment
 
 
+def build_found_equipment_message(owner_slack_id, submitter, found):
+    '''
+    Message telling an owner someone found their equipment
+    :param owner_slack_id: slack id of the owner
+    :param submitter: slack id of the user who found the equipment
+    :param found: list of tuples of equipment type and equipment
+    :return: message text
+    '''
+    if len(found) == 1:
+        items = found[0][0][:-1]
+    else:
+        names = [f"{equipment_type[:-1]} ({equipment['equipment_id']})"
+                 for equipment_type, equipment in found]
+        items = ", ".join(names[:-1]) + " and " + names[-1]
+    return f"Hi <@{owner_slack_id}>! <@{submitter}> says they found your "\
+        f"{items}."
+
+
 def generate_random_fortune():
-    return random.choice(fortunes)['quote']
+    return random.choice(get_fortunes())
 
 
 # deprecated
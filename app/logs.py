@@ -0,0 +1,191 @@
+"""
+This file contains the bot's logging pipeline. Log calls only put the
+record on a bounded queue and a listener on a real thread, outside of
+gevent's event loop, formats and writes it. A write to a slow stderr pipe
+blocks that thread only, so a request never waits on it. Records are
+formatted as one json object per line with any fields passed through
+`extra={"fields": {...}}`. Logs written on every event can be sampled with
+`if sampled(rate): logger.info(...)`, which skips building the record.
+"""
+from app.metrics import Counter
+from collections import deque
+from gevent import monkey
+from logging.handlers import QueueHandler
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+
+# the real thread primitives, even after monkey.patch_all(). greenlet locks
+# and sleeps can't be waited on from a real thread or wake one up
+start_os_thread = monkey.get_original("_thread", "start_new_thread")
+allocate_os_lock = monkey.get_original("_thread", "allocate_lock")
+
+LOG_RECORDS_DROPPED = Counter("sakabot_log_records_dropped_total",
+                              "Log records dropped because the log queue "
+                              "was full")
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as a json object with its time, level, logger, source
+    line, message and fields
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "source": f"{record.module}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            record.exc_text = record.exc_text or\
+                self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime("%Y-%m-%dT%H:%M:%S",
+                             time.gmtime(record.created)) +\
+            f".{int(record.msecs):03d}Z"
+
+
+TEXT_FORMATTER = logging.Formatter(
+    "[%(asctime)s] {%(module)s:%(lineno)d}\n%(levelname)s - %(message)s\n")
+
+
+def sampled(rate, key=None):
+    """
+    :param rate: fraction of the calls to keep eg. 0.1
+    :param key: <optional> eg. an event id. calls with the same key are all
+    kept or all skipped so the logs of one event stay together
+    :return: True for about `rate` of the calls
+    """
+    if rate >= 1:
+        return True
+    if key is None:
+        return random.random() < rate
+    return zlib.crc32(key.encode("utf-8")) % 10000 < rate * 10000
+
+
+class AsyncLogHandler(QueueHandler):
+    """
+    Queues records for a listener that hands them to the real handlers. The
+    listener runs on a real thread, started by the first record a process
+    logs. A process forked from one that already started it (eg. a gunicorn
+    worker forked from the master) starts its own on an empty queue, so the
+    records its parent had yet to write aren't written twice. When the queue
+    is full new records are dropped and counted rather than blocking the
+    caller.
+    """
+
+    def __init__(self, targets, max_size=10000):
+        """
+        :param targets: handlers that write the records. Only the listener
+        uses them once it's started
+        :param max_size: maximum records waiting to be written
+        """
+        super().__init__(deque())
+        self.targets = targets
+        self.max_size = max_size
+        self.listener_pid = None
+        self.start_lock = threading.Lock()
+        # released to wake the listener up when records are queued
+        self.wakeup = None
+        # held by the listener until it has written everything and stopped
+        self.running = None
+        self.stopping = False
+
+    def start(self):
+        with self.start_lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.queue = deque()
+            self.wakeup = allocate_os_lock()
+            self.wakeup.acquire()
+            self.running = allocate_os_lock()
+            self.running.acquire()
+            self.stopping = False
+            start_os_thread(self.listen, (self.queue, self.wakeup,
+                                          self.running))
+            self.listener_pid = os.getpid()
+
+    def listen(self, records, wakeup, running):
+        try:
+            while True:
+                while records:
+                    self.handle_queued(records.popleft())
+                if self.stopping:
+                    return
+                wakeup.acquire(timeout=1)
+        finally:
+            running.release()
+
+    def handle_queued(self, record):
+        for target in self.targets:
+            if record.levelno >= target.level:
+                target.handle(record)
+
+    def stop(self, timeout=5):
+        """
+        Write out the queued records and stop the listener
+        :param timeout: seconds to wait for the records to be written
+        """
+        if self.listener_pid == os.getpid():
+            self.stopping = True
+            self.wake_listener()
+            self.running.acquire(timeout=timeout)
+            self.listener_pid = None
+
+    def wake_listener(self):
+        try:
+            if self.wakeup.locked():
+                self.wakeup.release()
+        except RuntimeError:
+            # released by another thread in between
+            pass
+
+    def prepare(self, record):
+        # the record is formatted by the listener. only the traceback, which
+        # holds on to frames, is turned into text here
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.listener_pid != os.getpid():
+            self.start()
+        if len(self.queue) >= self.max_size:
+            LOG_RECORDS_DROPPED.inc()
+            return
+        self.queue.append(record)
+        self.wake_listener()
+
+
+def setup_logging(logger, level, log_format="json", max_queue=10000):
+    """
+    Send a logger's records through the queue to stderr
+    :param logger: logger to set up
+    :param level: log level eg. INFO
+    :param log_format: json for one json object per record or text
+    :param max_queue: maximum records waiting to be written
+    :return: the AsyncLogHandler
+    """
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JSONFormatter() if log_format == "json"
+                                else TEXT_FORMATTER)
+    handler = AsyncLogHandler([stream_handler], max_queue)
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    atexit.register(handler.stop)
+    return handler
@@ -0,0 +1,394 @@
+"""
+This file contains the counters, gauges and latency histograms the bot keeps
+and renders in the Prometheus text format for the /metrics endpoint.
+
+Recording a value is a lock and a couple of additions so it is cheap enough
+for the hot path. Every process records its own metrics and a
+MetricsAggregator writes them to a store shared with the other gunicorn
+workers (and dynos) every few seconds. A scrape served by any of them
+renders the metrics of all of them added together.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# seconds. from sub-millisecond regex dispatch up to slow Slack API calls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def latency_stats(latencies):
+    """
+    :param latencies: latencies in seconds
+    :return: dict of the average, median, 95th percentile and maximum
+    latency or an empty dict if there are none
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        "latency_avg": sum(latencies) / len(latencies),
+        "latency_p50": latencies[len(latencies) // 2],
+        "latency_p95": latencies[int(len(latencies) * 0.95)],
+        "latency_max": latencies[-1],
+    }
+
+
+def format_labels(labelnames, labels, extra=""):
+    pairs = [f'{name}="{escape_label_value(value)}"'
+             for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n")\
+        .replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def dump(self):
+        """
+        :return: json serializable dict of metric name -> the metric's values
+        """
+        return {metric.name: metric.dump() for metric in self.metrics}
+
+    def render(self, dumps=()):
+        """
+        :param dumps: <optional> dumps of the metrics of other processes to
+        add to this process's
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            values = metric.combine([metric.dump()] + [
+                dump[metric.name] for dump in dumps if metric.name in dump])
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples(values):
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Counter:
+    """
+    Monotonically increasing count, optionally split by labels
+    """
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # label values -> count
+        self.values = {}
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dump(self):
+        with self.lock:
+            return [[list(labels), value]
+                    for labels, value in self.values.items()]
+
+    def combine(self, dumps):
+        """
+        :param dumps: dumps of this counter from several processes
+        :return: dict of label values -> total count
+        """
+        values = {}
+        for dump in dumps:
+            for labels, value in dump:
+                labels = tuple(labels)
+                values[labels] = values.get(labels, 0) + value
+        return values
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """
+    Value read from a function whenever the metrics are rendered eg. a queue
+    depth
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, func, combine="sum",
+                 registry=REGISTRY):
+        """
+        :param func: function with no arguments that returns the value
+        :param combine: <optional> how the values of several processes are
+        combined, sum or max
+        """
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.combine_values = max if combine == "max" else sum
+        registry.register(self)
+
+    def dump(self):
+        return self.func()
+
+    def combine(self, dumps):
+        return self.combine_values(dumps)
+
+    def samples(self, value):
+        yield self.name, "", value
+
+
+class Histogram:
+    """
+    Distribution of observed values eg. latencies in cumulative buckets,
+    optionally split by labels
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # label values -> [per bucket counts (the last is +Inf), sum]
+        self.values = {}
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1),
+                                                0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observe the seconds spent in a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def dump(self):
+        with self.lock:
+            return [[list(labels), list(counts), total]
+                    for labels, (counts, total) in self.values.items()]
+
+    def combine(self, dumps):
+        """
+        :param dumps: dumps of this histogram from several processes
+        :return: dict of label values -> [per bucket counts, sum]
+        """
+        values = {}
+        for dump in dumps:
+            for labels, counts, total in dump:
+                series = values.setdefault(
+                    tuple(labels), [[0] * (len(self.buckets) + 1), 0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+        return values
+
+    def samples(self, values):
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),),
+                                          counts):
+                cumulative += count
+                le = f'le="{format_value(upper_bound)}"'
+                yield self.name + "_bucket",\
+                    format_labels(self.labelnames, labels, le), cumulative
+            yield self.name + "_sum", format_labels(self.labelnames, labels),\
+                total
+            yield self.name + "_count",\
+                format_labels(self.labelnames, labels), cumulative
+
+
+class FileMetricsStore:
+    """
+    Keeps the metrics of each process in a file of a directory shared by the
+    processes of one machine eg. the gunicorn workers of a dyno
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, process_id, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, process_id + ".json")
+        with open(path + ".tmp", "w") as metrics_file:
+            metrics_file.write(data)
+        # readers never see a partial file
+        os.replace(path + ".tmp", path)
+
+    def read_all(self):
+        """
+        :return: dict of process id -> data
+        """
+        entries = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as metrics_file:
+                    entries[name[:-len(".json")]] = metrics_file.read()
+            except OSError:
+                # removed since it was listed
+                continue
+        return entries
+
+    def delete(self, process_id):
+        try:
+            os.remove(os.path.join(self.directory, process_id + ".json"))
+        except OSError:
+            pass
+
+
+class SharedMetricsStore:
+    """
+    Keeps the metrics of each process in a hash in the shared state so
+    processes on every dyno see them
+    """
+
+    def __init__(self, backend, key):
+        """
+        :param backend: shared state backend from app.shared.get_backend
+        :param key: key of the hash
+        """
+        self.backend = backend
+        self.key = key
+
+    def write(self, process_id, data):
+        self.backend.hset(self.key, process_id, data.encode("utf-8"))
+
+    def read_all(self):
+        return {process_id.decode("utf-8") if isinstance(process_id, bytes)
+                else process_id: data.decode("utf-8")
+                for process_id, data in self.backend.hgetall(self.key).items()}
+
+    def delete(self, process_id):
+        self.backend.hdel(self.key, process_id)
+
+
+class MetricsAggregator:
+    """
+    Writes this process's metrics to a store every `interval` seconds and
+    renders them added to those of the other processes in the store. Values
+    written more than a few intervals ago are from a process that has gone
+    and are dropped. A process's own values are always read live so its
+    counters never appear to go backwards.
+    """
+
+    def __init__(self, store, interval=5, registry=REGISTRY):
+        """
+        :param store: FileMetricsStore or SharedMetricsStore
+        :param interval: seconds between writes
+        :param registry: metrics to write and render
+        """
+        self.store = store
+        self.interval = interval
+        self.registry = registry
+        self.thread_pid = None
+        self.logger = logging.getLogger("app")
+
+    def process_id(self):
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def flush(self):
+        self.store.write(self.process_id(), json.dumps({
+            "time": time.time(), "metrics": self.registry.dump()}))
+
+    def run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception("Failed to write the metrics")
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Start writing the metrics in the background. A process forked from
+        one that started writing starts its own.
+        """
+        if self.thread_pid != os.getpid():
+            self.thread_pid = os.getpid()
+            threading.Thread(target=self.run, daemon=True,
+                             name="metrics-aggregator").start()
+
+    def render(self):
+        """
+        :return: the metrics of every process in the Prometheus text
+        exposition format
+        """
+        dumps = []
+        try:
+            oldest = time.time() - 3 * self.interval
+            own_id = self.process_id()
+            for process_id, data in self.store.read_all().items():
+                if process_id == own_id:
+                    continue
+                entry = json.loads(data)
+                if entry["time"] < oldest:
+                    self.store.delete(process_id)
+                    continue
+                dumps.append(entry["metrics"])
+        except Exception:
+            self.logger.exception("Failed to read the metrics of the other "
+                                  "processes. Rendering this process's.")
+            dumps = []
+        return self.registry.render(dumps)
+
+
+STAGE_LATENCY = Histogram(
+    "sakabot_stage_duration_seconds",
+    "Seconds spent in each stage of handling a Slack request", ["stage"])
+RESPONSES = Counter("sakabot_responses_total",
+                    "Replies built by MessageHandler", ["response_type"])
+SLACK_API_LATENCY = Histogram("sakabot_slack_api_duration_seconds",
+                              "Seconds per Slack Web API call", ["method"])
+SLACK_API_CALLS = Counter("sakabot_slack_api_calls_total",
+                          "Slack Web API calls", ["method"])
+SLACK_API_ERRORS = Counter("sakabot_slack_api_errors_total",
+                           "Slack Web API calls that did not return ok",
+                           ["method", "error"])
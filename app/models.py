@@ -1,32 +1,817 @@
-from app.config import HOME_DIR
-import jmespath
+from app.config import EQUIPMENT_FILE
+from app import logger
+from app.shared import get_backend, is_shared, KEY_PREFIX, SharedStateError
+from app.workers import run_in_os_thread
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from fuzzywuzzy import fuzz, utils
+import argparse
+import hashlib
+import heapq
 import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
 
-all_equipment = json.loads(open(HOME_DIR + "/utils/equipment.json", "r").
-                           read())
+# stores are searched in this order when looking up an equipment id
+EQUIPMENT_TYPES = ["dongles", "chargers", "macbooks", "thunderbolts"]
 
+# shared equipment dataset, see publish_equipment. "current" holds the
+# version and hash of the dataset in "data"
+EQUIPMENT_COUNTER_KEY = KEY_PREFIX + "equipment:counter"
+EQUIPMENT_CURRENT_KEY = KEY_PREFIX + "equipment:current"
+EQUIPMENT_DATA_KEY = KEY_PREFIX + "equipment:data"
+EQUIPMENT_LOCK_KEY = KEY_PREFIX + "equipment:lock"
+EQUIPMENT_CHANNEL = KEY_PREFIX + "equipment"
 
-def find_equipment_by_id(id_, equipment_type):
+
+class EquipmentRecord:
+    """
+    Compact equipment item. Fields are stored in slots instead of a dict per
+    item and the owner strings, which repeat across an owner's items, are
+    interned so every item shares one copy. Records read like the dicts in
+    equipment.json eg. record["owner_name"] and record.get("owner_email").
+    """
+    FIELDS = ("equipment_id", "serial_number", "owner_name", "owner_cohort",
+              "owner_email", "owner_slack_id", "unmatched")
+    INTERNED_FIELDS = {"owner_name", "owner_cohort", "owner_email",
+                       "owner_slack_id"}
+    # fields missing from an item are left unset so they take no memory.
+    # extra holds a dict of any fields not in FIELDS, or None
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, item):
+        """
+        :param item: equipment dict as found in equipment.json
+        """
+        self.extra = None
+        for key, value in item.items():
+            if key in self.INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.FIELDS if hasattr(self, key)] +\
+            list(self.extra or [])
+
+    def to_dict(self):
+        """
+        :return: the item as a new dict in the shape of equipment.json
+        """
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self):
+        return f"EquipmentRecord({self.to_dict()})"
+
+
+def compact_equipment(equipment):
+    """
+    Convert the items of every equipment store to EquipmentRecords
+    :param equipment: dict of equipment type -> list of item dicts
+    :return: dict of equipment type -> list of EquipmentRecords
+    """
+    return {equipment_type: [EquipmentRecord(item) for item in items or []]
+            for equipment_type, items in equipment.items()}
+
+
+class EquipmentIndex:
+    """
+    In-memory hash indexes over the equipment stores. Built once when the
+    equipment data loads so lookups are dict hits instead of list scans.
+    """
+
+    def __init__(self, equipment):
+        # equipment_id -> {equipment_type: [equipment, ...]}
+        self.by_id = {}
+        # (owner_slack_id, equipment_type) -> [equipment, ...]
+        self.by_owner = {}
+
+        for equipment_type in EQUIPMENT_TYPES:
+            for item in equipment.get(equipment_type) or []:
+                self.by_id.setdefault(item.get("equipment_id"), {})\
+                    .setdefault(equipment_type, []).append(item)
+                owner_id = item.get("owner_slack_id")
+                if owner_id:
+                    self.by_owner.setdefault((owner_id, equipment_type), [])\
+                        .append(item)
+
+        self.id_search = EquipmentIdSearchIndex(self.by_id)
+        self.owner_name_search = OwnerNameSearchIndex(equipment)
+
+
+def normalize_equipment_id(id_):
+    """
+    Normalize an equipment id for fuzzy matching. Uppercase and keep only
+    letters and numbers.
+    :param id_: equipment id or what someone typed eg. "tb 0051"
+    :return: normalized id eg. "TB0051"
+    """
+    return re.sub(r"[^0-9A-Z]", "", id_.upper())
+
+
+def parse_equipment_ids(text):
+    """
+    Split a list of equipment ids
+    :param text: ids separated by spaces, commas or new lines eg.
+    "TB/0051, and/dongle/123"
+    :return: list of the unique uppercased ids in the order they appear
+    """
+    return list(dict.fromkeys(
+        id_ for id_ in re.split(r"[\s,]+", text.upper()) if id_))
+
+
+def trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)} or {key}
+
+
+class EquipmentIdSearchIndex:
+    """
+    Prefix and trigram indexes over normalized equipment ids for suggesting
+    ids close to one that wasn't found
+    """
+
+    # trigrams in more ids than this (eg. the "TB0" every thunderbolt id
+    # starts with) are too common to narrow the search down and are skipped
+    MAX_POSTINGS = 5000
+    # candidates sharing the most trigrams with the query that are ranked by
+    # edit distance
+    MAX_CANDIDATES = 200
+
+    def __init__(self, by_id):
+        """
+        :param by_id: EquipmentIndex.by_id
+        """
+        # normalized id -> [equipment id, ...]
+        self.ids_by_key = {}
+        for equipment_id in by_id:
+            if equipment_id:
+                self.ids_by_key.setdefault(
+                    normalize_equipment_id(equipment_id), []).append(
+                    equipment_id)
+        # sorted normalized ids for prefix searches
+        self.keys = sorted(self.ids_by_key)
+
+        # trigram -> positions in self.keys of the keys that contain it
+        postings = {}
+        for position, key in enumerate(self.keys):
+            for trigram in trigrams(key):
+                postings.setdefault(trigram, []).append(position)
+        self.postings = {trigram: array("I", positions)
+                         for trigram, positions in postings.items()}
+
+    def find_exact(self, query):
+        """
+        :return: list of equipment ids that normalize to the same id as query
+        """
+        return self.ids_by_key.get(normalize_equipment_id(query), [])
+
+    def suggest(self, query, limit=5, time_budget=0.005):
+        """
+        Suggest equipment ids for a query that isn't an exact id. Ids the
+        query is a prefix of come first, then ids sharing the most trigrams
+        with it ranked by edit distance.
+        :param query: what someone searched for eg. "TB/005"
+        :param limit: maximum number of suggestions
+        :param time_budget: seconds after which the search stops and returns
+        what it has found so far
+        :return: list of equipment ids
+        """
+        deadline = time.perf_counter() + time_budget
+        key = normalize_equipment_id(query)
+        if not key:
+            return []
+        keys = []
+
+        # prefix matches, shortest first
+        start = bisect_left(self.keys, key)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(key) and\
+                end - start < limit * 10:
+            end += 1
+        keys += sorted(self.keys[start:end], key=len)[:limit]
+
+        # near matches
+        if len(keys) < limit:
+            shared_trigrams = Counter()
+            for trigram in trigrams(key):
+                positions = self.postings.get(trigram)
+                if positions is None or len(positions) > self.MAX_POSTINGS:
+                    continue
+                shared_trigrams.update(positions)
+                if time.perf_counter() > deadline:
+                    break
+            candidates = [self.keys[position] for position, _ in
+                          heapq.nlargest(self.MAX_CANDIDATES,
+                                         shared_trigrams.items(),
+                                         key=lambda item: item[1])]
+            candidates.sort(key=lambda candidate: -fuzz.ratio(key, candidate))
+            keys += [candidate for candidate in candidates
+                     if candidate not in keys][:limit - len(keys)]
+
+        return [equipment_id for key in keys
+                for equipment_id in self.ids_by_key[key]][:limit]
+
+
+def name_tokens(name):
+    """
+    :return: list of the lowercased words in a name eg. ["john", "o", "doe"]
+    for "John O'Doe"
+    """
+    return utils.full_process(name or "", force_ascii=True).split()
+
+
+class OwnerNameSearchIndex:
+    """
+    Inverted index from the words in owner names to the owners' equipment,
+    including equipment whose owner has no slack id
+    """
+
+    # words at least this long also match words they are a prefix of eg.
+    # "jon" matches "jonathan"
+    MIN_PREFIX_LENGTH = 3
+
+    def __init__(self, equipment):
+        # owner name as in the data, one entry per distinct name
+        self.names = []
+        # distinct words of each name
+        self.name_words = []
+        # (position in self.names, equipment_type) -> [equipment, ...]
+        self.items = {}
+        # word -> positions in self.names of the names with that word
+        self.postings = {}
+
+        positions = {}
+        for equipment_type in EQUIPMENT_TYPES:
+            for item in equipment.get(equipment_type) or []:
+                name = item.get("owner_name")
+                if not name:
+                    continue
+                position = positions.get(name)
+                if position is None:
+                    position = positions[name] = len(self.names)
+                    self.names.append(name)
+                    tokens = tuple(set(name_tokens(name)))
+                    self.name_words.append(tokens)
+                    for token in tokens:
+                        self.postings.setdefault(token, []).append(position)
+                self.items.setdefault((position, equipment_type), [])\
+                    .append(item)
+        self.postings = {token: array("I", name_positions)
+                         for token, name_positions in self.postings.items()}
+        # sorted words for prefix matches
+        self.tokens = sorted(self.postings)
+
+    def matching_positions(self, token):
+        """
+        :return: set of positions of the names with a word equal to token or,
+        for long enough tokens, starting with it
+        """
+        positions = set(self.postings.get(token, ()))
+        if len(token) >= self.MIN_PREFIX_LENGTH:
+            start = bisect_left(self.tokens, token)
+            for other in self.tokens[start:]:
+                if not other.startswith(token):
+                    break
+                positions.update(self.postings[other])
+        return positions
+
+    def word_matches(self, word, token):
+        return word == token or (len(token) >= self.MIN_PREFIX_LENGTH and
+                                 word.startswith(token))
+
+    def search(self, name, equipment_type):
+        """
+        Find the equipment of the owners whose names contain every word of
+        name. Owners whose names have the fewest other words come first.
+        :param name: owner name or part of it eg. "john" or "doe john"
+        :param equipment_type: equipment store to search eg. dongles
+        :return: list of tuples of owner name and their list of equipment
+        """
+        tokens = set(name_tokens(name))
+        if not tokens:
+            return []
+        # take the candidates from the rarest word and check the others
+        # against each candidate's words, common words like "john" would
+        # otherwise build large sets on every search
+        rarest, *others = sorted(tokens, key=lambda token: len(
+            self.postings.get(token, ())))
+        positions = [
+            position for position in self.matching_positions(rarest)
+            if (position, equipment_type) in self.items and
+            all(any(self.word_matches(word, token)
+                    for word in self.name_words[position])
+                for token in others)]
+        ranked = sorted(
+            positions,
+            key=lambda position: (len(self.name_words[position]) - len(tokens),
+                                  self.names[position]))
+        return [(self.names[position], self.items[(position, equipment_type)])
+                for position in ranked]
+
+
+class EquipmentSnapshot:
+    """
+    The equipment data and its indexes as loaded at one point in time.
+    Snapshots are never modified. A reload builds a new one and swaps it in so
+    requests that already hold the old snapshot keep using it.
+    """
+
+    def __init__(self, equipment, version):
+        self.equipment = equipment
+        self.version = version
+        self.index = EquipmentIndex(equipment)
+
+
+def load_equipment(path=EQUIPMENT_FILE):
+    with open(path, "r") as equipment_file:
+        return compact_equipment(json.loads(equipment_file.read()))
+
+
+def load_snapshot(path=EQUIPMENT_FILE, version=None):
+    """
+    Load the equipment file and build its indexes. Takes about a second for
+    100k items so it's run with run_in_os_thread.
+    :param path: path to the equipment json file
+    :param version: <optional> version of the snapshot, see swap_snapshot
+    """
+    return EquipmentSnapshot(load_equipment(path), version)
+
+
+# loaded on first use, see get_snapshot
+_snapshot = None
+_reload_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Get the current equipment snapshot, loading the equipment data on first
+    use. Hold on to the returned snapshot for the duration of a request to
+    get consistent results across lookups.
+    """
+    global _snapshot
+    if _snapshot is None:
+        with _reload_lock:
+            if _snapshot is None:
+                _snapshot = load_first_snapshot()
+                logger.info("Loaded equipment dataset version %s",
+                            _snapshot.version)
+    return _snapshot
+
+
+def load_first_snapshot():
+    """
+    Load the shared equipment dataset, or the equipment file when it isn't
+    shared. The first process to start shares its file. The files of
+    processes that start later are left out even if they differ: they may
+    be older than the shared data, which is only replaced by the watcher or
+    `python -m app.models`. They aren't read at all, so a process without
+    one still starts.
+    """
+    if is_shared():
+        try:
+            snapshot = load_shared_snapshot()
+            if snapshot is None:
+                publish_equipment(replace=False)
+                snapshot = load_shared_snapshot()
+            if snapshot is not None:
+                return snapshot
+        except (SharedStateError, OSError, ValueError, zlib.error):
+            logger.exception("Failed to load the shared equipment dataset. "
+                             "Loading %s.", EQUIPMENT_FILE)
+    return run_in_os_thread(load_snapshot, EQUIPMENT_FILE, 1)
+
+
+def get_dataset_version():
+    return get_snapshot().version
+
+
+def reload_equipment(path=EQUIPMENT_FILE):
+    """
+    Load the equipment file, build its indexes on a real thread and swap
+    the result in as the current snapshot
+    :param path: path to the equipment json file
+    :return: the new snapshot
+    """
+    return swap_snapshot(run_in_os_thread(load_snapshot, path))
+
+
+def swap_snapshot(snapshot):
+    """
+    Swap a snapshot in as the current snapshot
+    :param snapshot: EquipmentSnapshot. If its version is None it becomes
+    one more than the current version. A snapshot older than the current
+    one is ignored.
+    :return: the current snapshot
+    """
+    global _snapshot
+    with _reload_lock:
+        current_version = _snapshot.version if _snapshot is not None else 0
+        if snapshot.version is None:
+            snapshot.version = current_version + 1
+        elif snapshot.version <= current_version:
+            return _snapshot
+        _snapshot = snapshot
+    logger.info("Loaded equipment dataset version %s", snapshot.version)
+    return snapshot
+
+
+def publish_equipment(path=EQUIPMENT_FILE, lock_timeout=30, replace=True):
+    """
+    Share an equipment file with every process as a new version of the
+    shared dataset, unless it is the one already shared, and notify them
+    :param path: path to the equipment json file
+    :param lock_timeout: seconds after which another process's lock on the
+    dataset is considered abandoned
+    :param replace: <optional> False to only share the file if nothing has
+    been shared yet
+    :return: version of the shared dataset
+    """
+    backend = get_backend()
+    with open(path, "rb") as equipment_file:
+        data = equipment_file.read()
+    # never share a broken file
+    json.loads(data.decode("utf-8"))
+    digest = hashlib.sha1(data).hexdigest()
+
+    while not backend.set(EQUIPMENT_LOCK_KEY, b"1", ttl=lock_timeout,
+                          only_if_absent=True):
+        time.sleep(0.1)
+    try:
+        current = backend.get(EQUIPMENT_CURRENT_KEY)
+        if current is not None:
+            version, current_digest = current.decode("utf-8").split(":")
+            if current_digest == digest or not replace:
+                return int(version)
+        version = backend.incr(EQUIPMENT_COUNTER_KEY)
+        backend.set(EQUIPMENT_DATA_KEY,
+                    f"{version}\n".encode("utf-8") + zlib.compress(data))
+        backend.set(EQUIPMENT_CURRENT_KEY,
+                    f"{version}:{digest}".encode("utf-8"))
+    finally:
+        backend.delete(EQUIPMENT_LOCK_KEY)
+    backend.publish(EQUIPMENT_CHANNEL, str(version).encode("utf-8"))
+    logger.info("Shared %s as equipment dataset version %s", path, version)
+    return version
+
+
+def get_shared_version():
+    """
+    :return: version of the shared equipment dataset or None if nothing has
+    been shared
+    """
+    current = get_backend().get(EQUIPMENT_CURRENT_KEY)
+    if current is None:
+        return None
+    return int(current.decode("utf-8").split(":")[0])
+
+
+def build_shared_snapshot(version, blob):
+    return EquipmentSnapshot(compact_equipment(json.loads(
+        zlib.decompress(blob).decode("utf-8"))), version)
+
+
+def load_shared_snapshot():
+    """
+    :return: EquipmentSnapshot of the shared dataset, parsed and indexed on a
+    real thread, or None if nothing has been shared
+    """
+    data = get_backend().get(EQUIPMENT_DATA_KEY)
+    if data is None:
+        return None
+    version, blob = data.split(b"\n", 1)
+    return run_in_os_thread(build_shared_snapshot, int(version), blob)
+
+
+class SharedEquipmentSync:
+    """
+    Keeps the process on the latest shared equipment dataset. A new version
+    is swapped in as soon as its notification arrives. The shared version is
+    also polled in case a notification is lost, so a process is never more
+    than `interval` seconds behind.
+    """
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.thread_pid = None
+        self.stopped = threading.Event()
+
+    def check(self, message=None):
+        """
+        Swap in the shared dataset if it is newer than the current snapshot
+        :param message: notification from publish_equipment, unused
+        :return: True if a new snapshot was swapped in
+        """
+        with self.lock:
+            try:
+                version = get_shared_version()
+                if version is None or version <= get_dataset_version():
+                    return False
+                snapshot = load_shared_snapshot()
+                if snapshot is None:
+                    return False
+            except (SharedStateError, ValueError, zlib.error):
+                logger.exception("Failed to load the shared equipment "
+                                 "dataset. Keeping dataset version %s.",
+                                 get_dataset_version())
+                return False
+            swap_snapshot(snapshot)
+            return True
+
+    def run(self):
+        try:
+            get_backend().subscribe(EQUIPMENT_CHANNEL, self.check)
+        except SharedStateError:
+            logger.exception("Failed to subscribe to equipment updates")
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """
+        Start syncing in the background. A process forked from one that
+        started syncing starts its own.
+        """
+        if self.thread_pid != os.getpid():
+            self.thread_pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="shared-equipment-sync")
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class EquipmentFileWatcher:
+    """
+    Polls the equipment file's modification time in the background and
+    reloads the equipment data when it changes. The new snapshot is built on
+    a real thread so requests keep being served. When the dataset is shared
+    the file is shared instead and every process, this one included, picks
+    it up through SharedEquipmentSync.
+    """
+
+    def __init__(self, path=EQUIPMENT_FILE, interval=30):
+        self.path = path
+        self.interval = interval
+        self.file_signature = self.get_file_signature()
+        self.thread = None
+        self.thread_pid = None
+        self.stopped = threading.Event()
+
+    def get_file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """
+        Reload or, when the dataset is shared, share the equipment data if
+        the file changed since the last check
+        :return: True if the new data was loaded or shared
+        """
+        file_signature = self.get_file_signature()
+        if file_signature is None or file_signature == self.file_signature:
+            return False
+        # remember it even if loading fails so a broken file is retried only
+        # once it changes again
+        self.file_signature = file_signature
+        try:
+            if is_shared():
+                publish_equipment(self.path)
+            else:
+                reload_equipment(self.path)
+        except (OSError, ValueError, SharedStateError):
+            logger.exception("Failed to reload equipment from %s. Keeping "
+                             "dataset version %s.", self.path,
+                             get_dataset_version())
+            return False
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """
+        Start polling in the background. A process forked from one that
+        started the watcher has no polling thread, so it starts its own.
+        """
+        if self.thread_pid != os.getpid():
+            self.thread_pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="equipment-file-watcher")
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def find_equipment_by_id(id_, equipment_type, snapshot=None):
     """
     Find equipment that matches given id from equipment store
     :param id_: :string: equipment id eg. TB/0034
     :param equipment_type: specific equipment store to look in should be one
     of: chargers, thunderbolts, macbooks or dongles
-    :return: dict of found equipment or None if no equipment by that id is
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: list of found equipment, empty if no equipment by that id is
     found
     """
-    return jmespath.search(f"{equipment_type}[?equipment_id=='{id_}']",
-                           all_equipment)
+    snapshot = snapshot or get_snapshot()
+    return snapshot.index.by_id.get(id_, {}).get(equipment_type, [])
+
+
+def find_equipment_by_id_in_all_stores(id_, snapshot=None):
+    """
+    Find equipment that matches given id from the first equipment store that
+    has it. Stores are checked in the order of EQUIPMENT_TYPES. An id that
+    only differs from one equipment id in case, spaces or punctuation finds
+    that equipment.
+    :param id_: :string: equipment id eg. TB/0034 or tb 0034
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: tuple of the equipment type and list of found equipment or
+    (None, []) if no equipment by that id is found
+    """
+    snapshot = snapshot or get_snapshot()
+    stores = snapshot.index.by_id.get(id_)
+    if stores is None:
+        # eg. "tb 0051" for TB/0051
+        exact_ids = snapshot.index.id_search.find_exact(id_)
+        if len(exact_ids) == 1:
+            stores = snapshot.index.by_id[exact_ids[0]]
+    if stores:
+        for equipment_type in EQUIPMENT_TYPES:
+            if equipment_type in stores:
+                return equipment_type, stores[equipment_type]
+    return None, []
+
+
+def find_equipment_by_ids(ids, snapshot=None):
+    """
+    Find the equipment for several ids at once, all from the same snapshot
+    :param ids: list of equipment ids eg. ["TB/0034", "AND/DONGLE/123"]
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: dict of each id to a tuple of the equipment type and list of
+    found equipment as returned by find_equipment_by_id_in_all_stores
+    """
+    snapshot = snapshot or get_snapshot()
+    return {id_: find_equipment_by_id_in_all_stores(id_, snapshot)
+            for id_ in ids}
+
+
+def suggest_equipment_ids(id_, limit=5, snapshot=None):
+    """
+    Suggest equipment ids close to one that wasn't found
+    :param id_: :string: equipment id that wasn't found eg. TB/005
+    :param limit: maximum number of suggestions
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: list of equipment ids
+    """
+    snapshot = snapshot or get_snapshot()
+    return snapshot.index.id_search.suggest(id_, limit)
 
 
-def find_equipment_by_owner_id(owner_id, equipment_type):
+def find_equipment_by_owner_id(owner_id, equipment_type, snapshot=None):
     """
     Find equipment that matches given owner_id from equipment store
     :param owner_id: owner slackid eg. U1234567
     :param equipment_type: specific equipment store to look in should be one
     of: chargers, thunderbolts, macbooks or dongles
-    :return: dict of found equipment or None if no equipment by that id is
-    found
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: list of found equipment, empty if the owner has no equipment of
+    that type
     """
-    return jmespath.search(f"{equipment_type}[?owner_slack_id=='{owner_id}']",
-                           all_equipment)
+    snapshot = snapshot or get_snapshot()
+    return snapshot.index.by_owner.get((owner_id, equipment_type), [])
+
+
+def build_equipment_reference(equipment, equipment_type, version):
+    """
+    Build a short reference to an equipment item eg. for a button value that
+    find_equipment_by_reference resolves back to the item
+    :param equipment: equipment object
+    :param equipment_type: equipment store the item is in eg. dongles
+    :param version: version of the dataset the item was found in
+    :return: string reference eg. "dongles:3:U1234567:AND/DONGLE/123"
+    """
+    # the id goes last since it's the only part that may contain a colon
+    return f"{equipment_type}:{version}:{equipment.get('owner_slack_id')}:"\
+        f"{equipment['equipment_id']}"
+
+
+def find_equipment_by_reference(reference, snapshot=None):
+    """
+    Find the equipment item a reference from build_equipment_reference points
+    to. Items are looked up in the current dataset, which may be newer than
+    the one the reference was built from.
+    :param reference: string reference
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: tuple of the equipment type and equipment or (None, None) if the
+    reference is malformed or the item is no longer in the dataset
+    """
+    snapshot = snapshot or get_snapshot()
+    try:
+        equipment_type, version, owner_id, id_ = reference.split(":", 3)
+    except ValueError:
+        return None, None
+    if version != str(snapshot.version):
+        logger.info("Resolving %s from dataset version %s in version %s",
+                    id_, version, snapshot.version)
+
+    equipment_list = find_equipment_by_id(id_, equipment_type, snapshot)
+    # ids aren't unique so tell items apart by their owner
+    for equipment in equipment_list:
+        if str(equipment.get("owner_slack_id")) == owner_id:
+            return equipment_type, equipment
+    if len(equipment_list) == 1:
+        # the item changed owners since the reference was built
+        return equipment_type, equipment_list[0]
+    return None, None
+
+
+def find_equipment_by_owner_name(name, equipment_type, snapshot=None):
+    """
+    Find equipment whose owner's name contains every word of a name
+    :param name: owner name or part of it eg. john doe
+    :param equipment_type: specific equipment store to look in should be one
+    of: chargers, thunderbolts, macbooks or dongles
+    :param snapshot: <optional> equipment snapshot to search, defaults to the
+    current one
+    :return: list of tuples of owner name and their list of equipment, best
+    matches first
+    """
+    snapshot = snapshot or get_snapshot()
+    return snapshot.index.owner_name_search.search(name, equipment_type)
+
+
+def find_owner_name(text, snapshot=None):
+    """
+    Find the owner's name at the end of some text eg. "jane doe" in "for jane
+    doe"
+    :param text: words that may end in an owner's name
+    :param snapshot: <optional> equipment snapshot to look in, defaults to the
+    current one
+    :return: the longest run of words at the end of text that are all words
+    of owner names or "" if the last word isn't
+    """
+    snapshot = snapshot or get_snapshot()
+    postings = snapshot.index.owner_name_search.postings
+    words = text.split()
+    start = len(words)
+    while start and all(token in postings
+                        for token in name_tokens(words[start - 1])):
+        start -= 1
+    return " ".join(words[start:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Share an equipment file with every dyno as the next "
+        "version of the shared equipment dataset")
+    parser.add_argument("path", nargs="?", default=EQUIPMENT_FILE,
+                        help="equipment json file, defaults to "
+                        "EQUIPMENT_FILE")
+    args = parser.parse_args()
+    if not is_shared():
+        parser.exit(1, "Set REDIS_URL to share the equipment dataset\n")
+    print(f"Equipment dataset version {publish_equipment(args.path)}")
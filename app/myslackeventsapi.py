@@ -3,6 +3,8 @@ This file contains a modified version of the SlackEventAdapter and SlackServer
 provided by the SlackEventsApi lib. We event handling asynchronous.
 """
 from slackeventsapi import SlackEventAdapter, SlackServer
+from app.metrics import STAGE_LATENCY
+from app.workers import EventQueueFull
 from flask import request, make_response
 import json
 
@@ -20,7 +22,8 @@ class MySlackServer(SlackServer):
                     "These are not the slackbots you're looking for.", 404)
 
             # Parse the request payload into JSON
-            event_data = json.loads(request.data.decode('utf-8'))
+            with STAGE_LATENCY.time("parse"):
+                event_data = json.loads(request.data.decode('utf-8'))
 
             # Echo the URL verification challenge code
             if "challenge" in event_data:
@@ -39,14 +42,26 @@ class MySlackServer(SlackServer):
             # Parse the Event payload and emit the event to the event listener
             if "event" in event_data:
                 event_type = event_data["event"]["type"]
-                from app import huey
+                event_id = event_data.get("event_id")
+                from app import event_pool, seen_events
 
-                @huey.task()
-                def call_event_listener_async():
-                    self.emitter.emit(event_type, event_data)
+                # ack events slack redelivered without handling them again
+                if event_id and seen_events.seen_before(event_id):
+                    response = make_response("", 200)
+                    response.headers["X-Slack-No-Retry"] = "1"
+                    return response
 
                 # enqueue event
-                call_event_listener_async()
+                try:
+                    event_pool.submit(self.emitter.emit, event_type,
+                                      event_data)
+                except EventQueueFull:
+                    # slack retries events that fail with a 5xx so the retry
+                    # must not be mistaken for a duplicate
+                    if event_id:
+                        seen_events.forget(event_id)
+                    return make_response("Too many events. Try again later.",
+                                         503)
                 response = make_response("", 200)
                 response.headers['X-Slack-Powered-By'] = self.package_info
                 return response
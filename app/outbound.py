@@ -0,0 +1,258 @@
+"""
+This file contains the outbound message queue. Handlers queue their replies
+and return instead of waiting on Slack. Messages to a channel are sent in the
+order they were queued by a sender dedicated to that channel.
+"""
+from app import logger
+from app.metrics import STAGE_LATENCY, latency_stats
+from collections import deque
+import threading
+import time
+
+# slack shows at most 100 attachments per message but recommends 20
+MAX_ATTACHMENTS = 20
+# method of messages posted to an interactive payload's response_url. the
+# url takes the place of the channel
+RESPONSE_URL = "response_url"
+
+
+def paginate(text, attachments, page_size=MAX_ATTACHMENTS):
+    """
+    Split a message with more attachments than slack shows into several
+    :param text: message text, sent with the first page
+    :param attachments: message attachments
+    :param page_size: maximum attachments per message
+    :return: list of tuples of text and attachments, one for each message
+    """
+    attachments = attachments or []
+    pages = [(text, attachments[:page_size])]
+    for start in range(page_size, len(attachments), page_size):
+        pages.append(("", attachments[start:start + page_size]))
+    return pages
+
+
+class OutboundMessage:
+    """
+    A Slack API message call waiting to be sent
+    """
+
+    def __init__(self, method, channel, text, attachments=None, **kwargs):
+        self.method = method
+        self.channel = channel
+        self.text = text
+        self.attachments = list(attachments or [])
+        self.kwargs = kwargs
+        self.queued_at = time.perf_counter()
+
+    def can_coalesce(self, other):
+        """
+        Messages can be merged into one when they go to the same place with
+        the same options, the merged message reads in the original order and
+        it stays within the attachment limit
+        """
+        return self.method == other.method and\
+            self.channel == other.channel and self.kwargs == other.kwargs and\
+            (not self.attachments or not other.text) and\
+            len(self.attachments) + len(other.attachments) <= MAX_ATTACHMENTS
+
+    def coalesce(self, other):
+        self.text = "\n".join(text for text in [self.text, other.text]
+                              if text)
+        self.attachments += other.attachments
+
+
+class OutboundMessageQueue:
+    """
+    Per channel message queues with a sender greenlet (a thread outside of
+    gevent) for each channel that has messages waiting. Messages queued while
+    a channel's sender is busy are merged into as few calls as possible.
+    Slack limits messages to about one per second per channel, so calls to
+    a channel are spaced out by `interval` seconds. A rate limited channel
+    is paused for the Retry-After period without holding up the others.
+    """
+
+    def __init__(self, client, max_retries=5, backoff=1, max_backoff=30,
+                 interval=1, latency_window=1000):
+        """
+        :param client: SlackAPIClient to send messages with
+        :param max_retries: times to retry a rate limited or failed call
+        :param backoff: seconds to wait before the first retry of a failed
+        call. doubles on every retry
+        :param max_backoff: maximum seconds to wait between retries
+        :param interval: minimum seconds between calls to the same channel
+        :param latency_window: number of most recent messages to compute
+        send latency stats over
+        """
+        self.client = client
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.channels = {}
+        # channel -> time.monotonic() before which it gets no calls
+        self.next_call_at = {}
+        self.depth = 0
+        self.sent_count = 0
+        self.coalesced_count = 0
+        self.retry_count = 0
+        self.failed_count = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def post_message(self, channel, message, attachments=None):
+        """
+        Queue a chat.postMessage call
+        :param channel: Channel to post message to
+        :param message: message text to send
+        :param attachments: message attachments
+        """
+        self.enqueue(*[OutboundMessage("chat.postMessage", channel, text,
+                                       page, as_user=True)
+                       for text, page in paginate(message, attachments)])
+
+    def post_ephemeral_message(self, channel, user, message,
+                               attachments=None):
+        """
+        Queue a chat.postEphemeral call
+        :param channel: Channel to post message to
+        :param user: user to send message to
+        :param message: message text to send
+        :param attachments: message attachments
+        """
+        self.enqueue(*[OutboundMessage("chat.postEphemeral", channel, text,
+                                       page, user=user)
+                       for text, page in paginate(message, attachments)])
+
+    def enqueue(self, *messages):
+        """
+        Queue messages for the same channel, to be sent one after the other
+        """
+        channel = messages[0].channel
+        with self.lock:
+            self.depth += len(messages)
+            if channel in self.channels:
+                self.channels[channel].extend(messages)
+                return
+            self.channels[channel] = deque(messages)
+        threading.Thread(target=self.drain, args=(channel,),
+                         daemon=True).start()
+
+    def drain(self, channel):
+        """
+        Send a channel's messages until its queue is empty
+        """
+        # yield once so the handler that started this sender can finish
+        # queuing the rest of its burst of messages
+        time.sleep(0)
+        while True:
+            # wait for the channel's next call slot before taking messages
+            # off the queue so the ones queued meanwhile are merged in
+            with self.lock:
+                wait = self.next_call_at.get(channel, 0) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self.lock:
+                queue = self.channels[channel]
+                if not queue:
+                    del self.channels[channel]
+                    return
+                message = queue.popleft()
+                self.depth -= 1
+                while queue and message.can_coalesce(queue[0]):
+                    message.coalesce(queue.popleft())
+                    self.depth -= 1
+                    self.coalesced_count += 1
+            self.send(message)
+
+    def send(self, message):
+        """
+        Send a message right away, retrying rate limited and failed calls
+        :param message: OutboundMessage to send
+        :return: response from slack api of the last attempt
+        """
+        for attempt in range(self.max_retries + 1):
+            pause = self.reserve_call(message.channel)
+            if pause > 0:
+                time.sleep(pause)
+
+            if message.method == RESPONSE_URL:
+                slack_response = self.client.respond(
+                    message.channel, text=message.text,
+                    attachments=message.attachments or None,
+                    **message.kwargs)
+            else:
+                slack_response = self.client.api_call(
+                    message.method, channel=message.channel,
+                    text=message.text,
+                    attachments=message.attachments or None,
+                    **message.kwargs)
+            if slack_response.get("ok"):
+                latency = time.perf_counter() - message.queued_at
+                with self.lock:
+                    self.sent_count += 1
+                    self.latencies.append(latency)
+                STAGE_LATENCY.observe(latency, "reply")
+                return slack_response
+
+            error = slack_response.get("error")
+            if error not in ["ratelimited", "request_failed"] or\
+                    attempt == self.max_retries:
+                break
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            if error == "ratelimited":
+                headers = slack_response.get("headers") or {}
+                delay = max(float(headers.get("Retry-After", 0)), delay)
+                self.pause_channel(message.channel, delay)
+            else:
+                time.sleep(delay)
+            with self.lock:
+                self.retry_count += 1
+            logger.warning("Retrying %s to %s after %s. Attempt %s.",
+                           message.method, message.channel, error,
+                           attempt + 1)
+
+        with self.lock:
+            self.failed_count += 1
+        logger.error(slack_response)
+        return slack_response
+
+    def reserve_call(self, channel):
+        """
+        Take the next free call slot of a channel
+        :return: seconds to wait before making the call
+        """
+        now = time.monotonic()
+        with self.lock:
+            call_at = max(now, self.next_call_at.get(channel, 0))
+            self.next_call_at[channel] = call_at + self.interval
+            if len(self.next_call_at) > 1000:
+                # forget the channels that are free again
+                self.next_call_at = {
+                    channel: next_call_at for channel, next_call_at
+                    in self.next_call_at.items() if next_call_at > now}
+        return call_at - now
+
+    def pause_channel(self, channel, seconds):
+        with self.lock:
+            self.next_call_at[channel] = max(
+                self.next_call_at.get(channel, 0),
+                time.monotonic() + seconds)
+
+    def stats(self):
+        """
+        :return: dict of queue depth, message counts and send latency (seconds
+        from being queued to being accepted by Slack) stats
+        """
+        with self.lock:
+            latencies = list(self.latencies)
+            stats = {
+                "depth": self.depth,
+                "active_channels": len(self.channels),
+                "sent": self.sent_count,
+                "coalesced": self.coalesced_count,
+                "retries": self.retry_count,
+                "failed": self.failed_count,
+            }
+        stats.update(latency_stats(latencies))
+        return stats
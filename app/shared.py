@@ -0,0 +1,198 @@
+"""
+This file contains the state shared by every process serving the bot, on
+every dyno: the current equipment dataset, the Slack event ids already
+received, rate limits and metrics. With REDIS_URL set it is kept in Redis.
+Without it an in-memory stand-in with the same interface keeps it in the
+process, which is all a single process needs and what the benchmarks use.
+"""
+from app import logger
+from app.config import REDIS_URL
+import os
+import threading
+import time
+
+# every key and channel starts with this
+KEY_PREFIX = "sakabot:"
+
+
+class SharedStateError(Exception):
+    """
+    Raised when the shared state can't be read or written eg. Redis is down
+    """
+
+
+class LocalBackend:
+    """
+    In-memory stand-in for the Redis commands we use. Messages published to
+    a channel are handed to its subscribers right away.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (value, expiry time or None)
+        self.values = {}
+        # channel -> [callback, ...]
+        self.subscribers = {}
+
+    def get_entry(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self.get_entry(key)
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        with self.lock:
+            if only_if_absent and self.get_entry(key) is not None:
+                return False
+            self.values[key] = (value, time.monotonic() + ttl
+                                if ttl else None)
+            return True
+
+    def incr(self, key, ttl=None):
+        with self.lock:
+            value = int(self.get_entry(key) or 0) + 1
+            expires_at = self.values[key][1] if value > 1 else\
+                (time.monotonic() + ttl if ttl else None)
+            self.values[key] = (str(value).encode("utf-8"), expires_at)
+            return value
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def hset(self, key, field, value):
+        with self.lock:
+            self.values.setdefault(key, ({}, None))[0][field] = value
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self.get_entry(key) or {})
+
+    def hdel(self, key, field):
+        with self.lock:
+            (self.get_entry(key) or {}).pop(field, None)
+
+    def publish(self, channel, message):
+        with self.lock:
+            callbacks = list(self.subscribers.get(channel, []))
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(callback)
+
+
+class RedisBackend:
+    """
+    Shared state in Redis. redis-py's connection pool opens new connections
+    in a forked process so the backend can be created before gunicorn forks.
+    Subscriptions are served by a listener thread per process, started by
+    the first subscribe call in that process. It listens on every channel
+    under KEY_PREFIX so channels subscribed to later need no new
+    subscription.
+    """
+
+    # seconds to wait before reconnecting a dropped subscription
+    RECONNECT_DELAY = 1
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.listener_pid = None
+
+    def call(self, command, *args, **kwargs):
+        try:
+            return getattr(self.client, command)(*args, **kwargs)
+        except self.redis.RedisError as e:
+            raise SharedStateError(f"{command} failed: {e}") from e
+
+    def get(self, key):
+        return self.call("get", key)
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        return bool(self.call("set", key, value, ex=ttl,
+                              nx=only_if_absent))
+
+    def incr(self, key, ttl=None):
+        value = self.call("incr", key)
+        if value == 1 and ttl:
+            self.call("expire", key, ttl)
+        return value
+
+    def delete(self, key):
+        self.call("delete", key)
+
+    def hset(self, key, field, value):
+        self.call("hset", key, field, value)
+
+    def hgetall(self, key):
+        return self.call("hgetall", key)
+
+    def hdel(self, key, field):
+        self.call("hdel", key, field)
+
+    def publish(self, channel, message):
+        self.call("publish", channel, message)
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(callback)
+            if self.listener_pid == os.getpid():
+                return
+            self.listener_pid = os.getpid()
+        threading.Thread(target=self.listen, daemon=True,
+                         name="shared-state-listener").start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(KEY_PREFIX + "*")
+                for message in pubsub.listen():
+                    with self.lock:
+                        callbacks = list(self.subscribers.get(
+                            message["channel"].decode("utf-8"), []))
+                    for callback in callbacks:
+                        try:
+                            callback(message["data"])
+                        except Exception:
+                            logger.exception("Subscriber failed")
+            except self.redis.RedisError:
+                logger.exception("Lost the shared state subscription. "
+                                 "Reconnecting.")
+                time.sleep(self.RECONNECT_DELAY)
+
+
+# created on first use, see get_backend
+backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Get the shared state backend: Redis if REDIS_URL is set, otherwise the
+    in-memory stand-in
+    """
+    global backend
+    if backend is None:
+        with _backend_lock:
+            if backend is None:
+                backend = RedisBackend(REDIS_URL) if REDIS_URL else\
+                    LocalBackend()
+    return backend
+
+
+def is_shared():
+    """
+    :return: True if the state is shared with other processes
+    """
+    return bool(REDIS_URL)
@@ -0,0 +1,173 @@
+"""
+This file contains the client we use to call the Slack Web API. It keeps a
+bounded pool of keep-alive connections so replies don't pay for a new TLS
+handshake on every call.
+"""
+from app.metrics import SLACK_API_LATENCY, SLACK_API_CALLS,\
+    SLACK_API_ERRORS, latency_stats
+from requests.adapters import HTTPAdapter
+from collections import deque
+import requests
+import threading
+import json
+import os
+import time
+
+
+class SlackAPIClient:
+    """
+    Slack Web API client backed by a requests session with a bounded
+    connection pool. Under gevent the pool's queue and locks are monkey
+    patched, so greenlets share connections safely and wait for a free one
+    once pool_size calls are in flight.
+    """
+
+    def __init__(self, token, base_url="https://slack.com/api/", pool_size=10,
+                 timeout=10, latency_window=1000):
+        """
+        :param token: slack bot token
+        :param base_url: url the API method names are appended to eg. a local
+        fake Slack server's url
+        :param pool_size: maximum number of open connections to Slack
+        :param timeout: seconds to wait for Slack to respond
+        :param latency_window: number of most recent calls to compute latency
+        stats over
+        """
+        self.token = token
+        self.base_url = base_url.rstrip("/") + "/"
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None
+        self.session_pid = None
+
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.call_count = 0
+        self.error_count = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def get_session(self):
+        """
+        Get this process's session. A process forked from one that already
+        opened connections (eg. a gunicorn worker forked from a master that
+        preloaded the app) gets a new session instead of sharing sockets with
+        its parent.
+        """
+        if self.session_pid != os.getpid():
+            session = requests.Session()
+            session.headers["Authorization"] = f"Bearer {self.token}"
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.pool_size, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.session, self.session_pid = session, os.getpid()
+        return self.session
+
+    def call(self, method, send):
+        """
+        Make a call, keeping the connection and latency stats and metrics
+        :param method: name the call is counted under eg. chat.postMessage
+        :param send: function making the call and returning the slack
+        response dict
+        :return: the slack response dict
+        """
+        with self.stats_lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            slack_response = send()
+        finally:
+            latency = time.perf_counter() - start
+            with self.stats_lock:
+                self.in_flight -= 1
+                self.call_count += 1
+                self.latencies.append(latency)
+            SLACK_API_LATENCY.observe(latency, method)
+            SLACK_API_CALLS.inc(method)
+
+        if not slack_response.get("ok"):
+            with self.stats_lock:
+                self.error_count += 1
+            SLACK_API_ERRORS.inc(method, slack_response.get("error"))
+        return slack_response
+
+    def api_call(self, method, timeout=None, **kwargs):
+        """
+        Call a Slack Web API method. Same interface as SlackClient.api_call.
+        :param method: API method name eg. chat.postMessage
+        :param timeout: <optional> seconds to wait for Slack to respond
+        :param kwargs: method arguments. lists and dicts eg. attachments are
+        sent json encoded
+        :return: dict response from slack api with the HTTP response headers
+        under "headers". Failed requests return {"ok": False, "error": ...}
+        """
+        data = {key: json.dumps(value) if isinstance(value, (list, dict))
+                else value for key, value in kwargs.items()
+                if value is not None}
+
+        def send():
+            try:
+                response = self.get_session().post(
+                    self.base_url + method, data=data,
+                    timeout=timeout or self.timeout)
+                slack_response = response.json()
+                slack_response["headers"] = response.headers
+            except (requests.RequestException, ValueError) as e:
+                slack_response = {"ok": False, "error": "request_failed",
+                                  "detail": str(e)}
+            return slack_response
+
+        return self.call(method, send)
+
+    def respond(self, response_url, timeout=None, **payload):
+        """
+        Post a message to the response_url of an interactive payload eg. to
+        replace the message a button was clicked on
+        :param response_url: url from the interactive payload
+        :param timeout: <optional> seconds to wait for Slack to respond
+        :param payload: message eg. text and replace_original
+        :return: dict with ok and, for failed posts, the error. Rate limited
+        posts fail with "ratelimited" and the HTTP response headers, server
+        errors and connection errors with "request_failed" and other
+        responses eg. a 404 for an expired url with "http_<status code>"
+        """
+        payload = {key: value for key, value in payload.items()
+                   if value is not None}
+
+        def send():
+            try:
+                # the url identifies the message so it takes no token
+                response = self.get_session().post(
+                    response_url, json=payload,
+                    headers={"Authorization": None},
+                    timeout=timeout or self.timeout)
+            except requests.RequestException as e:
+                return {"ok": False, "error": "request_failed",
+                        "detail": str(e)}
+            if response.ok:
+                return {"ok": True}
+            if response.status_code == 429:
+                return {"ok": False, "error": "ratelimited",
+                        "headers": response.headers}
+            # server errors are retried. a url that expired or was used up
+            # (404, 410) would keep failing so its error isn't retried
+            error = "request_failed" if response.status_code >= 500 else\
+                f"http_{response.status_code}"
+            return {"ok": False, "error": error, "detail": response.text}
+
+        return self.call("response_url", send)
+
+    def stats(self):
+        """
+        :return: dict of connection pool and latency (in seconds) stats
+        """
+        with self.stats_lock:
+            latencies = list(self.latencies)
+            stats = {
+                "pool_size": self.pool_size,
+                "in_flight": self.in_flight,
+                "calls": self.call_count,
+                "errors": self.error_count,
+            }
+        stats.update(latency_stats(latencies))
+        return stats
@@ -1,6 +1,5 @@
 import os
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import threading
 
 
 # json credentials you downloaded earlier
@@ -10,8 +9,26 @@ CLIENT_SECRET_FILE = HOME_DIR + REL_PATH
 SCOPE = ['https://spreadsheets.google.com/feeds',
          "https://www.googleapis.com/auth/spreadsheets"]
 
-# get email and key from creds
-credentials = ServiceAccountCredentials.from_json_keyfile_name(
-    CLIENT_SECRET_FILE,
-    SCOPE)
-gsheet = gspread.authorize(credentials)  # authenticate with Google
+_gsheet = None
+_gsheet_lock = threading.Lock()
+
+
+def get_gsheet():
+    """
+    Get the gspread client, authenticating with Google on first use so that
+    importing the utils doesn't need credentials or network access
+    """
+    global _gsheet
+    if _gsheet is None:
+        with _gsheet_lock:
+            if _gsheet is None:
+                import gspread
+                from oauth2client.service_account import\
+                    ServiceAccountCredentials
+
+                # get email and key from creds
+                credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                    CLIENT_SECRET_FILE,
+                    SCOPE)
+                _gsheet = gspread.authorize(credentials)
+    return _gsheet
@@ -8,8 +8,8 @@ import logging
 import os
 import sys
 
-# import the gspread instance
-from app.utils import gsheet as gc
+# the gspread instance, authenticated on first use
+from app.utils import get_gsheet
 from app.config import ASSET_SPREADSHEET_KEY
 
 logging.basicConfig(
@@ -21,6 +21,16 @@ HOME_DIR = os.path.dirname(os.path.abspath(__file__))
 EQUIPMENT_FILE = os.path.join(HOME_DIR, "equipment.json")
 
 
+# description column values -> equipment type
+DEVICE_TYPES = {
+    "Training Macbook": "macbooks",
+    "Company Macbook": "macbooks",
+    "Thunderbolt-Ethernet adapter": "thunderbolts",
+    "Macbook Charger": "chargers",
+    "Dongle": "dongles",
+}
+
+
 def get_all_items(sheet):
     """
     Function to return a list of all items in the master sheet
@@ -30,157 +40,95 @@ def get_all_items(sheet):
     :param sheet: The name of the sheet to use e.g 'Andela Asset Tracker'
     """
 
-    # Get and write thunderbolts
     master_inventory_sheet = sheet.worksheet("Master Inventory List")
 
     # get a list of all assets in the andela_sheet
     and_items = master_inventory_sheet.get_all_values()
 
     data = {
-        'macbooks': macbooks(and_items),
-        'thunderbolts': thunderbolts(and_items),
-        'chargers': mac_chargers(and_items),
-        'dongles': dongles(and_items)
+        'macbooks': [],
+        'thunderbolts': [],
+        'chargers': [],
+        'dongles': []
     }
+    for equipment_type, item in classify_items(and_items):
+        data[equipment_type].append(item)
 
-    # create the equipments.json file
-    json_file = open(EQUIPMENT_FILE, "w+")
+    for equipment_type in data:
+        logging.info('Retrieved %s %s', len(data[equipment_type]),
+                     equipment_type)
 
-    # write the data to the equipments .json file
+    # write the data to a temporary file and move it over the equipment.json
+    # file so the running app never reloads a half written file
+    json_file = open(EQUIPMENT_FILE + ".tmp", "w+")
     json_file.write(json.dumps(data))
     json_file.close()
+    os.replace(EQUIPMENT_FILE + ".tmp", EQUIPMENT_FILE)
 
 
-def filter_items(sheet_data, device_type):
+def classify_items(sheet_data):
     """
-    Function to filter and return a list of specific devices
-    Works by filtering the sheet data for all devices with the same
-    description.
+    Generator that reads the sheet data once and yields each device row as
+    an equipment item. A row's type comes from its description column. The
+    column is found by looking for a known description in the first device
+    row and rows are scanned again only if their description isn't there.
     Example:
-        filter_items(andelat_sheet_data, "Thunderbolt-Ethernet adapter")
+        classify_items(andela_sheet_data)
 
-    :param sheet_data: a list of the data in the andela master sheet being
-    checked
-    :param device_type: the device type under the description column
-    :return: a lsi of the data for thunderbolts
+    :param sheet_data: a list of the data in the andela master sheet
+    :return: generator of (equipment type, equipment item) tuples
     """
-
-    filtered_items = []
-
-    for list_item in sheet_data:
-        if device_type in list_item:
-            filtered_items.append(list_item)
-
-    return filtered_items
-
-
-def mac_chargers(and_items):
-    """ return a list of thunderbolts with values: equipment_id, owner_name"""
-
-    # filter_items(and_items, asset_item)
-    logging.info('Retrieving chargers')
-
-    # filter_items(and_items, asset_item)
-    filtered_list = filter_items(and_items, "Macbook Charger")
-    mac_chargers_list = []
-
-    if filtered_list:
-        for item in filtered_list:
-            if not item[2] or not item[9]:
-                continue
-            col = {
-                "equipment_id": item[2].upper(),
-                "owner_name": item[9].strip(),
-            }
-
-            mac_chargers_list.append(col)
-
-    logging.info('Retrieved %s chargers', len(mac_chargers_list))
-    return mac_chargers_list
-
-
-def thunderbolts(and_items):
-    """ return a list of thunderbolts with values: equipment_id, owner_name"""
-
-    # filter and return a list of thunderbolts
-    logging.info('Retrieving thunderbolts')
-
-    # filter_items(and_items, asset_item)
-    filtered_list = filter_items(and_items, "Thunderbolt-Ethernet adapter")
-    thunderbolts_list = []
-
-    if filtered_list:
-
-        for item in filtered_list:
-            if not item[2] or not item[9]:
-                continue
-            col = {
-                "equipment_id": item[2].upper(),
-                "owner_name": item[9].strip(),
-            }
-
-            thunderbolts_list.append(col)
-
-    logging.info('Retrieved %s thunderbolts', len(thunderbolts_list))
-    return thunderbolts_list
-
-
-def macbooks(sheet_data):
-    logging.info('Retrieving Macbooks')
-
-    # Get and dump mackbooks
-    # filter_items(sheet, device_type)
-    items = filter_items(sheet_data, "Training Macbook")
-    items += filter_items(sheet_data, "Company Macbook")
-
-    macbook_list = []
-
-    if items:
-        for item in items:
-            if not item[2] or not item[9]:
+    description_column = None
+
+    for row in sheet_data:
+        equipment_type = None
+        if description_column is not None and description_column < len(row):
+            equipment_type = DEVICE_TYPES.get(row[description_column])
+        if equipment_type is None:
+            for column, cell in enumerate(row):
+                if cell in DEVICE_TYPES:
+                    equipment_type = DEVICE_TYPES[cell]
+                    description_column = column
+                    break
+            else:
                 continue
-            col = {
-                "equipment_id": item[2].upper(),
-                "serial_number": item[6],
-                "owner_name": item[9].strip(),
-                "owner_cohort": item[10].strip()
-            }
-
-            macbook_list.append(col)
 
-    logging.info('Retrieved %s macbooks', len(macbook_list))
-    return macbook_list
+        if not row[2] or not row[9]:
+            continue
+        yield equipment_type, ITEM_BUILDERS[equipment_type](row)
 
 
-def dongles(sheet_data):
-    logging.info('Retrieving Dongles')
-
-    # Get and dump mackbooks
-    # filter_items(sheet, device_type)
-    items = filter_items(sheet_data, "Dongle")
+def build_macbook(item):
+    return {
+        "equipment_id": item[2].upper(),
+        "serial_number": item[6],
+        "owner_name": item[9].strip(),
+        "owner_cohort": item[10].strip()
+    }
 
-    dongle_list = []
 
-    if items:
-        for item in items:
-            if not item[2] or not item[9]:
-                continue
-            col = {
-                "equipment_id": item[2].upper(),
-                "owner_name": item[9].strip(),
-            }
+def build_accessory(item):
+    """ build a thunderbolt, charger or dongle with values: equipment_id,
+    owner_name"""
+    return {
+        "equipment_id": item[2].upper(),
+        "owner_name": item[9].strip(),
+    }
 
-            dongle_list.append(col)
 
-    logging.info('Retrieved %s dongles', len(dongle_list))
-    return dongle_list
+ITEM_BUILDERS = {
+    "macbooks": build_macbook,
+    "thunderbolts": build_accessory,
+    "chargers": build_accessory,
+    "dongles": build_accessory,
+}
 
 
 def main():
     if ASSET_SPREADSHEET_KEY is None:
         print("ASSET_SPREADSHEET_KEY not found in configs. Aborted.")
         sys.exit()
-    sheet = gc.open_by_key(ASSET_SPREADSHEET_KEY)
+    sheet = get_gsheet().open_by_key(ASSET_SPREADSHEET_KEY)
     get_all_items(sheet)
 
 
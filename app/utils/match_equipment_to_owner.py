@@ -6,7 +6,10 @@ database is slack.
 import os
 import json
 import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from app import slack_client
+from app.utils.slack_directory import SlackDirectory, normalize_name
 from fuzzywuzzy import fuzz
 
 logging.basicConfig(
@@ -22,17 +25,127 @@ EQUIPMENT_FILE_PATH = HOME_DIR + "/equipment.json"
 OWNER_DETAILS_CACHE_FILE_PATH = HOME_DIR + "/name_to_owner_details_cache.json"
 
 
-def add_emails_and_slack_id_to_equipment_json(equipment_list, owner_details_cache, people_list):
+class PeopleIndex:
+    """
+    Slack users keyed by their normalized real name and email local-part.
+    Matches the first user in users.list order whose name or email would
+    score 100 with fuzz.token_sort_ratio, in one dict lookup.
+    """
+
+    def __init__(self, people_list):
+        # normalized name -> (position in people_list, person)
+        self.by_name = {}
+        for position, person in enumerate(people_list):
+            if "email" not in person["profile"]:
+                logging.debug(json.dumps(person, indent=4))
+                continue
+            person_name = person["profile"].get("real_name", "")
+            name_from_email = person["profile"]["email"].split("@")[0]
+            for name in [normalize_name(person_name.replace("'", "")),
+                         normalize_name(name_from_email)]:
+                if name:
+                    self.by_name.setdefault(name, (position, person))
+
+    def match(self, owner_name):
+        """
+        :param owner_name: owner name as in the spreadsheet
+        :return: matching slack user or None
+        """
+        match = self.by_name.get(normalize_name(owner_name.replace("'", "")))
+        return match[1] if match else None
+
+
+def _score_candidates(args):
+    """
+    Fuzzy match owner names against candidate names. Runs in a worker
+    process.
+
+    :param args: tuple of list of (owner_name, candidate names) and the
+    minimum score to accept
+    :return: list of (owner_name, best candidate name, score)
+    """
+    owner_candidates, threshold = args
+    matches = []
+    for owner_name, candidates in owner_candidates:
+        normalized_owner_name = normalize_name(owner_name.replace("'", ""))
+        best_score, best_name = 0, None
+        for name in candidates:
+            score = fuzz.token_sort_ratio(normalized_owner_name, name)
+            if score > best_score:
+                best_score, best_name = score, name
+        if best_score >= threshold:
+            matches.append((owner_name, best_name, best_score))
+    return matches
+
+
+def fuzzy_match_owners(owner_names, people_index, threshold, processes=None,
+                       chunk_size=100):
+    """
+    Fuzzy match owner names that had no exact match. An owner name is only
+    compared to the names that share a token with it, and chunks of owner
+    names are scored in parallel in a process pool.
+
+    :param owner_names: owner names to match
+    :param people_index: PeopleIndex of slack users
+    :param threshold: minimum fuzz.token_sort_ratio score to accept a match
+    :param processes: number of worker processes, defaults to the cpu count
+    :param chunk_size: number of owner names sent to a worker at a time
+    :return: dict of owner_name to matching slack user
+    """
+    # token -> normalized names containing it
+    names_by_token = {}
+    for name in people_index.by_name:
+        for token in name.split():
+            names_by_token.setdefault(token, set()).add(name)
+
+    owner_candidates = []
+    for owner_name in owner_names:
+        candidates = set()
+        for token in normalize_name(owner_name.replace("'", "")).split():
+            candidates.update(names_by_token.get(token, ()))
+        if candidates:
+            owner_candidates.append((owner_name, candidates))
+
+    chunks = [(owner_candidates[i:i + chunk_size], threshold)
+              for i in range(0, len(owner_candidates), chunk_size)]
+    owners = {}
+    with ProcessPoolExecutor(processes) as executor:
+        for matches in executor.map(_score_candidates, chunks):
+            for owner_name, name, score in matches:
+                logging.info("%s percent fuzzy match of %s to %s", score,
+                             owner_name, name)
+                owners[owner_name] = people_index.by_name[name][1]
+    return owners
+
+
+def add_emails_and_slack_id_to_equipment_json(equipment_list, owner_details_cache, people_list, people_index=None, fuzzy_threshold=None):
     """
     Add slack_id and email to each equipment item
 
     :param equipment_list: list of equipment eg. list of macbooks
     :param owner_details_cache: cache of names that have been matched to slack details
     :param people_list: list of slack users
+    :param people_index: <optional> PeopleIndex of people_list. built if not given
+    :param fuzzy_threshold: <optional> fuzzy match owners without an exact
+    match and accept matches scoring at least this much
     :return: tuple containing equipment_list and owner_details_cache
     """
     unmatched_equipment_indices = []
     match_count = 0
+    if people_index is None:
+        people_index = PeopleIndex(people_list)
+
+    def add_owner_details(item, person):
+        slack_id = person["id"]
+        email = person["profile"]["email"]
+        item["owner_email"] = email
+        item["owner_slack_id"] = slack_id
+
+        # add to cache
+        owner_details_cache[item["owner_name"]] = {
+            "owner_slack_id": slack_id,
+            "owner_email": email
+        }
 
     for index, item in enumerate(equipment_list):
         if not item["owner_name"]:
@@ -51,40 +164,32 @@ def add_emails_and_slack_id_to_equipment_json(equipment_list, owner_details_cach
                          item["equipment_id"])
             continue
 
-        # check slack user list for slack_id and email
-        logging.debug("Checking slack users.list for owner details.")
-        for person in people_list:
-            if "email" not in person["profile"]:
-                logging.debug(json.dumps(person, indent=4))
-                continue
-            person_name = person["profile"]["real_name"]
-            email = person["profile"]["email"]
-            slack_id = person["id"]
-            name_from_email = email.split("@")[0]
-
-            # run a fuzzy match of email name and slack real name
-            if fuzz.token_sort_ratio(
-                person_name.replace("'", ""),
-                owner_name.replace("'", "")) >= 100\
-                or fuzz.token_sort_ratio(
-                    name_from_email,
-                    owner_name.replace("'", "")) >= 100:
-                logging.info("100 percent match for %s owner details",
-                             item["equipment_id"])
-                item["owner_email"] = email
-                item["owner_slack_id"] = slack_id
-
-                # add to cache
-                owner_details_cache[owner_name] = {
-                    "owner_slack_id": slack_id,
-                    "owner_email": email
-                }
-                match_count += 1
-                break
+        # check slack users for a 100 percent match of slack real name or
+        # email name
+        person = people_index.match(owner_name)
+        if person is not None:
+            logging.info("100 percent match for %s owner details",
+                         item["equipment_id"])
+            add_owner_details(item, person)
+            match_count += 1
+            continue
 
         # if no match was found
-        if "owner_email" not in item:
-            unmatched_equipment_indices.append(index)
+        unmatched_equipment_indices.append(index)
+
+    if fuzzy_threshold is not None and unmatched_equipment_indices:
+        owners = fuzzy_match_owners(
+            {equipment_list[i]["owner_name"]
+             for i in unmatched_equipment_indices},
+            people_index, fuzzy_threshold)
+        for i in unmatched_equipment_indices:
+            person = owners.get(equipment_list[i]["owner_name"])
+            if person is not None:
+                add_owner_details(equipment_list[i], person)
+                match_count += 1
+        unmatched_equipment_indices = [
+            i for i in unmatched_equipment_indices
+            if "owner_email" not in equipment_list[i]]
 
     logging.info("Matched %s equipment items.", match_count)
 
@@ -131,7 +236,7 @@ def add_emails_and_slack_id_to_equipment_json(equipment_list, owner_details_cach
                 break
             for person in people_list:
                 if slack_id == person["id"]:
-                    equipment["owner_email"] = email
+                    equipment["owner_email"] = person["profile"]["email"]
                     equipment["owner_slack_id"] = slack_id
                     owner_details_cache[owner_name] = {
                         "owner_slack_id": slack_id,
@@ -154,12 +259,18 @@ def add_emails_and_slack_id_to_equipment_json(equipment_list, owner_details_cach
 
 
 if __name__ == "__main__":
-    # fetch users list from slack
-    slack_response = slack_client.api_call('users.list')
-    if not slack_response["ok"]:
-        logging.error("Slack raised this error %s", slack_response["error"])
+    parser = argparse.ArgumentParser(
+        description="Add owner slack ids and emails to equipment.json")
+    parser.add_argument("--fuzzy-threshold", type=int,
+                        help="fuzzy match owners without an exact match and "
+                        "accept matches scoring at least this much eg. 90")
+    args = parser.parse_args()
+
+    # sync the local snapshot of the slack users list
+    slack_directory = SlackDirectory(slack_client)
+    slack_directory.sync()
 
-    people_list = slack_response["members"]
+    people_list = slack_directory.people()
     with open(EQUIPMENT_FILE_PATH, "r") as equipment_file:
         equipment_data = json.loads(equipment_file.read())
 
@@ -171,16 +282,20 @@ if __name__ == "__main__":
         else:
             owner_details_cache = {}
 
+    people_index = PeopleIndex(people_list)
     for equipment_type in equipment_data:
         print(equipment_type)
         result = add_emails_and_slack_id_to_equipment_json(
             equipment_data[equipment_type], owner_details_cache,
-            people_list)
+            people_list, people_index, args.fuzzy_threshold)
         equipment_data[equipment_type] = result[0]
         owner_details_cache = result[1]
 
-    with open(EQUIPMENT_FILE_PATH, "w+") as equipment_file:
+    # replace equipment.json in one step so the running app never reloads a
+    # half written file
+    with open(EQUIPMENT_FILE_PATH + ".tmp", "w+") as equipment_file:
         equipment_file.write(json.dumps(equipment_data))
+    os.replace(EQUIPMENT_FILE_PATH + ".tmp", EQUIPMENT_FILE_PATH)
 
     with open(OWNER_DETAILS_CACHE_FILE_PATH, "w+") as owner_details_cache_file:
         owner_details_cache_file.write(json.dumps(owner_details_cache))
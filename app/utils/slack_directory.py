@@ -0,0 +1,238 @@
+"""
+This script keeps a local snapshot of the Slack workspace's users in sync
+with users.list. It pages through the whole directory with cursors, keeps
+the snapshot in slack_users.json and indexes users by id, email and
+normalized name.
+
+users.list has no way to ask for only the users that changed, so a sync
+still reads every page, fetching the next page while the current one is
+merged. Only users whose `updated` timestamp changed are re-indexed and a
+snapshot younger than max_age is used without calling Slack at all.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from fuzzywuzzy import utils
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s"
+)
+
+HOME_DIR = os.path.dirname(os.path.abspath(__file__))
+SLACK_USERS_FILE_PATH = HOME_DIR + "/slack_users.json"
+
+
+def normalize_name(name):
+    """
+    Normalize a name the way fuzz.token_sort_ratio does before comparing, so
+    two names score 100 exactly when their normalized forms are equal.
+    Lowercase, keep only ascii letters and numbers and sort the tokens.
+
+    :param name: person name or email local-part
+    :return: normalized name eg. "doe john" for "John O. Doe"
+    """
+    return " ".join(sorted(utils.full_process(name, force_ascii=True).split()))
+
+
+def compact_member(member):
+    """
+    Keep only the user fields we use
+    :param member: user object from users.list
+    :return: user object with id, updated, deleted, real_name and email
+    """
+    profile = member.get("profile", {})
+    compact = {
+        "id": member["id"],
+        "updated": member.get("updated"),
+        "deleted": member.get("deleted", False),
+        "profile": {"real_name": profile.get("real_name", "")}
+    }
+    if "email" in profile:
+        compact["profile"]["email"] = profile["email"]
+    return compact
+
+
+class SlackDirectory:
+    """
+    Slack users snapshot with indexes by id, lowercased email and normalized
+    real name
+    """
+
+    def __init__(self, client, path=SLACK_USERS_FILE_PATH, page_size=200,
+                 max_age=3600):
+        """
+        :param client: SlackAPIClient to call users.list with
+        :param path: snapshot file
+        :param page_size: users to request per page
+        :param max_age: seconds a snapshot is used for before syncing again
+        """
+        self.client = client
+        self.path = path
+        self.page_size = page_size
+        self.max_age = max_age
+        self.synced_at = 0
+        # id -> user, in users.list order
+        self.by_id = {}
+        self.by_email = {}
+        # normalized real name -> [user id, ...]
+        self.by_name = {}
+
+    def people(self):
+        """
+        :return: list of users in users.list order
+        """
+        return list(self.by_id.values())
+
+    def find_by_email(self, email):
+        user_id = self.by_email.get(email.lower())
+        return self.by_id.get(user_id)
+
+    def find_by_name(self, name):
+        return [self.by_id[user_id]
+                for user_id in self.by_name.get(normalize_name(name), [])]
+
+    def add(self, member):
+        """
+        Add or update a user. An updated user keeps its place in the order.
+        :return: True if the user is new or changed
+        """
+        existing = self.by_id.get(member["id"])
+        if existing is not None:
+            if existing["updated"] == member["updated"] and\
+                    existing["profile"] == member["profile"]:
+                return False
+            self.unindex(existing)
+        self.by_id[member["id"]] = member
+        email = member["profile"].get("email")
+        if email:
+            self.by_email[email.lower()] = member["id"]
+        name = normalize_name(member["profile"]["real_name"])
+        if name:
+            self.by_name.setdefault(name, []).append(member["id"])
+        return True
+
+    def remove(self, user_id):
+        self.unindex(self.by_id.pop(user_id))
+
+    def unindex(self, member):
+        email = member["profile"].get("email")
+        if email and self.by_email.get(email.lower()) == member["id"]:
+            del self.by_email[email.lower()]
+        name = normalize_name(member["profile"]["real_name"])
+        if member["id"] in self.by_name.get(name, []):
+            self.by_name[name].remove(member["id"])
+            if not self.by_name[name]:
+                del self.by_name[name]
+
+    def load(self):
+        """
+        Load the snapshot file if there is one
+        """
+        try:
+            with open(self.path, "r") as snapshot_file:
+                snapshot = json.loads(snapshot_file.read())
+        except (OSError, ValueError):
+            return
+        for member in snapshot["members"]:
+            self.add(member)
+        self.synced_at = snapshot["synced_at"]
+        logging.info("Loaded %s slack users from %s", len(self.by_id),
+                     self.path)
+
+    def save(self):
+        with open(self.path + ".tmp", "w+") as snapshot_file:
+            snapshot_file.write(json.dumps({"synced_at": self.synced_at,
+                                            "members": self.people()}))
+        os.replace(self.path + ".tmp", self.path)
+
+    def fetch_page(self, cursor):
+        """
+        Fetch one page of users.list, waiting out rate limits
+        :return: tuple of the page's users and the next cursor
+        """
+        while True:
+            slack_response = self.client.api_call(
+                "users.list", limit=self.page_size, cursor=cursor or None)
+            if slack_response.get("ok"):
+                break
+            if slack_response.get("error") != "ratelimited":
+                raise RuntimeError("Slack raised this error "
+                                   f"{slack_response.get('error')}")
+            retry_after = float(
+                slack_response["headers"].get("Retry-After", 1))
+            logging.info("users.list rate limited. Retrying in %ss",
+                         retry_after)
+            time.sleep(retry_after)
+        next_cursor = slack_response.get("response_metadata", {})\
+            .get("next_cursor")
+        return slack_response["members"], next_cursor
+
+    def fetch_pages(self):
+        """
+        Generator of users.list pages. The next page is fetched in the
+        background while the caller processes the current one.
+        """
+        page, cursor = self.fetch_page(None)
+        while cursor:
+            result = {}
+
+            def prefetch(cursor=cursor):
+                try:
+                    result["page"] = self.fetch_page(cursor)
+                except Exception as e:
+                    result["error"] = e
+
+            thread = threading.Thread(target=prefetch, daemon=True)
+            thread.start()
+            yield page
+            thread.join()
+            if "error" in result:
+                raise result["error"]
+            page, cursor = result["page"]
+        yield page
+
+    def sync(self, force=False):
+        """
+        Bring the directory up to date with Slack and save the snapshot
+        :param force: sync even if the snapshot is younger than max_age
+        :return: dict of counts of users fetched, changed and removed
+        """
+        if not self.by_id:
+            self.load()
+        if not force and time.time() - self.synced_at < self.max_age:
+            logging.info("Slack users snapshot is fresh. Skipping sync.")
+            return {"fetched": 0, "changed": 0, "removed": 0}
+
+        fetched_ids = set()
+        changed = 0
+        for page in self.fetch_pages():
+            for member in page:
+                member = compact_member(member)
+                fetched_ids.add(member["id"])
+                changed += self.add(member)
+        removed = [user_id for user_id in self.by_id
+                   if user_id not in fetched_ids]
+        for user_id in removed:
+            self.remove(user_id)
+
+        self.synced_at = time.time()
+        self.save()
+        logging.info("Synced %s slack users. %s changed, %s removed.",
+                     len(fetched_ids), changed, len(removed))
+        return {"fetched": len(fetched_ids), "changed": changed,
+                "removed": len(removed)}
+
+
+if __name__ == "__main__":
+    from app import slack_client
+
+    parser = argparse.ArgumentParser(
+        description="Sync the local snapshot of Slack users")
+    parser.add_argument("--force", action="store_true",
+                        help="sync even if the snapshot is fresh")
+    args = parser.parse_args()
+    SlackDirectory(slack_client).sync(force=args.force)
@@ -2,19 +2,51 @@
 This file contains the views for the bot which are really just event handlers
 to different slack event types.
 """
-from flask import request
-from app import slack_events_adapter, slack_client, huey, logger
-from huey import crontab
+from flask import request, make_response
+from app import slack_events_adapter, slack_client, event_pool, logger
 from app.controllers import MessageHandler
-from app.helpers import generate_random_fortune
+from app.helpers import generate_random_fortune,\
+    build_found_equipment_message
+from app.metrics import STAGE_LATENCY, Gauge, MetricsAggregator,\
+    FileMetricsStore, SharedMetricsStore
+from app.config import LOG_EVENT_SAMPLE_RATE, METRICS_DIR,\
+    METRICS_FLUSH_INTERVAL
+from app.logs import sampled
+from app.models import build_equipment_reference,\
+    find_equipment_by_reference, get_dataset_version
+from app.outbound import OutboundMessageQueue, OutboundMessage,\
+    RESPONSE_URL
+from app.shared import KEY_PREFIX, get_backend, is_shared
+from app.workers import EventQueueFull
 from functools import wraps
 import re
 import json
+import logging
 import random
 import time
 
 
 message_handler = MessageHandler()
+outbound_queue = OutboundMessageQueue(slack_client)
+
+Gauge("sakabot_event_queue_depth", "Events waiting for an event worker",
+      lambda: event_pool.stats()["queued"])
+Gauge("sakabot_event_workers_busy", "Event workers handling an event",
+      lambda: event_pool.stats()["running"])
+Gauge("sakabot_outbound_queue_depth", "Replies waiting to be sent to Slack",
+      lambda: outbound_queue.stats()["depth"])
+Gauge("sakabot_slack_api_in_flight", "Slack Web API calls in progress",
+      lambda: slack_client.stats()["in_flight"])
+Gauge("sakabot_query_cache_size", "Search replies in the cache",
+      lambda: message_handler.cache.stats()["size"])
+Gauge("sakabot_equipment_dataset_version", "Version of the equipment data "
+      "in use", get_dataset_version, combine="max")
+
+# add up the metrics of every worker, on every dyno when the state is shared
+metrics_aggregator = MetricsAggregator(
+    SharedMetricsStore(get_backend(), KEY_PREFIX + "metrics")
+    if is_shared() else FileMetricsStore(METRICS_DIR),
+    interval=METRICS_FLUSH_INTERVAL)
 
 
 @slack_events_adapter.on("message")
@@ -22,19 +54,18 @@ def handle_message_event(event_data):
     if not is_valid_message_event(event_data):
         return
 
-    logger.info(f"Handling message event.\n{event_data}")
+    log_event(event_data)
     message = event_data["event"]
 
     response = message_handler.respond_to(message)
     logger.debug(response)
     if response.response_type == "RESPONSE_SEARCH_EQUIPMENT":
-        post_message(message["channel"],
-                     f"{generate_random_fortune()}")
-        time.sleep(0.5)
+        outbound_queue.post_message(message["channel"],
+                                    f"{generate_random_fortune()}")
 
-    logger.info(f"Sending {response.response_type} response to slack.")
-    post_message(message["channel"], response.text,
-                 attachments=response.attachments)
+    log_response(event_data, response)
+    outbound_queue.post_message(message["channel"], response.text,
+                                attachments=response.attachments)
 
 
 @slack_events_adapter.on("app_mention")
@@ -42,86 +73,176 @@ def handle_mention(event_data):
     if not is_valid_message_event(event_data):
         return
 
-    logger.info(f"Handling message event.\n{event_data}")
+    log_event(event_data)
     message = event_data["event"]
 
     # Remove mention from message.
     message["text"] = re.sub(r"^<@.*?>\s?|\s?<@.{0,12}>$", "",
                              message.get("text"))
     response = message_handler.respond_to(message)
-    logger.info(f"Sending {response.response_type} response to slack.")
+    log_response(event_data, response)
 
     if response.response_type in ["RESPONSE_FORTUNE", "RESPONSE_GREETING",
                                   "RESPONSE_HELP"]:
-        post_message(message["channel"], response.text,
-                     attachments=response.attachments)
+        outbound_queue.post_message(message["channel"], response.text,
+                                    attachments=response.attachments)
         return
 
-    post_ephemeral_message(message["channel"], message["user"], response.text,
-                           attachments=response.attachments)
+    outbound_queue.post_ephemeral_message(message["channel"], message["user"],
+                                          response.text,
+                                          attachments=response.attachments)
 
 
 @slack_events_adapter.server.route("/interactive", methods=["POST"])
 def handle_interactive_message():
-    payload = json.loads(request.form["payload"])
+    received_at = time.perf_counter()
+    with STAGE_LATENCY.time("parse"):
+        payload = json.loads(request.form["payload"])
 
     if payload["callback_id"] == "notify_owner":
         # slack owner
         submitter = payload["user"]["id"]
-        equipment = json.loads(payload["actions"][0]["value"])
-        logger.info(f"Handling notify_owner request by "
-                    f"<@{payload['user']['name']}> for "
-                    f"{equipment['equipment_id']}")
-
-        owner = equipment["owner_slack_id"]
-        msg = f"Hi <@{owner}>! <@{submitter}> says they"\
-            f" found your {equipment['type']}."
-        logger.error(f"Attempting to notify owner {equipment['owner_name']} "
-                     "that their equipment was found.")
-
-        slack_response = post_message(owner, msg)
-        if slack_response["ok"]:
-            return f":green_heart: Thanks! We let {equipment['owner_name']} "\
-                f"know you have their {equipment['type']}"
+        equipment_type, equipment = resolve_equipment_reference(
+            payload["actions"][0]["value"])
+        if equipment is None:
+            return ":orange_heart: Oops! I couldn't find that equipment "\
+                "anymore. Try searching for it again."
+        logger.info("Handling notify_owner request by <@%s> for %s",
+                    payload["user"]["name"], equipment["equipment_id"],
+                    extra={"fields": {"user": submitter,
+                                      "equipment_id":
+                                      equipment["equipment_id"]}})
+
+        # slack gives up on the request after 3 seconds so the owner is
+        # messaged in the background and the result sent to the
+        # response_url, which replaces the clicked message
+        response_url = payload.get("response_url")
+        if response_url:
+            try:
+                # the ack promises a result so the job can't be dropped
+                event_pool.submit_or_reject(
+                    notify_owner_in_background, submitter, equipment_type,
+                    equipment, response_url, received_at)
+                STAGE_LATENCY.observe(time.perf_counter() - received_at,
+                                      "interactive_ack")
+                return f":hourglass_flowing_sand: Letting "\
+                    f"{equipment['owner_name']} know you have their "\
+                    f"{equipment_type[:-1]}..."
+            except EventQueueFull:
+                # a failed request leaves the button for another click
+                return make_response("Too many requests. Try again later.",
+                                     503)
+        # slack is waiting on this request so there's no time for retries
+        text = notify_owner(submitter, equipment_type, equipment,
+                            retry=False)
+        STAGE_LATENCY.observe(time.perf_counter() - received_at,
+                              "interactive_ack")
+        return text
     return ":orange_heart: Oops! "\
         "We were unable to send the message. Something went wrong."
 
 
-def post_message(channel, message, attachments=None):
+def notify_owner(submitter, equipment_type, equipment, retry=True):
     """
-    Call Slack API chat.postMessage method
-    :param channel: Channel to post message to
-    :param message: message text to send
-    :param attachments: message attachments
-    :returns: response from slack api see \
-    https://api.slack.com/methods/chat.postMessage
+    Message the owner of equipment that someone found it
+    :param submitter: slack id of the user who found the equipment
+    :param equipment_type: type of equipment eg. dongles
+    :param equipment: equipment object
+    :param retry: <optional> retry rate limited and failed calls. Off when
+    the click is waiting on the result
+    :return: text telling the submitter whether the owner was messaged
     """
-    slack_response = slack_client.api_call("chat.postMessage",
-                                           channel=channel, text=message,
-                                           attachments=attachments,
-                                           as_user=True)
-    if not slack_response["ok"]:
-        logger.error(slack_response)
-    return slack_response
+    owner = equipment["owner_slack_id"]
+    equipment_name = equipment_type[:-1]
+    msg = build_found_equipment_message(owner, submitter,
+                                        [(equipment_type, equipment)])
+    logger.error("Attempting to notify owner %s that their equipment was "
+                 "found.", equipment["owner_name"])
+
+    if retry:
+        slack_response = outbound_queue.send(
+            OutboundMessage("chat.postMessage", owner, msg, as_user=True))
+    else:
+        slack_response = slack_client.api_call(
+            "chat.postMessage", channel=owner, text=msg, as_user=True)
+        if not slack_response["ok"]:
+            logger.error(slack_response)
+    if slack_response["ok"]:
+        return f":green_heart: Thanks! We let {equipment['owner_name']} "\
+            f"know you have their {equipment_name}"
+    return ":orange_heart: Oops! "\
+        "We were unable to send the message. Something went wrong."
 
 
-def post_ephemeral_message(channel, user, message, attachments=None):
+def notify_owner_in_background(submitter, equipment_type, equipment,
+                               response_url, received_at):
     """
-    Call Slack API chat.postEphemeral method
-    :param channel: Channel to post message to
-    :param user: user to send message to
-    :param message: message text to send
-    :param attachments: message attachments
-    :returns: response from slack api see \
-    https://api.slack.com/methods/chat.postEphemeral
+    Notify the owner and replace the clicked message with the result
+    :param response_url: response_url of the interactive payload
+    :param received_at: time.perf_counter() when the click was received
     """
-    slack_response = slack_client.api_call("chat.postEphemeral",
-                                           channel=channel,
-                                           user=user, text=message,
-                                           attachments=attachments)
-    if not slack_response["ok"]:
-        logger.error(slack_response)
-    return slack_response
+    text = notify_owner(submitter, equipment_type, equipment)
+    slack_response = outbound_queue.send(
+        OutboundMessage(RESPONSE_URL, response_url, text,
+                        replace_original=True))
+    if slack_response["ok"]:
+        STAGE_LATENCY.observe(time.perf_counter() - received_at,
+                              "interactive_done")
+
+
+def event_fields(event_data):
+    """
+    :return: dict of the fields of a slack event worth logging. The message
+    text and the rest of the payload are left out.
+    """
+    message = event_data["event"]
+    return {"event_id": event_data.get("event_id"),
+            "event_type": message.get("type"),
+            "channel": message.get("channel"), "user": message.get("user"),
+            "text_length": len(message.get("text") or "")}
+
+
+def log_event(event_data):
+    # skip building the fields when the record would be dropped
+    if logger.isEnabledFor(logging.INFO) and\
+            sampled(LOG_EVENT_SAMPLE_RATE, event_data.get("event_id")):
+        logger.info("Handling %s event.", event_data["event"].get("type"),
+                    extra={"fields": event_fields(event_data)})
+
+
+def log_response(event_data, response):
+    if logger.isEnabledFor(logging.INFO) and\
+            sampled(LOG_EVENT_SAMPLE_RATE, event_data.get("event_id")):
+        logger.info("Sending %s response to slack.", response.response_type,
+                    extra={"fields": {"event_id": event_data.get("event_id"),
+                                      "response_type":
+                                      response.response_type}})
+
+
+def resolve_equipment_reference(value):
+    """
+    Find the equipment a notify_owner button points to
+    :param value: button value. a reference from build_equipment_reference or
+    on buttons sent before those, the equipment object as json
+    :return: tuple of the equipment type and equipment or (None, None) if it
+    can't be found
+    """
+    if value.startswith("{"):
+        try:
+            legacy_equipment = json.loads(value)
+            value = build_equipment_reference(
+                legacy_equipment, legacy_equipment["type"] + "s",
+                get_dataset_version())
+        except (ValueError, KeyError):
+            return None, None
+    return find_equipment_by_reference(value)
+
+
+@slack_events_adapter.server.route("/metrics", methods=["GET"])
+def metrics():
+    response = make_response(metrics_aggregator.render(), 200)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    return response
 
 
 def is_valid_message_event(event_data):
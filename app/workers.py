@@ -0,0 +1,173 @@
+"""
+This file contains the worker pool that handles Slack events in the
+background so the events endpoint can ack Slack right away.
+"""
+from app import logger
+from app.metrics import STAGE_LATENCY
+from collections import deque
+import os
+import threading
+import time
+
+OVERFLOW_POLICIES = ["drop", "shed", "reject"]
+
+
+class EventQueueFull(Exception):
+    """
+    Raised by EventWorkerPool.submit when the queue is full and the overflow
+    policy is reject
+    """
+
+
+class EventWorkerPool:
+    """
+    A fixed number of worker greenlets (threads outside of gevent) taking
+    jobs off a bounded queue. When the queue is full the overflow policy
+    decides what happens to a new job:
+
+        drop    discard the new job
+        shed    discard the oldest queued job to make room for the new one
+        reject  raise EventQueueFull so the caller can tell Slack to retry
+
+    Jobs whose caller has to know whether they run eg. a button click whose
+    ack promises a result are submitted with submit_or_reject. They are
+    rejected when the queue is full whatever the policy and never shed.
+    """
+
+    def __init__(self, workers=16, max_queue=200, overflow_policy="reject"):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy should be one of "
+                             f"{OVERFLOW_POLICIES}")
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.job_queued = threading.Condition(self.lock)
+        self.workers = []
+        self.workers_pid = None
+        self.running = 0
+        self.submitted_count = 0
+        self.completed_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self.rejected_count = 0
+
+    def start(self):
+        """
+        Start the workers. Called on the first submit so each process starts
+        its own workers after it has been forked. A process forked after the
+        workers started has none running, so it starts its own too.
+        """
+        with self.lock:
+            if self.workers_pid == os.getpid():
+                return
+            self.workers = []
+            self.workers_pid = os.getpid()
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self.work, daemon=True,
+                                          name=f"event-worker-{i}")
+                self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) to run on a worker
+        :return: True if the job was queued, False if it was dropped
+        :raises EventQueueFull: if the queue is full and the overflow policy
+        is reject
+        """
+        return self.enqueue(self.overflow_policy, func, args, kwargs)
+
+    def submit_or_reject(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) to run on a worker. The job is never
+        dropped or shed.
+        :return: True
+        :raises EventQueueFull: if the queue is full
+        """
+        return self.enqueue("reject", func, args, kwargs)
+
+    def enqueue(self, overflow_policy, func, args, kwargs):
+        if self.workers_pid != os.getpid():
+            self.start()
+        # only jobs submitted under the shed policy can be shed
+        sheddable = overflow_policy == "shed"
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                if overflow_policy == "reject":
+                    self.rejected_count += 1
+                    raise EventQueueFull(f"{len(self.queue)} events queued")
+                shed = next((index for index, job in enumerate(self.queue)
+                             if job[4]), None) if sheddable else None
+                self.dropped_count += 1
+                if shed is None:
+                    logger.warning("Event queue full. Dropped new event.")
+                    return False
+                del self.queue[shed]
+                logger.warning("Event queue full. Dropped oldest event.")
+            self.queue.append((func, args, kwargs, time.perf_counter(),
+                               sheddable))
+            self.submitted_count += 1
+            self.job_queued.notify()
+        return True
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.job_queued.wait()
+                func, args, kwargs, queued_at, _ = self.queue.popleft()
+                self.running += 1
+            start = time.perf_counter()
+            STAGE_LATENCY.observe(start - queued_at, "queue_wait")
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Event handler failed")
+                failed = True
+            else:
+                failed = False
+            STAGE_LATENCY.observe(time.perf_counter() - start, "handle")
+            with self.lock:
+                self.running -= 1
+                if failed:
+                    self.failed_count += 1
+                else:
+                    self.completed_count += 1
+
+    def stats(self):
+        """
+        :return: dict of queued, running, dropped and other job counts
+        """
+        with self.lock:
+            return {
+                "workers": self.worker_count,
+                "max_queue": self.max_queue,
+                "queued": len(self.queue),
+                "running": self.running,
+                "submitted": self.submitted_count,
+                "completed": self.completed_count,
+                "failed": self.failed_count,
+                "dropped": self.dropped_count,
+                "rejected": self.rejected_count,
+            }
+
+
+def run_in_os_thread(func, *args):
+    """
+    Run func(*args) on a real thread and wait for its result. Under gevent a
+    greenlet doing seconds of CPU bound work (eg. parsing and indexing the
+    equipment data) freezes every other greenlet of the process. Handing it
+    to gevent's native thread pool only blocks the calling greenlet while
+    the others keep serving requests. Without gevent it runs in place.
+    func shouldn't log or use sockets since those are patched for greenlets.
+    :return: what func returns
+    """
+    from gevent import monkey
+    if not monkey.is_module_patched("threading"):
+        return func(*args)
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args)
@@ -0,0 +1,100 @@
+"""
+Benchmark MessageHandler message dispatch: trying each pattern in turn with
+re.compile(...).search against the precompiled MessageDispatcher. Before
+timing it checks that both route a set of messages to the same handlers as
+the patterns did before owners could be found by name, apart from the
+messages that are name searches of the owners in ROUTE_EQUIPMENT.
+
+Usage:
+    $ python -m benchmarks.bench_dispatch --number 100000
+"""
+from app.controllers import MessageHandler
+from app.models import EquipmentSnapshot, swap_snapshot
+import argparse
+import re
+import timeit
+
+MESSAGES = {
+    "hello": "hello",
+    "find-by-id": "find TB/0051",
+    "find-by-owner": "find <@U1234567> thunderbolt",
+    "default": "where do I return the projector I borrowed last week?",
+}
+
+# message -> handler it should reach. None for the handler the patterns
+# routed it to before the owner name search was added
+ROUTES = {
+    "help me find the charger": None,
+    "can you help me find a dongle": None,
+    "get a fortune or find a charger": None,
+    "find my dongle": None,
+    "find TB/0051 AND/DONGLE/123": None,
+    "thanks for finding my mac": None,
+    "retrieve lost dongle": None,
+    "can you find out whose mac this is": None,
+    "i need to get home charger": None,
+    "find john doe charger": "search_equipment_by_owner_name_reply",
+    "find mary o'neil's mac": "search_equipment_by_owner_name_reply",
+    "get jo thunderbolt": "search_equipment_by_owner_name_reply",
+    "search for jane roe charger": "search_equipment_by_owner_name_reply",
+}
+# owners the name searches in ROUTES are for
+ROUTE_EQUIPMENT = {"chargers": [
+    {"equipment_id": f"CHARGER/{i}", "owner_name": name}
+    for i, name in enumerate(["John Doe", "Mary O'Neil", "Jo Bloggs",
+                              "Jane Roe"])]}
+
+
+def sequential_match(responses, text):
+    for pattern in responses:
+        match = re.compile(pattern, re.IGNORECASE).search(text)
+        if match:
+            return responses[pattern], match.groups()
+
+
+def check_routes(message_handler):
+    swap_snapshot(EquipmentSnapshot(ROUTE_EQUIPMENT, None))
+    responses = message_handler.responses
+    name_search = message_handler.search_equipment_by_owner_name_reply
+    old_responses = {pattern: handler
+                     for pattern, handler in responses.items()
+                     if handler != name_search}
+    for text, expected in ROUTES.items():
+        if expected is None:
+            old_match = sequential_match(old_responses, text)
+            expected = old_match[0].__name__ if old_match else None
+        match = message_handler.dispatcher.match(text)
+        handler = match[0].__name__ if match else None
+        assert handler == expected, f"{text!r} went to {handler}, " \
+            f"expected {expected}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    message_handler = MessageHandler()
+    responses = message_handler.responses
+    dispatcher = message_handler.dispatcher
+    check_routes(message_handler)
+
+    def sequential(text):
+        return sequential_match(responses, text)
+
+    for name, text in MESSAGES.items():
+        assert sequential(text) == dispatcher.match(text), name
+        sequential_time = min(timeit.repeat(
+            lambda: sequential(text), number=args.number,
+            repeat=args.repeat)) / args.number
+        dispatcher_time = min(timeit.repeat(
+            lambda: dispatcher.match(text), number=args.number,
+            repeat=args.repeat)) / args.number
+        print(f"{name:<14} sequential {sequential_time * 1e6:>6.2f}us   "
+              f"dispatcher {dispatcher_time * 1e6:>6.2f}us   "
+              f"x{sequential_time / dispatcher_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark loading fortunes in a worker: parsing fortunes.json into dicts
+against memory-mapping the fortune store built by `python -m app.fortunes`.
+
+Each loader runs in a fresh interpreter, like a gunicorn worker would. Memory
+is read from /proc/self/status so this only runs on Linux. RssAnon is memory
+private to the worker, RssFile is page cache that workers share.
+
+Usage:
+    $ python -m benchmarks.bench_fortunes --picks 1000
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+WORKER = """
+import json, random, time
+from app import fortunes
+
+def memory():
+    with open("/proc/self/status") as status:
+        fields = dict(line.split(":", 1) for line in status)
+    return {{key: int(fields[key].split()[0]) for key in ["RssAnon", "RssFile"]}}
+
+before = memory()
+start = time.perf_counter()
+if {loader!r} == "json":
+    store = json.loads(open(fortunes.FORTUNES_JSON_FILE).read())
+    pick = lambda: random.choice(store).get("quote")
+else:
+    store = fortunes.FortuneStore()
+    pick = lambda: random.choice(store)
+load_time = time.perf_counter() - start
+start = time.perf_counter()
+for _ in range({picks}):
+    pick()
+pick_time = (time.perf_counter() - start) / {picks}
+after = memory()
+print(json.dumps({{"load_time": load_time, "pick_time": pick_time,
+                  "anon_kb": after["RssAnon"] - before["RssAnon"],
+                  "file_kb": after["RssFile"] - before["RssFile"]}}))
+"""
+
+
+def run_worker(loader, picks):
+    output = subprocess.check_output(
+        [sys.executable, "-c", WORKER.format(loader=loader, picks=picks)])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--picks", type=int, default=1000)
+    args = parser.parse_args()
+
+    for loader in ["json", "mmap"]:
+        result = run_worker(loader, args.picks)
+        print(f"{loader:<5} load {result['load_time'] * 1e3:>7.2f}ms   "
+              f"pick {result['pick_time'] * 1e6:>5.2f}us   "
+              f"private RSS +{result['anon_kb'] / 1024:>5.1f}MB   "
+              f"shared RSS +{result['file_kb'] / 1024:>5.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
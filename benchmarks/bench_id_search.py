@@ -0,0 +1,80 @@
+"""
+Benchmark equipment id suggestions: the time to build the prefix and trigram
+indexes and the latency of suggesting ids for prefixes of ids and for ids
+with a typo, against scoring every id with fuzz.ratio.
+
+Usage:
+    $ python -m benchmarks.bench_id_search --sizes 10000 100000
+"""
+from app.models import EquipmentIndex, compact_equipment,\
+    normalize_equipment_id
+from benchmarks.data import generate_equipment
+from fuzzywuzzy import fuzz
+import argparse
+import random
+import time
+
+TYPO_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def make_queries(ids, count):
+    queries = {"prefix": [], "typo": []}
+    for _ in range(count):
+        equipment_id = random.choice(ids)
+        queries["prefix"].append(equipment_id[:-random.randint(1, 3)])
+        characters = list(equipment_id)
+        position = random.randrange(len(characters))
+        characters[position] = random.choice(TYPO_CHARACTERS)
+        queries["typo"].append("".join(characters))
+    return queries
+
+
+def latencies(search, queries):
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        results.append(time.perf_counter() - start)
+    results.sort()
+    return results
+
+
+def bench(size, count):
+    equipment = compact_equipment(generate_equipment(size))
+    start = time.perf_counter()
+    index = EquipmentIndex(equipment)
+    build_time = time.perf_counter() - start
+    ids = list(index.by_id)
+    queries = make_queries(ids, count)
+
+    def scan(query):
+        key = normalize_equipment_id(query)
+        return sorted(ids, key=lambda equipment_id: -fuzz.ratio(
+            key, normalize_equipment_id(equipment_id)))[:5]
+
+    print(f"\n{size} items (index build {build_time * 1e3:.1f}ms)")
+    for kind, kind_queries in queries.items():
+        for name, search in [("index", index.id_search.suggest),
+                             ("scan", scan)]:
+            # scoring every id is slow so it gets fewer queries
+            results = latencies(search, kind_queries[:count // 10 or 1]
+                                if name == "scan" else kind_queries)
+            p50 = results[len(results) // 2]
+            p99 = results[int(len(results) * 0.99)]
+            print(f"  {kind:<7} {name:<6} p50 {p50 * 1e3:>8.2f}ms   "
+                  f"p99 {p99 * 1e3:>8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(0)
+    for size in args.sizes:
+        bench(size, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark the per event logging cost in the handler: the old synchronous
+handler logging an f-string of the whole event against the queued json
+pipeline logging selected fields, with and without sampling. Runs under
+gevent like the app. Records are written to a file that can be slowed down
+to simulate a backed up stderr pipe. The slow down blocks the writing thread
+like a real write to a full pipe does, rather than yielding to other
+greenlets.
+
+Usage:
+    $ python -m benchmarks.bench_logging --number 5000 --write-latency 0.0005
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from app.logs import setup_logging, sampled
+from app.views import event_fields
+import argparse
+import logging
+import tempfile
+import time
+
+# the blocking sleep, not gevent's
+blocking_sleep = monkey.get_original("time", "sleep")
+
+EVENT = {
+    "token": "verification-token", "team_id": "T1234567",
+    "api_app_id": "A1234567", "event_id": "Ev1234567", "event_time": 1,
+    "type": "event_callback", "authed_users": ["U7654321"],
+    "event": {"type": "message", "channel": "D1234567", "user": "U1234567",
+              "text": "find TB/0051 AND/DONGLE/123", "ts": "1.000001",
+              "event_ts": "1.000001", "channel_type": "im"},
+}
+
+
+class SlowStream:
+    """
+    File that blocks for write_latency seconds per write
+    """
+
+    def __init__(self, stream, write_latency):
+        self.stream = stream
+        self.write_latency = write_latency
+
+    def write(self, text):
+        if self.write_latency:
+            blocking_sleep(self.write_latency)
+        self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def old_logger(stream):
+    logger = logging.getLogger("bench.old")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] {%(pathname)s:%(lineno)d}\n%(levelname)s - "
+        "%(message)s\n"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def new_logger(name, stream, queue_size):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    handler = setup_logging(logger, logging.INFO, "json", queue_size)
+    # write to the file instead of stderr
+    handler.targets[0].setStream(stream)
+    return logger, handler
+
+
+def run(log, number):
+    start = time.perf_counter()
+    for i in range(number):
+        log(f"Ev{i:08d}")
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--number", type=int, default=5000)
+    parser.add_argument("--write-latency", type=float, default=0,
+                        help="seconds each write to the log file takes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryFile("w") as log_file:
+        stream = SlowStream(log_file, args.write_latency)
+        logger = old_logger(stream)
+        old = run(lambda event_id: logger.info(
+            f"Handling message event.\n{EVENT}"), args.number)
+        print(f"sync f-string of the event   {old * 1e6:>8.2f}us/event")
+
+        for name, sample_rate in [("queued json fields", 1),
+                                  ("queued json, 10% sampled", 0.1)]:
+            logger, handler = new_logger(f"bench.{sample_rate}", stream,
+                                         args.number)
+
+            def log(event_id):
+                if sampled(sample_rate, event_id):
+                    logger.info("Handling %s event.", EVENT["event"]["type"],
+                                extra={"fields": event_fields(EVENT)})
+            new = run(log, args.number)
+            start = time.perf_counter()
+            handler.stop()
+            drained = time.perf_counter() - start
+            print(f"{name:<28} {new * 1e6:>8.2f}us/event   "
+                  f"x{old / new:.1f}   (written in the background in "
+                  f"{drained * 1e3:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark equipment lookups by id, owner slack id and owner name: per-query
+JMESPath scans against the indexes in app.models.
+
+Usage:
+    $ python -m benchmarks.bench_lookups --sizes 10000 50000 100000
+"""
+from app.models import EquipmentIndex, EQUIPMENT_TYPES
+from benchmarks.data import generate_equipment
+import argparse
+import jmespath
+import random
+import timeit
+
+
+def bench(size, queries, repeat):
+    equipment = generate_equipment(size)
+    items = [(equipment_type, item) for equipment_type in EQUIPMENT_TYPES
+             for item in equipment[equipment_type]]
+    sample = random.sample(items, min(queries, len(items)))
+
+    def jmespath_by_id():
+        for equipment_type, item in sample:
+            jmespath.search(
+                f"{equipment_type}[?equipment_id=='{item['equipment_id']}']",
+                equipment)
+
+    def jmespath_by_owner():
+        for equipment_type, item in sample:
+            jmespath.search(
+                f"{equipment_type}[?owner_slack_id=="
+                f"'{item['owner_slack_id']}']", equipment)
+
+    def jmespath_by_name():
+        for equipment_type, item in sample:
+            jmespath.search(
+                f"{equipment_type}[?contains(owner_name, "
+                f"'{item['owner_name']}')]", equipment)
+
+    index_build = min(timeit.repeat(lambda: EquipmentIndex(equipment),
+                                    number=1, repeat=repeat))
+    index = EquipmentIndex(equipment)
+
+    def index_by_id():
+        for equipment_type, item in sample:
+            index.by_id.get(item["equipment_id"], {}).get(equipment_type, [])
+
+    def index_by_owner():
+        for equipment_type, item in sample:
+            index.by_owner.get((item["owner_slack_id"], equipment_type), [])
+
+    def index_by_name():
+        for equipment_type, item in sample:
+            index.owner_name_search.search(item["owner_name"], equipment_type)
+
+    def per_query(func):
+        return min(timeit.repeat(func, number=1, repeat=repeat)) / len(sample)
+
+    print(f"\n{size} items, {len(sample)} queries "
+          f"(index build {index_build * 1e3:.1f}ms)")
+    for name, scan, indexed in [("by id", jmespath_by_id, index_by_id),
+                                ("by owner", jmespath_by_owner,
+                                 index_by_owner),
+                                ("by name", jmespath_by_name,
+                                 index_by_name)]:
+        scan_time, index_time = per_query(scan), per_query(indexed)
+        print(f"  {name:<9} jmespath {scan_time * 1e6:>12.1f}us/query   "
+              f"index {index_time * 1e6:>8.2f}us/query   "
+              f"x{scan_time / index_time:,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 50000, 100000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for size in args.sizes:
+        bench(size, args.queries, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
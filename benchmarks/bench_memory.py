@@ -0,0 +1,60 @@
+"""
+Benchmark the memory the equipment dataset takes in each worker: items kept
+as the dicts json.loads returns against compact EquipmentRecords, with and
+without the lookup indexes. Memory is measured with tracemalloc and reported
+per 100k items.
+
+Usage:
+    $ python -m benchmarks.bench_memory --sizes 10000 100000
+"""
+from app.models import EquipmentSnapshot, compact_equipment
+from benchmarks.data import generate_equipment
+import argparse
+import gc
+import json
+import tracemalloc
+
+
+def measure(build):
+    """
+    :param build: function returning the object to measure
+    :return: bytes allocated by build that are still in use
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench(size):
+    text = json.dumps(generate_equipment(size))
+    results = {
+        "dicts": measure(lambda: json.loads(text)),
+        "records": measure(lambda: compact_equipment(json.loads(text))),
+        "dicts + indexes": measure(
+            lambda: EquipmentSnapshot(json.loads(text), version=1)),
+        "records + indexes": measure(
+            lambda: EquipmentSnapshot(compact_equipment(json.loads(text)),
+                                      version=1)),
+    }
+    print(f"\n{size} items")
+    for name, used in results.items():
+        print(f"  {name:<18} {used / 2 ** 20:>8.1f}MB   "
+              f"{used / size * 100000 / 2 ** 20:>8.1f}MB per 100k items")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        bench(size)
+
+
+if __name__ == "__main__":
+    main()
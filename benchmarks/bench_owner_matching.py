@@ -0,0 +1,111 @@
+"""
+Benchmark matching equipment owner names to Slack users: the old
+fuzz.token_sort_ratio comparison against every user, the PeopleIndex exact
+match and the optional fuzzy tier, on a synthetic directory.
+
+Usage:
+    $ python -m benchmarks.bench_owner_matching --users 10000 --owners 1000
+"""
+from app.utils.match_equipment_to_owner import PeopleIndex,\
+    fuzzy_match_owners
+from fuzzywuzzy import fuzz
+import argparse
+import random
+import time
+
+FIRST_NAMES = ["John", "Jane", "Mary", "Peter", "Ann", "Liam", "Ada", "Grace",
+               "Brian", "Faith", "Kevin", "Mercy", "Dennis", "Joy", "Eric"]
+LAST_NAMES = ["Doe", "Roe", "Smith", "Okafor", "Kamau", "Njoroge", "Wanjiru",
+              "Otieno", "Mwangi", "Achieng", "Adeyemi", "Mensah", "Banda"]
+
+
+def generate_people(count):
+    people = []
+    for i in range(count):
+        first_name = random.choice(FIRST_NAMES)
+        last_name = random.choice(LAST_NAMES)
+        people.append({"id": f"U{i:08d}", "profile": {
+            "real_name": f"{first_name} {last_name} {i}",
+            "email": f"{first_name.lower()}.{last_name.lower()}{i}"
+                     "@example.com"}})
+    return people
+
+
+def generate_owner_names(people, count):
+    """
+    Owner names as they'd appear in the spreadsheet: most are a user's name
+    with tokens reordered, a few have a typo and a few match nobody
+    """
+    owner_names = []
+    for i in range(count):
+        name = random.choice(people)["profile"]["real_name"].split()
+        random.shuffle(name)
+        name = " ".join(name)
+        roll = random.random()
+        if roll < 0.1:
+            position = random.randrange(len(name))
+            name = name[:position] + "x" + name[position + 1:]
+        elif roll < 0.15:
+            name = f"Unknown Person {i}"
+        owner_names.append(name)
+    return owner_names
+
+
+def linear_match(owner_name, people):
+    """
+    The old matching loop
+    """
+    for person in people:
+        person_name = person["profile"]["real_name"]
+        name_from_email = person["profile"]["email"].split("@")[0]
+        if fuzz.token_sort_ratio(
+            person_name.replace("'", ""),
+            owner_name.replace("'", "")) >= 100\
+            or fuzz.token_sort_ratio(
+                name_from_email, owner_name.replace("'", "")) >= 100:
+            return person
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--linear-owners", type=int, default=20,
+                        help="owners to time the old loop on, it is slow")
+    parser.add_argument("--fuzzy-threshold", type=int, default=90)
+    args = parser.parse_args()
+
+    random.seed(0)
+    people = generate_people(args.users)
+    owner_names = generate_owner_names(people, args.owners)
+
+    start = time.perf_counter()
+    for owner_name in owner_names[:args.linear_owners]:
+        linear_match(owner_name, people)
+    linear_time = (time.perf_counter() - start) / args.linear_owners
+
+    start = time.perf_counter()
+    people_index = PeopleIndex(people)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    unmatched = [owner_name for owner_name in owner_names
+                 if people_index.match(owner_name) is None]
+    index_time = (time.perf_counter() - start) / len(owner_names)
+
+    start = time.perf_counter()
+    fuzzy_matches = fuzzy_match_owners(unmatched, people_index,
+                                       args.fuzzy_threshold)
+    fuzzy_time = time.perf_counter() - start
+
+    print(f"{args.users} users, {args.owners} owners")
+    print(f"  linear scan    {linear_time * 1e3:>10.2f}ms/owner")
+    print(f"  index          {index_time * 1e3:>10.4f}ms/owner   "
+          f"(built in {build_time * 1e3:.0f}ms, "
+          f"{len(owner_names) - len(unmatched)} matched)")
+    print(f"  fuzzy tier     {fuzzy_time * 1e3:>10.0f}ms for "
+          f"{len(unmatched)} unmatched owners "
+          f"({len(fuzzy_matches)} matched)")
+
+
+if __name__ == "__main__":
+    main()
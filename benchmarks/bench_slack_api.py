@@ -0,0 +1,86 @@
+"""
+Benchmark Slack API calls from greenlets against a local fake Slack server
+running in another process: a new connection per call (what SlackClient does)
+against the pooled SlackAPIClient.
+
+Usage:
+    $ python -m benchmarks.bench_slack_api --calls 500 --concurrency 20
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from app.slack_api import SlackAPIClient
+from gevent.pool import Pool
+import argparse
+import requests
+import subprocess
+import sys
+import time
+
+FAKE_SLACK_URL = "http://127.0.0.1:{port}/api/"
+
+
+def fake_slack_connections(url):
+    return requests.post(url + "fake.stats").json()["connections"]
+
+
+def run(url, call, calls, concurrency):
+    connections = fake_slack_connections(url)
+    pool = Pool(concurrency)
+    start = time.perf_counter()
+    for i in range(calls):
+        pool.spawn(call, i)
+    pool.join()
+    return time.perf_counter() - start,\
+        fake_slack_connections(url) - connections - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds the fake server waits per call")
+    parser.add_argument("--connect-latency", type=float, default=0.05,
+                        help="seconds the fake server waits per new "
+                        "connection, standing in for a TLS handshake")
+    args = parser.parse_args()
+
+    url = FAKE_SLACK_URL.format(port=args.port)
+    fake_slack = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_slack", "--port",
+        str(args.port), "--latency", str(args.latency), "--connect-latency",
+        str(args.connect_latency)], stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                fake_slack_connections(url)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        client = SlackAPIClient("xoxb-fake", base_url=url,
+                                pool_size=args.pool_size)
+
+        def new_connection_call(i):
+            requests.post(url + "chat.postMessage",
+                          data={"channel": f"C{i}", "text": "hello"}).json()
+
+        def pooled_call(i):
+            client.api_call("chat.postMessage", channel=f"C{i}", text="hello")
+
+        for name, call in [("new connection", new_connection_call),
+                           ("pooled", pooled_call)]:
+            elapsed, connections = run(url, call, args.calls,
+                                       args.concurrency)
+            print(f"{name:<15} {args.calls / elapsed:>8.1f} calls/s   "
+                  f"{connections:>5} connections opened")
+        print(client.stats())
+    finally:
+        fake_slack.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark syncing the Slack user directory from a local fake users.list:
+a cold sync, a sync within max_age that uses the snapshot and a forced
+incremental sync where a few users changed.
+
+Usage:
+    $ python -m benchmarks.bench_slack_directory --users 20000
+"""
+from app.slack_api import SlackAPIClient
+from app.utils.slack_directory import SlackDirectory
+from benchmarks.fake_slack import FakeSlack
+import argparse
+import os
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--changed", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the fake server waits per page")
+    args = parser.parse_args()
+
+    members = [{"id": f"U{i:08d}", "updated": 1, "profile": {
+        "real_name": f"User {i}", "email": f"user{i}@example.com",
+        "image_512": f"https://example.com/{i}.png"}}
+        for i in range(args.users)]
+    fake_slack = FakeSlack(latency=args.latency, members=members).start()
+    client = SlackAPIClient("xoxb-fake", base_url=fake_slack.url)
+    path = os.path.join(tempfile.mkdtemp(), "slack_users.json")
+
+    def timed_sync(name, force=False):
+        start = time.perf_counter()
+        result = SlackDirectory(client, path=path).sync(force=force)
+        print(f"{name:<12} {time.perf_counter() - start:>7.2f}s   {result}")
+
+    timed_sync("cold")
+    timed_sync("fresh")
+    for i in range(0, args.users, max(1, args.users // args.changed)):
+        members[i]["updated"] = 2
+        members[i]["profile"]["real_name"] += " Jr"
+    timed_sync("incremental", force=True)
+    fake_slack.stop()
+
+
+if __name__ == "__main__":
+    main()
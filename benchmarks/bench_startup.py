@@ -0,0 +1,125 @@
+"""
+Benchmark gunicorn startup with and without preload_app: the time until
+every worker has loaded the app and the memory all processes take together,
+for a range of worker counts. Runs gunicorn.conf.py with a synthetic
+equipment dataset. With --collect each worker runs a full garbage collection
+once it's up, as it eventually will while serving requests, which writes to
+the header of every object the collector tracks unless gc.freeze() moved
+them out of its reach.
+
+RSS counts pages shared between processes once per process. PSS splits each
+shared page between the processes sharing it, so summed up it is the memory
+the processes really take. Memory is read from /proc so this only runs on
+Linux.
+
+Usage:
+    $ python -m benchmarks.bench_startup --workers 1 2 4 8 16 --collect
+"""
+from benchmarks.data import write_equipment
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+HOME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the app's config plus a hook recording when each worker has loaded the app
+CONFIG = """
+import gc
+import time
+
+exec(open({config!r}).read())
+app_post_worker_init = post_worker_init
+
+
+def post_worker_init(worker):
+    app_post_worker_init(worker)
+    if {collect!r}:
+        gc.collect()
+    with open({ready_file!r}, "a") as ready_file:
+        ready_file.write(f"{{worker.pid}} {{time.time()}}\\n")
+"""
+
+
+def memory(pid):
+    """
+    :return: tuple of the RSS and PSS of a process in kB
+    """
+    totals = {"Rss": 0, "Pss": 0}
+    path = f"/proc/{pid}/smaps_rollup"
+    if not os.path.exists(path):
+        path = f"/proc/{pid}/smaps"
+    with open(path) as smaps:
+        for line in smaps:
+            key = line.split(":", 1)[0]
+            if key in totals:
+                totals[key] += int(line.split()[1])
+    return totals["Rss"], totals["Pss"]
+
+
+def boot(workers, preload, port, data_dir, collect=False, timeout=120):
+    ready_path = os.path.join(data_dir, "ready")
+    open(ready_path, "w").close()
+    config_path = os.path.join(data_dir, "gunicorn.conf.py")
+    with open(config_path, "w") as config_file:
+        config_file.write(CONFIG.format(
+            config=os.path.join(HOME_DIR, "gunicorn.conf.py"),
+            ready_file=ready_path, collect=collect))
+
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers),
+               PRELOAD_APP="true" if preload else "false", PORT=str(port),
+               LOG_LEVEL="WARNING", EQUIPMENT_RELOAD_INTERVAL="0",
+               EQUIPMENT_FILE=os.path.join(data_dir, "equipment.json"))
+    start = time.time()
+    master = subprocess.Popen(
+        ["gunicorn", "-c", config_path, "run:slack_events_adapter.server"],
+        cwd=HOME_DIR, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            with open(ready_path) as ready_file:
+                ready = [line.split() for line in ready_file if line.strip()]
+            if len(ready) >= workers:
+                break
+            if master.poll() is not None or time.time() - start > timeout:
+                raise RuntimeError("gunicorn failed to start")
+            time.sleep(0.05)
+        boot_time = max(float(ready_time) for _, ready_time in ready) - start
+        # let the workers settle before reading their memory
+        time.sleep(1)
+        pids = [master.pid] + [int(pid) for pid, _ in ready]
+        usage = [memory(pid) for pid in pids]
+    finally:
+        master.terminate()
+        master.wait()
+    return boot_time, sum(rss for rss, _ in usage), sum(pss for _, pss in usage)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument("--equipment", type=int, default=100000,
+                        help="size of the synthetic equipment dataset")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--collect", action="store_true",
+                        help="run a full garbage collection in each worker "
+                        "before reading its memory")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp()
+    write_equipment(os.path.join(data_dir, "equipment.json"), args.equipment)
+    print(f"{args.equipment} equipment items")
+    print(f"{'workers':>7} {'preload':>8} {'boot':>9} {'total RSS':>11} "
+          f"{'total PSS':>11}")
+    for workers in args.workers:
+        for preload in [False, True]:
+            boot_time, rss, pss = boot(workers, preload, args.port,
+                                       data_dir, args.collect)
+            print(f"{workers:>7} {str(preload):>8} {boot_time:>8.2f}s "
+                  f"{rss / 1024:>9.1f}MB {pss / 1024:>9.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
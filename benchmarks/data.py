@@ -0,0 +1,37 @@
+"""
+Synthetic datasets for the benchmarks. Kept free of app imports so a
+benchmark can write them out before the app loads.
+"""
+import json
+
+EQUIPMENT_TYPES = ["dongles", "chargers", "macbooks", "thunderbolts"]
+
+
+def generate_equipment(size):
+    """
+    Generate a synthetic equipment dataset of roughly `size` items spread
+    evenly across the equipment stores. Every owner has three items.
+    :param size: total number of equipment items
+    :return: dict in the same shape as equipment.json
+    """
+    equipment = {equipment_type: [] for equipment_type in EQUIPMENT_TYPES}
+    for i in range(size):
+        equipment_type = EQUIPMENT_TYPES[i % len(EQUIPMENT_TYPES)]
+        item = {
+            "equipment_id": f"{equipment_type[:3].upper()}/{i:06d}",
+            "owner_name": f"Owner {i // 3}",
+            "owner_email": f"owner.{i // 3}@example.com",
+            "owner_slack_id": f"U{i // 3:08d}",
+        }
+        if equipment_type == "macbooks":
+            item["serial_number"] = f"C02{i:09d}"
+            item["owner_cohort"] = f"{i % 30}"
+        equipment[equipment_type].append(item)
+    return equipment
+
+
+def write_equipment(path, size):
+    equipment = generate_equipment(size)
+    with open(path, "w") as equipment_file:
+        equipment_file.write(json.dumps(equipment))
+    return equipment
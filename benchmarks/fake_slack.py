@@ -0,0 +1,171 @@
+"""
+A local fake of the Slack Web API for benchmarks and manual testing. Point
+the app at it by setting SLACK_API_URL to its url.
+
+It answers every method with {"ok": true}, records the calls it receives and
+the number of TCP connections opened, and can simulate call latency,
+connection setup (eg. TLS handshake) latency, rate limiting and a paginated
+users.list. For when it runs in another process, the fake.stats method
+returns the number of calls and connections it has seen and fake.calls
+returns the time, method and channel of every call.
+
+Usage:
+    $ python -m benchmarks.fake_slack --port 8765 --latency 0.05
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlparse
+import argparse
+import json
+import threading
+import time
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.fake_slack.accept_connection()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or "{}")
+        else:
+            params = dict(parse_qsl(body))
+        params.update(parse_qsl(urlparse(self.path).query))
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        status, headers, payload = self.server.fake_slack.handle(method,
+                                                                 params)
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeSlack:
+    """
+    Fake Slack Web API server running on a background thread
+    """
+
+    def __init__(self, port=0, latency=0, connect_latency=0, members=None,
+                 page_size=200):
+        """
+        :param port: port to listen on, 0 picks a free one
+        :param latency: seconds to wait before answering each call
+        :param connect_latency: seconds to wait before serving a new connection
+        :param members: user objects served by users.list
+        :param page_size: default users.list page size
+        """
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.members = members or []
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.calls = []
+        self.connection_count = 0
+        # number of upcoming calls to answer with HTTP 429 and Retry-After
+        self.ratelimited_calls = 0
+        self.retry_after = 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port),
+                                          FakeSlackHandler)
+        self.server.fake_slack = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def accept_connection(self):
+        with self.lock:
+            self.connection_count += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+
+    def ratelimit(self, calls, retry_after=1):
+        """
+        Answer the next `calls` calls with a ratelimited error
+        """
+        with self.lock:
+            self.ratelimited_calls = calls
+            self.retry_after = retry_after
+
+    def handle(self, method, params):
+        """
+        :return: tuple of HTTP status, extra headers and response payload
+        """
+        if method == "fake.stats":
+            return 200, {}, {"ok": True, "calls": len(self.calls),
+                             "connections": self.connection_count}
+        if method == "fake.calls":
+            with self.lock:
+                calls = [(call_time, call_method, call_params.get("channel"))
+                         for call_time, call_method, call_params
+                         in self.calls]
+            return 200, {}, {"ok": True, "calls": calls}
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((time.time(), method, params))
+            if self.ratelimited_calls > 0:
+                self.ratelimited_calls -= 1
+                return 429, {"Retry-After": str(self.retry_after)},\
+                    {"ok": False, "error": "ratelimited"}
+
+        if method == "users.list":
+            return 200, {}, self.users_list(params)
+        if method == "chat.postMessage":
+            return 200, {}, {"ok": True, "channel": params.get("channel"),
+                             "ts": f"{time.time():.6f}"}
+        return 200, {}, {"ok": True}
+
+    def users_list(self, params):
+        start = int(params.get("cursor") or 0)
+        limit = int(params.get("limit") or self.page_size)
+        end = start + limit
+        next_cursor = str(end) if end < len(self.members) else ""
+        return {"ok": True, "members": self.members[start:end],
+                "response_metadata": {"next_cursor": next_cursor}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--connect-latency", type=float, default=0)
+    args = parser.parse_args()
+    fake_slack = FakeSlack(args.port, args.latency, args.connect_latency)
+    print(f"Fake Slack API listening on {fake_slack.url}")
+    fake_slack.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
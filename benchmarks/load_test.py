@@ -0,0 +1,324 @@
+"""
+Load test the events and interactive endpoints. Starts a fake Slack API and
+the app under gunicorn with gunicorn.conf.py (as in the Procfile), replays
+synthetic message, app_mention and interactive notify_owner payloads at a
+given concurrency and reports ack latency, end-to-end reply latency and
+throughput per scenario. End-to-end latency runs from sending a request to
+the last Slack API call made for it: the reply to the event's channel or
+the post to the interactive payload's response_url. Interactive requests
+answered in the HTTP response only show up in the ack latency.
+
+Save a run as a baseline and compare later runs against it to flag
+regressions:
+
+    $ python -m benchmarks.load_test --requests 2000 --concurrency 50 \
+        --save-baseline baseline.json
+    $ python -m benchmarks.load_test --requests 2000 --concurrency 50 \
+        --baseline baseline.json
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from benchmarks.data import write_equipment, EQUIPMENT_TYPES
+from gevent.pool import Pool
+from urllib.parse import urlencode
+import argparse
+import gevent
+import json
+import os
+import random
+import requests
+import subprocess
+import sys
+import tempfile
+import time
+
+VERIFICATION_TOKEN = "load-test-token"
+SCENARIOS = ["message", "app_mention", "interactive"]
+MESSAGE_TEMPLATES = ["find {equipment_id}", "find my {equipment_type}",
+                     "find <@{owner_id}> {equipment_type}", "hello",
+                     "fortune", "help"]
+EQUIPMENT_TYPE_NAMES = {"dongles": "dongle", "chargers": "charger",
+                        "macbooks": "mac", "thunderbolts": "thunderbolt"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def wait_for(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.app_url = f"http://127.0.0.1:{args.app_port}"
+        self.fake_slack_url = f"http://127.0.0.1:{args.slack_port}/api/"
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(
+            pool_maxsize=args.concurrency))
+        self.processes = []
+        # reply key -> (scenario, time the request was sent)
+        self.sent = {}
+        # scenario -> [ack latency, ...]
+        self.ack_latencies = {scenario: [] for scenario in SCENARIOS}
+        self.errors = {scenario: 0 for scenario in SCENARIOS}
+
+    def start(self):
+        data_dir = tempfile.mkdtemp()
+        equipment_file = os.path.join(data_dir, "equipment.json")
+        self.equipment = write_equipment(equipment_file,
+                                         self.args.equipment)
+
+        app_log = open(os.path.join(data_dir, "app.log"), "w")
+        print(f"App log: {app_log.name}")
+        env = dict(os.environ, SLACK_API_URL=self.fake_slack_url,
+                   SLACK_VERIFICATION_TOKEN=VERIFICATION_TOKEN,
+                   EQUIPMENT_FILE=equipment_file,
+                   EQUIPMENT_RELOAD_INTERVAL="0", BOT_TOKEN="xoxb-fake",
+                   ADMIN_SLACK_ID="UADMIN", LOG_LEVEL="WARNING",
+                   WEB_CONCURRENCY=str(self.args.workers),
+                   PORT=str(self.args.app_port))
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "benchmarks.fake_slack", "--port",
+            str(self.args.slack_port), "--latency",
+            str(self.args.slack_latency)], stdout=subprocess.DEVNULL))
+        self.processes.append(subprocess.Popen([
+            "gunicorn", "-c", "gunicorn.conf.py",
+            "run:slack_events_adapter.server"], env=env,
+            stdout=app_log, stderr=subprocess.STDOUT))
+        wait_for(self.fake_slack_url + "fake.stats", self.processes[0])
+        wait_for(self.app_url + "/slack/events", self.processes[1])
+
+        # build button values the way the app does
+        os.environ.update(env)
+        from app.helpers import build_search_equipment_attachment
+        self.build_attachment = build_search_equipment_attachment
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+    def random_equipment(self):
+        equipment_type = random.choice(EQUIPMENT_TYPES)
+        return equipment_type, random.choice(self.equipment[equipment_type])
+
+    def random_text(self):
+        equipment_type, equipment = self.random_equipment()
+        return random.choice(MESSAGE_TEMPLATES).format(
+            equipment_id=equipment["equipment_id"],
+            equipment_type=EQUIPMENT_TYPE_NAMES[equipment_type],
+            owner_id=equipment["owner_slack_id"])
+
+    def event_request(self, scenario, i):
+        channel = f"D{i:08d}" if scenario == "message" else f"C{i:08d}"
+        text = self.random_text()
+        if scenario == "app_mention":
+            text = f"<@UBOT> {text}"
+        payload = {"token": VERIFICATION_TOKEN, "event_id": f"Ev{i:08d}",
+                   "type": "event_callback",
+                   "event": {"type": scenario, "channel": channel,
+                             "user": f"U{i:08d}", "text": text,
+                             "ts": f"{time.time():.6f}"}}
+        return "/slack/events", json.dumps(payload),\
+            {"Content-Type": "application/json"}, channel
+
+    def interactive_request(self, i):
+        equipment_type, equipment = self.random_equipment()
+        attachment = self.build_attachment(dict(equipment), equipment_type,
+                                           add_notify_owner_btn=True)
+        response_key = f"response.{i:08d}"
+        payload = {"type": "interactive_message",
+                   "callback_id": "notify_owner",
+                   "user": {"id": f"U{i:08d}", "name": f"user{i}"},
+                   "actions": attachment["actions"],
+                   "response_url": self.fake_slack_url + response_key}
+        return "/interactive", urlencode({"payload": json.dumps(payload)}),\
+            {"Content-Type": "application/x-www-form-urlencoded"},\
+            response_key
+
+    def send(self, scenario, i):
+        if scenario == "interactive":
+            path, body, headers, reply_key = self.interactive_request(i)
+        else:
+            path, body, headers, reply_key = self.event_request(scenario, i)
+        start = time.time()
+        self.sent[reply_key] = (scenario, start)
+        try:
+            response = self.session.post(self.app_url + path, data=body,
+                                         headers=headers, timeout=10)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            self.ack_latencies[scenario].append(time.time() - start)
+        else:
+            self.errors[scenario] += 1
+
+    def run(self):
+        scenarios = self.args.scenarios
+        pool = Pool(self.args.concurrency)
+        start = time.time()
+        for i in range(self.args.requests):
+            pool.spawn(self.send, scenarios[i % len(scenarios)], i)
+        pool.join()
+        elapsed = time.time() - start
+        replies = self.collect_replies()
+        return self.report(elapsed, replies)
+
+    def collect_replies(self):
+        """
+        Wait until the fake Slack API stops receiving calls and return the
+        time of the last reply for each request
+        """
+        call_count, settled_at = -1, time.time()
+        while time.time() - settled_at < self.args.settle:
+            calls = self.session.post(self.fake_slack_url + "fake.calls")\
+                .json()["calls"]
+            if len(calls) != call_count:
+                call_count, settled_at = len(calls), time.time()
+            gevent.sleep(0.2)
+
+        replies = {}
+        for call_time, method, channel in calls:
+            reply_key = channel if method.startswith("chat.") else method
+            if reply_key in self.sent:
+                replies[reply_key] = max(replies.get(reply_key, 0),
+                                         call_time)
+        return replies
+
+    def report(self, elapsed, replies):
+        reply_latencies = {scenario: [] for scenario in SCENARIOS}
+        for reply_key, reply_time in replies.items():
+            scenario, sent_at = self.sent[reply_key]
+            reply_latencies[scenario].append(reply_time - sent_at)
+
+        results = {"throughput": self.args.requests / elapsed}
+        for scenario in self.args.scenarios:
+            acks, e2e = self.ack_latencies[scenario], reply_latencies[scenario]
+            results[scenario] = {
+                "requests": len(acks) + self.errors[scenario],
+                "errors": self.errors[scenario],
+                "replied": len(e2e),
+                "ack_p50": percentile(acks, 0.5),
+                "ack_p95": percentile(acks, 0.95),
+                "ack_p99": percentile(acks, 0.99),
+                "e2e_p50": percentile(e2e, 0.5),
+                "e2e_p95": percentile(e2e, 0.95),
+                "e2e_p99": percentile(e2e, 0.99),
+            }
+        return results
+
+
+def print_results(results):
+    def ms(value):
+        return "      -" if value is None else f"{value * 1e3:>7.1f}"
+
+    print(f"\nthroughput {results['throughput']:.1f} requests/s")
+    print(f"{'scenario':<12} {'reqs':>6} {'errs':>5} {'replied':>7}  "
+          f"{'ack p50':>7} {'p95':>7} {'p99':>7}  "
+          f"{'e2e p50':>7} {'p95':>7} {'p99':>7}  (ms)")
+    for scenario in SCENARIOS:
+        if scenario not in results:
+            continue
+        result = results[scenario]
+        print(f"{scenario:<12} {result['requests']:>6} {result['errors']:>5} "
+              f"{result['replied']:>7}  {ms(result['ack_p50'])} "
+              f"{ms(result['ack_p95'])} {ms(result['ack_p99'])}  "
+              f"{ms(result['e2e_p50'])} {ms(result['e2e_p95'])} "
+              f"{ms(result['e2e_p99'])}")
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    :return: list of descriptions of metrics more than `tolerance` (a
+    fraction) worse than the baseline
+    """
+    regressions = []
+    if results["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {results['throughput']:.1f} < "
+                           f"baseline {baseline['throughput']:.1f}")
+    for scenario in SCENARIOS:
+        if scenario not in results or scenario not in baseline:
+            continue
+        for metric in ["ack_p50", "ack_p95", "e2e_p50", "e2e_p95"]:
+            value = results[scenario][metric]
+            baseline_value = baseline[scenario][metric]
+            if value is None or baseline_value is None:
+                continue
+            if value > baseline_value * (1 + tolerance):
+                regressions.append(
+                    f"{scenario} {metric} {value * 1e3:.1f}ms > baseline "
+                    f"{baseline_value * 1e3:.1f}ms")
+        if results[scenario]["errors"] > baseline[scenario]["errors"]:
+            regressions.append(f"{scenario} errors "
+                               f"{results[scenario]['errors']} > baseline "
+                               f"{baseline[scenario]['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS,
+                        default=SCENARIOS)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="gunicorn workers")
+    parser.add_argument("--equipment", type=int, default=10000,
+                        help="size of the synthetic equipment dataset")
+    parser.add_argument("--slack-latency", type=float, default=0.05,
+                        help="seconds the fake Slack API waits per call")
+    parser.add_argument("--settle", type=float, default=2,
+                        help="seconds without new Slack calls before "
+                        "replies are counted")
+    parser.add_argument("--app-port", type=int, default=5055)
+    parser.add_argument("--slack-port", type=int, default=8765)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="compare against a saved baseline and exit "
+                        "with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction a metric may be worse than the "
+                        "baseline before it's flagged")
+    args = parser.parse_args()
+
+    random.seed(0)
+    load_test = LoadTest(args)
+    try:
+        load_test.start()
+        results = load_test.run()
+    finally:
+        load_test.stop()
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            baseline_file.write(json.dumps(results, indent=2))
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.loads(baseline_file.read())
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Profile app startup: the time each module takes to import, the time to
+import run.py (what a gunicorn worker or the master with preload_app does)
+and the time each app.warm_up step takes. Run it in a fresh interpreter so
+nothing is imported beforehand.
+
+Usage:
+    $ python -m benchmarks.profile_startup --top 25
+"""
+import argparse
+import builtins
+import sys
+import time
+
+
+class ImportProfiler:
+    """
+    Times every module imported while installed. Cumulative time includes
+    the modules a module imports in turn, self time doesn't.
+    """
+
+    def __init__(self):
+        self.original_import = builtins.__import__
+        # module name -> [cumulative seconds, self seconds]
+        self.timings = {}
+        self.stack = []
+
+    def __enter__(self):
+        builtins.__import__ = self.profiled_import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self.original_import
+
+    def profiled_import(self, name, globals=None, locals=None, fromlist=(),
+                        level=0):
+        if level or name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist,
+                                        level)
+        self.stack.append(0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist,
+                                        level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            timing = self.timings.setdefault(name, [0, 0])
+            timing[0] += elapsed
+            timing[1] += elapsed - children
+
+    def report(self, top):
+        print(f"{'cumulative':>11} {'self':>9}  module")
+        for name, (cumulative, own) in sorted(
+                self.timings.items(), key=lambda item: -item[1][0])[:top]:
+            print(f"{cumulative * 1e3:>9.1f}ms {own * 1e3:>7.1f}ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--top", type=int, default=25,
+                        help="number of slowest imports to show")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ImportProfiler() as profiler:
+        import run  # noqa: F401
+    import_time = time.perf_counter() - start
+
+    from app import warm_up
+    start = time.perf_counter()
+    timings = warm_up()
+    warm_up_time = time.perf_counter() - start
+
+    print(f"import run     {import_time * 1e3:>8.1f}ms")
+    for name, seconds in timings.items():
+        print(f"warm up {name:<10} {seconds * 1e3:>8.1f}ms")
+    print(f"total          {(import_time + warm_up_time) * 1e3:>8.1f}ms\n")
+    profiler.report(args.top)
+
+
+if __name__ == "__main__":
+    main()
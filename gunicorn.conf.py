@@ -0,0 +1,47 @@
+"""
+Gunicorn settings. Used by the Procfile:
+
+    $ gunicorn -c gunicorn.conf.py run:slack_events_adapter.server
+
+With PRELOAD_APP on (the default) the master imports the app, warms it up by
+loading the equipment data and building its indexes once, and then forks the
+workers.
+The workers share those memory pages with the master until they write to
+them. Anything that can't be shared across a fork (the Slack API
+connections, the SQLite dedup connection, the event workers and the
+equipment file watcher) is started by each worker on first use.
+"""
+import gc
+import os
+
+bind = "0.0.0.0:" + os.getenv("PORT", "5000")
+worker_class = "gevent"
+# heroku sets WEB_CONCURRENCY based on the dyno size
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+
+def when_ready(server):
+    """
+    Runs in the master after the app is loaded and before the workers are
+    forked
+    """
+    if not preload_app:
+        return
+    from app import warm_up
+    warm_up()
+    gc.collect()
+    # move everything loaded so far out of the collector's generations so
+    # collections in the workers don't touch, and so copy, the shared pages.
+    # without it the first full collection in each worker copies most of
+    # them. needs python 3.7+, see runtime.txt
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """
+    Runs in each worker after it has loaded the app. Workers forked from a
+    preloaded master are already warm.
+    """
+    from app import warm_up
+    warm_up()
@@ -1,11 +1,37 @@
 from gevent import monkey
 monkey.patch_all()
 
-from app import slack_events_adapter, huey
+from app import slack_events_adapter
 from app import views
+from app.views import metrics_aggregator
+from app.config import EQUIPMENT_RELOAD_INTERVAL
+from app.models import EquipmentFileWatcher, SharedEquipmentSync
+from app.shared import is_shared
 import logging
 
 
+# pick up new equipment.json exports without restarting the workers
+equipment_watcher = EquipmentFileWatcher(interval=EQUIPMENT_RELOAD_INTERVAL)
+# follow the equipment dataset shared by every dyno when there is one
+equipment_sync = SharedEquipmentSync(interval=EQUIPMENT_RELOAD_INTERVAL or 30)
+
+
+@slack_events_adapter.server.before_request
+def start_background_tasks():
+    """
+    Start the watcher, the shared dataset sync and the metrics writer from
+    the first request a process serves rather than on import, so each
+    gunicorn worker runs its own even when the workers are forked from a
+    master that preloaded the app
+    """
+    if EQUIPMENT_RELOAD_INTERVAL > 0:
+        equipment_watcher.start()
+    if is_shared():
+        equipment_sync.start()
+    metrics_aggregator.start()
+
+
 if __name__ == "__main__":
-    huey.start()
+    from app import warm_up
+    warm_up()
     slack_events_adapter.start(port=5000, debug=True)
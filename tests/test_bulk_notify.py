@@ -0,0 +1,144 @@
+"""
+Tests for notifying owners in bulk against the in-memory shared state and a
+checkpoint file in a temp dir.
+
+Usage:
+    $ source .env && python -m unittest discover tests
+"""
+from app import bulk_notify
+from app.bulk_notify import BulkNotifier, NotificationCheckpoint,\
+    SharedNotificationState, acquire_run_lock, release_run_lock, run_key,\
+    item_key, SENDING, SENT, FAILED
+from app.models import EquipmentSnapshot
+from app.shared import LocalBackend
+from unittest import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+def build_snapshot(size):
+    """
+    :return: snapshot of `size` dongles with a different owner each
+    """
+    return EquipmentSnapshot({"dongles": [
+        {"equipment_id": f"AND/DONGLE/{i}", "owner_name": f"Owner {i}",
+         "owner_slack_id": f"U{i:08d}"} for i in range(size)]}, 1)
+
+
+class FakeOutbound:
+    """
+    Stands in for OutboundMessageQueue. Messages to the owners in `failing`
+    fail.
+    """
+
+    def __init__(self, failing=(), delay=0):
+        self.failing = set(failing)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.sent = []
+
+    def send(self, message):
+        time.sleep(self.delay)
+        if message.channel in self.failing:
+            return {"ok": False, "error": "channel_not_found"}
+        with self.lock:
+            self.sent.append(message.channel)
+        return {"ok": True}
+
+
+class BulkNotifyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = build_snapshot(21)
+        self.ids = [f"AND/DONGLE/{i}" for i in range(21)]
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "checkpoint.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def notify(self, checkpoint, ids, outbound=None):
+        outbound = outbound or FakeOutbound()
+        counts = BulkNotifier(outbound, "USUBMITTER", checkpoint,
+                              concurrency=4, rate=1000)\
+            .run(ids, self.snapshot)
+        return outbound, counts
+
+    def test_run_key_ignores_order_and_duplicates(self):
+        self.assertEqual(run_key(["TB/1", "TB/2"]),
+                         run_key(["TB/2", "TB/1", "TB/2"]))
+        self.assertNotEqual(run_key(["TB/1"]), run_key(["TB/1", "TB/2"]))
+
+    def test_checkpoint_claim(self):
+        checkpoint = NotificationCheckpoint(self.path)
+        self.assertEqual(checkpoint.claim(["a", "b"]), ["a", "b"])
+        checkpoint.record(["a"], SENT)
+        checkpoint.record(["b"], FAILED)
+        self.assertEqual(checkpoint.claim(["a", "b", "c"]), ["b", "c"])
+        checkpoint.close()
+
+    def test_shared_state_claim(self):
+        state = SharedNotificationState(LocalBackend())
+        self.assertEqual(state.claim(["a", "b"]), ["a", "b"])
+        self.assertEqual(state.claim(["a", "b"]), [])
+        state.record(["a"], SENT)
+        state.record(["b"], FAILED)
+        self.assertEqual(state.get("a"), SENT)
+        self.assertIsNone(state.get("b"))
+        self.assertEqual(state.claim(["a", "b"]), ["b"])
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = NotificationCheckpoint(self.path)
+        failing = FakeOutbound(failing=["U00000003"])
+        _, counts = self.notify(checkpoint, self.ids[:10], failing)
+        checkpoint.close()
+        self.assertEqual(counts, {"sent": 9, "failed": 1})
+
+        # a run that stopped while sending leaves the item as sending
+        checkpoint = NotificationCheckpoint(self.path)
+        checkpoint.record([item_key("dongles", {
+            "equipment_id": "AND/DONGLE/10",
+            "owner_slack_id": "U00000010"})], SENDING)
+        outbound, counts = self.notify(checkpoint, self.ids[:11])
+        checkpoint.close()
+        self.assertEqual(outbound.sent, ["U00000003"])
+        self.assertEqual(counts, {"sent": 1, "already_sent": 9,
+                                  "unknown": 1})
+
+    def test_overlapping_runs_send_each_item_once(self):
+        state = SharedNotificationState(LocalBackend())
+        first, _ = self.notify(state, self.ids[:20])
+        second, counts = self.notify(state, self.ids)
+        self.assertEqual(len(first.sent), 20)
+        self.assertEqual(second.sent, ["U00000020"])
+        self.assertEqual(counts, {"sent": 1, "already_sent": 20})
+
+    def test_concurrent_runs_send_each_item_once(self):
+        state = SharedNotificationState(LocalBackend())
+        outbound = FakeOutbound(delay=0.001)
+        runs = [threading.Thread(target=self.notify,
+                                 args=(state, self.ids, outbound))
+                for _ in range(3)]
+        for run in runs:
+            run.start()
+        for run in runs:
+            run.join()
+        self.assertEqual(sorted(outbound.sent),
+                         [f"U{i:08d}" for i in range(21)])
+
+    def test_run_lock(self):
+        backend = LocalBackend()
+        with mock.patch.object(bulk_notify, "is_shared", return_value=True),\
+                mock.patch.object(bulk_notify, "get_backend",
+                                  return_value=backend):
+            self.assertTrue(acquire_run_lock(self.ids))
+            self.assertFalse(acquire_run_lock(list(reversed(self.ids))))
+            release_run_lock(self.ids)
+            self.assertTrue(acquire_run_lock(self.ids))
+
+
+if __name__ == "__main__":
+    unittest.main()